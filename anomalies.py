@@ -0,0 +1,104 @@
+"""Spending anomaly detection over per-category expense series.
+
+Each category keeps an exponentially weighted mean/variance of its expense
+amounts (and of its monthly totals). `ewma_update` folds in one observation
+in O(1) and is what `db_utils.add_expense` uses on the insert path;
+`ewma_scan` replays a whole history at once with NumPy for the batch rescan.
+"""
+import math
+from collections import namedtuple
+import numpy as np
+
+ALPHA = 0.1            # EWMA smoothing factor
+Z_THRESHOLD = 3.0      # flag when an observation is this many std devs above the mean
+MIN_OBSERVATIONS = 5   # don't flag until a category has this much history
+
+
+ScanResult = namedtuple(
+    "ScanResult",
+    ["z", "expected", "prior_counts", "group_codes", "means", "variances", "counts"],
+)
+
+
+def zscore(x, mean, var):
+    """Score of `x` against an EWMA mean/variance (0 when there is no spread yet)"""
+    std = math.sqrt(var) if var > 0 else 0.0
+    return (x - mean) / std if std > 0 else 0.0
+
+
+def ewma_update(mean, var, count, x, alpha=ALPHA):
+    """Fold one observation into an EWMA state.
+
+    Returns (mean, var, count, z) where z is the score of `x` against the
+    state *before* it was folded in.
+    """
+    if count == 0:
+        return float(x), 0.0, 1, 0.0
+    z = zscore(x, mean, var)
+    diff = x - mean
+    incr = alpha * diff
+    mean = mean + incr
+    var = (1 - alpha) * (var + diff * incr)
+    return mean, var, count + 1, z
+
+
+def is_anomaly(z, count):
+    """Whether a z-score against a state built from `count` observations is an outlier"""
+    return count >= MIN_OBSERVATIONS and z >= Z_THRESHOLD
+
+
+def ewma_scan(codes, values, alpha=ALPHA):
+    """Vectorized EWMA replay over many series at once.
+
+    `codes` labels the series each value belongs to and `values` must already
+    be in time order within each series. The recurrence is sequential within
+    a series, so the scan steps through positions and updates every series
+    that is that long in one NumPy operation.
+
+    Returns a ScanResult: per-row z-scores, expected values (the mean before
+    the row) and history lengths before each row, plus the final state of
+    every series.
+    """
+    codes = np.asarray(codes)
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    z = np.zeros(n)
+    expected = np.zeros(n)
+    prior_counts = np.zeros(n, dtype=np.int64)
+    if n == 0:
+        empty = np.zeros(0)
+        return ScanResult(z, expected, prior_counts, codes[:0], empty, empty,
+                          np.zeros(0, dtype=np.int64))
+
+    order = np.lexsort((np.arange(n), codes))
+    sorted_codes = codes[order]
+    starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+    lengths = np.diff(np.r_[starts, n])
+    prior_counts[order] = np.arange(n) - np.repeat(starts, lengths)
+
+    means = np.zeros(len(starts))
+    variances = np.zeros(len(starts))
+    for step in range(int(lengths.max())):
+        active = np.flatnonzero(lengths > step)
+        idx = order[starts[active] + step]
+        x = values[idx]
+        if step == 0:
+            means[active] = x
+            expected[idx] = x
+            continue
+        m = means[active]
+        v = variances[active]
+        expected[idx] = m
+        std = np.sqrt(v)
+        z[idx] = np.divide(x - m, std, out=np.zeros_like(x), where=std > 0)
+        diff = x - m
+        incr = alpha * diff
+        means[active] = m + incr
+        variances[active] = (1 - alpha) * (v + diff * incr)
+
+    return ScanResult(z, expected, prior_counts, sorted_codes[starts], means, variances, lengths)
+
+
+def flag_mask(z, prior_counts):
+    """Vectorized `is_anomaly`"""
+    return (prior_counts >= MIN_OBSERVATIONS) & (z >= Z_THRESHOLD)
@@ -0,0 +1,254 @@
+"""JSON API over db_utils, for scripts, mobile shortcuts and webhooks.
+
+Run with:
+    uvicorn api:app --host 0.0.0.0 --port 8000
+
+Requests use the `ledger` query parameter or `X-Ledger` header to pick a
+ledger (default: the default ledger). If API_TOKEN is set, every request
+needs `Authorization: Bearer <token>`.
+
+GET responses carry an ETag built from the ledger's data versions, so a
+client sending it back in If-None-Match gets 304 Not Modified without the
+payload being loaded at all.
+
+    GET    /expenses?month=&category=   list expenses
+    POST   /expenses                    add one expense
+    POST   /expenses/bulk               add a list of expenses in one INSERT
+    GET    /expenses/{id}
+    DELETE /expenses/{id}
+    GET    /balances                    list monthly balances
+    GET    /balances/{month}
+    PUT    /balances/{month}            {"prev_balance", "this_month"}
+    GET    /summary                     per-month totals
+    GET    /months/{month}?as_of=       a month's balance and expenses at a past time
+"""
+import datetime
+import hashlib
+import hmac
+import math
+import os
+import re
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+import db_utils
+
+API_TOKEN = os.getenv("API_TOKEN")
+MAX_BULK_ROWS = 10000
+MONTH = re.compile(r"^\d{4}-\d{2}$")
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _ledger_of(request):
+    """The request's ledger, made the current ledger of the request as well: the
+    threadpool calls run in a copy of its context, and with LEDGER_RLS=1 the
+    sessions they open are scoped to the current ledger"""
+    ledger_id = request.query_params.get("ledger") or request.headers.get("x-ledger") or db_utils.DEFAULT_LEDGER
+    db_utils.set_current_ledger(ledger_id)
+    return ledger_id
+
+
+def _expense_json(e):
+    return {"id": e.id, "date": e.date.isoformat(), "month": e.month,
+            "category": e.category, "tag": e.tag, "amount": e.amount}
+
+
+def _balance_json(b):
+    return {"month": b.month, "prev_balance": b.prev_balance,
+            "this_month": b.this_month, "total_balance": b.total_balance}
+
+
+def _month(value):
+    """A YYYY-MM month; other strings would sort among the months and break the summary"""
+    if not isinstance(value, str) or not MONTH.match(value):
+        raise BadRequest(f"month must be YYYY-MM, got {value!r}")
+    return value
+
+
+def _number(body, field):
+    """A finite number from the request body (NaN and infinities are rejected)"""
+    try:
+        value = float(body[field])
+    except KeyError:
+        raise BadRequest(f"missing field: {field}")
+    except (TypeError, ValueError) as e:
+        raise BadRequest(str(e))
+    if not math.isfinite(value):
+        raise BadRequest(f"{field} must be a finite number")
+    return value
+
+
+def _parse_expense(body):
+    """Validate one expense from a request body into add_expenses_batch's row format"""
+    if not isinstance(body, dict):
+        raise BadRequest("expense must be an object")
+    try:
+        date = datetime.date.fromisoformat(body["date"])
+        category = body["category"]
+    except KeyError as e:
+        raise BadRequest(f"missing field: {e.args[0]}")
+    except (TypeError, ValueError) as e:
+        raise BadRequest(str(e))
+    amount = _number(body, "amount")
+    if not isinstance(category, str) or not category:
+        raise BadRequest("category must be a non-empty string")
+    month = date.strftime("%Y-%m")
+    if body.get("month") and _month(body["month"]) != month:
+        raise BadRequest(f"month {body['month']} doesn't match the date {date.isoformat()}")
+    return {"date": date, "month": month, "category": category, "tag": body.get("tag") or "", "amount": amount}
+
+
+def _etag(ledger_id, prefix, extra=""):
+    """Weak ETag over the ledger's data versions under prefix (plus queued rows)"""
+    versions = db_utils.get_data_versions(prefix, ledger_id=ledger_id)
+    pending = len(db_utils._pending_expenses(ledger_id)) if prefix != "balances" else 0
+    state = f"{ledger_id}|{sorted(versions.items())}|{pending}|{extra}"
+    return 'W/"' + hashlib.sha1(state.encode()).hexdigest()[:20] + '"'
+
+
+async def _conditional(request, prefix, load, extra=""):
+    """JSON response for load(), or 304 if the client's ETag is still current"""
+    ledger_id = _ledger_of(request)
+    etag = await run_in_threadpool(_etag, ledger_id, prefix, extra)
+    if etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers={"ETag": etag, "Vary": "X-Ledger"})
+    payload = await run_in_threadpool(load, ledger_id)
+    if payload is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return JSONResponse(payload, headers={"ETag": etag, "Vary": "X-Ledger", "Cache-Control": "no-cache"})
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        raise BadRequest("invalid JSON body")
+
+
+async def list_expenses(request):
+    month = request.query_params.get("month")
+    category = request.query_params.get("category")
+    return await _conditional(request, f"expenses:{category}" if category else "expenses:",
+                              lambda ledger_id: [_expense_json(e) for e in db_utils.get_expenses_by_category(
+                                  category, month, ledger_id=ledger_id)])
+
+
+async def add_expense(request):
+    row = _parse_expense(await _json_body(request))
+    warning = await run_in_threadpool(db_utils.add_expense, row["date"], row["month"], row["category"],
+                                      row["tag"], row["amount"], ledger_id=_ledger_of(request))
+    # Queued (write-behind) expenses have no id yet
+    status = 202 if db_utils.write_queue else 201
+    return JSONResponse({"budget_warning": warning}, status_code=status)
+
+
+async def add_expenses_bulk(request):
+    body = await _json_body(request)
+    if not isinstance(body, list):
+        raise BadRequest("expected a list of expenses")
+    if len(body) > MAX_BULK_ROWS:
+        raise BadRequest(f"at most {MAX_BULK_ROWS} expenses per request")
+    rows = [_parse_expense(item) for item in body]
+    ids = await run_in_threadpool(db_utils.add_expenses_batch, rows, ledger_id=_ledger_of(request))
+    return JSONResponse({"ids": ids}, status_code=201)
+
+
+async def get_expense(request):
+    expense_id = request.path_params["expense_id"]
+    expense = await run_in_threadpool(db_utils.get_expense_by_id, expense_id, ledger_id=_ledger_of(request))
+    if expense is None:
+        return JSONResponse({"error": "not found"}, status_code=404)
+    return JSONResponse(_expense_json(expense))
+
+
+async def delete_expense(request):
+    expense_id = request.path_params["expense_id"]
+    deleted = await run_in_threadpool(db_utils.delete_expense, expense_id, ledger_id=_ledger_of(request))
+    return Response(status_code=204) if deleted else JSONResponse({"error": "not found"}, status_code=404)
+
+
+async def list_balances(request):
+    return await _conditional(request, "balances", lambda ledger_id: [
+        _balance_json(b) for b in db_utils.list_balances(ledger_id=ledger_id)])
+
+
+async def get_balance(request):
+    month = request.path_params["month"]
+    def load(ledger_id):
+        bal = db_utils.get_balance(month, ledger_id=ledger_id)
+        return _balance_json(bal) if bal else None
+    return await _conditional(request, "balances", load)
+
+
+async def put_balance(request):
+    month = _month(request.path_params["month"])
+    body = await _json_body(request)
+    if not isinstance(body, dict):
+        raise BadRequest("balance must be an object")
+    prev_balance = _number(body, "prev_balance")
+    this_month = _number(body, "this_month")
+    await run_in_threadpool(db_utils.add_balance, month, prev_balance, this_month,
+                            ledger_id=_ledger_of(request))
+    return Response(status_code=204)
+
+
+async def summary(request):
+    # Projections also depend on today's date
+    return await _conditional(request, "", lambda ledger_id: db_utils.get_monthly_summary(ledger_id=ledger_id),
+                              extra=str(datetime.date.today()))
+
+
+async def month_as_of(request):
+    try:
+        as_of = datetime.datetime.fromisoformat(request.query_params["as_of"])
+    except KeyError:
+        raise BadRequest("missing parameter: as_of")
+    except ValueError as e:
+        raise BadRequest(str(e))
+    if as_of.tzinfo:
+        # The change log stores local server time
+        as_of = as_of.astimezone().replace(tzinfo=None)
+    state = await run_in_threadpool(db_utils.get_month_as_of, request.path_params["month"], as_of,
+                                    ledger_id=_ledger_of(request))
+    return JSONResponse(dict(state, as_of=as_of.isoformat()))
+
+
+async def _bad_request(request, exc):
+    return JSONResponse({"error": str(exc)}, status_code=400)
+
+
+class _TokenAuth:
+    """Reject requests without the configured bearer token"""
+    def __init__(self, app, token):
+        self.app = app
+        self.expected = f"Bearer {token}".encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            supplied = dict(scope["headers"]).get(b"authorization", b"")
+            if not hmac.compare_digest(supplied, self.expected):
+                await JSONResponse({"error": "unauthorized"}, status_code=401)(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+
+routes = [
+    Route("/expenses", list_expenses, methods=["GET"]),
+    Route("/expenses", add_expense, methods=["POST"]),
+    Route("/expenses/bulk", add_expenses_bulk, methods=["POST"]),
+    Route("/expenses/{expense_id:int}", get_expense, methods=["GET"]),
+    Route("/expenses/{expense_id:int}", delete_expense, methods=["DELETE"]),
+    Route("/balances", list_balances, methods=["GET"]),
+    Route("/balances/{month}", get_balance, methods=["GET"]),
+    Route("/balances/{month}", put_balance, methods=["PUT"]),
+    Route("/summary", summary, methods=["GET"]),
+    Route("/months/{month}", month_as_of, methods=["GET"]),
+]
+
+app = Starlette(routes=routes, exception_handlers={BadRequest: _bad_request})
+if API_TOKEN:
+    app = _TokenAuth(app, API_TOKEN)
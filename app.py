@@ -1,5 +1,6 @@
 import streamlit as st
 import datetime
+import change_feed
 
 categories = [
     "harshala", "rani", "yoga", "Outside food", "groceries", "fruits", "vegetables",
@@ -10,12 +11,49 @@ categories = [
 
 page = st.sidebar.radio(
     "📌 Navigate", 
-    ["💵 Add Monthly Balance", "📊 Balance Overview", "📝 Add Expenses", "📈 Analysis", "📚 Historical View"]
+    ["💵 Add Monthly Balance", "📊 Balance Overview", "📝 Add Expenses", "🔁 Recurring Expenses", "🏷️ Auto-Categorize", "📈 Analysis", "📚 Historical View"]
 )
 
+from db_utils import materialize_recurring, set_current_ledger, DEFAULT_LEDGER
+
+# Each browser session works on one ledger (household); ?ledger=<id> in the URL picks it
+if "ledger_id" not in st.session_state:
+    st.session_state["ledger_id"] = st.query_params.get("ledger", DEFAULT_LEDGER)
+ledger_id = st.sidebar.text_input("🏠 Ledger", key="ledger_id")
+st.query_params["ledger"] = ledger_id
+set_current_ledger(ledger_id)
+
+@st.cache_resource
+def materialize_recurring_once(day):
+    """Create due recurring expenses once per server process and day, not on every rerun"""
+    return materialize_recurring(day)
+
+materialize_recurring_once(datetime.date.today())
+
+# How often each session checks whether another session changed what it shows
+LIVE_REFRESH_SECONDS = 3
+
+@st.fragment(run_every=LIVE_REFRESH_SECONDS)
+def live_refresh(ledger_id):
+    """Rerun the page once data it shows was changed elsewhere (no DB access, just counters)"""
+    # Read on every tick: a page fragment can change its months without a full rerun
+    if change_feed.changed_since(ledger_id, st.session_state["changes_seen"], st.session_state["watched_months"]):
+        st.rerun()
+
+# Pages that only show a few months list them here; None means the whole ledger
+st.session_state["watched_months"] = None
+# Writes that don't rerun the page (it already shows them) run inside
+# change_feed.own_changes on this snapshot, so they don't trigger a refresh either
+st.session_state["changes_seen"] = change_feed.snapshot(ledger_id)
+
+# Pages are split into st.fragment units: a widget inside one reruns only that unit,
+# and actions that change what other units show call st.rerun() for the whole page.
+# A fragment rerun doesn't run this script, so each fragment sets the ledger again.
 from pages.add_balance import add_balance_page
 from pages.balance_overview import balance_overview_page
 from pages.add_expenses import add_expenses_page
+from pages.recurring_expenses import recurring_expenses_page
+from pages.categorize import categorize_page
 from pages.analysis import analysis_page
 from pages.historical_view import historical_view_page
 
@@ -25,7 +63,13 @@ elif page == "📊 Balance Overview":
     balance_overview_page()
 elif page == "📝 Add Expenses":
     add_expenses_page(categories)
+elif page == "🔁 Recurring Expenses":
+    recurring_expenses_page(categories)
+elif page == "🏷️ Auto-Categorize":
+    categorize_page(categories)
 elif page == "📈 Analysis":
     analysis_page()
 elif page == "📚 Historical View":
-    historical_view_page()
\ No newline at end of file
+    historical_view_page()
+
+live_refresh(ledger_id)
\ No newline at end of file
@@ -0,0 +1,334 @@
+"""Parquet snapshots of a ledger's balances and expenses, and fast restore.
+
+`snapshot` writes a full snapshot (every live expense and balance) or a
+delta since the previous one: expenses with ids past its expense id
+watermark, plus the expense deletes and balance writes logged in change_log
+past its log id watermark. Files are zstd-compressed Parquet in
+<backup dir>/<ledger>/<snapshot name>/, listed in the ledger's manifest.json.
+A full snapshot is taken when there is none yet or FULL_EVERY deltas have
+followed the last one, so restores replay a short chain.
+
+`restore` replays the last full snapshot and the deltas after it (or up to a
+given snapshot) into a ledger, replacing its balances and expenses. Rows are
+bulk loaded (COPY on Postgres); when they outnumber the rows already in the
+table, the expense indexes are dropped first and rebuilt once at the end.
+Rollups, data versions and history snapshots of the ledger are rebuilt, and
+its spending stats rescanned unless --skip-rescan. Restoring into another
+ledger (--to-ledger) clones it with fresh uids.
+
+Command line:
+    python backup.py snapshot [--ledger L | --all] [--full]
+    python backup.py restore [--ledger L] [--to-ledger L2] [--through NAME] [--skip-rescan]
+    python backup.py list [--ledger L]
+--dir picks the backup directory (default: BACKUP_DIR or ./backups).
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from sqlalchemy import delete, func, insert, select, text
+import change_feed
+import db_utils as db
+
+FULL_EVERY = 7
+CHUNK_ROWS = 100_000
+COPY_ROWS = 500_000
+
+EXPENSE_SCHEMA = pa.schema([("id", pa.int64()), ("uid", pa.string()), ("date", pa.date32()), ("month", pa.string()),
+                            ("category", pa.string()), ("tag", pa.string()), ("amount", pa.float64()),
+                            ("rule_id", pa.int64()), ("period", pa.string())])
+BALANCE_SCHEMA = pa.schema([("month", pa.string()), ("prev_balance", pa.float64()), ("this_month", pa.float64()),
+                            ("total_balance", pa.float64()), ("updated_at", pa.timestamp("us"))])
+DELETED_SCHEMA = pa.schema([("uid", pa.string())])
+
+_EXPENSE_COLUMNS = [getattr(db.Expense, f.name) for f in EXPENSE_SCHEMA]
+_BALANCE_COLUMNS = [getattr(db.Balance, f.name) for f in BALANCE_SCHEMA]
+_HEX = np.array([f"{i:02x}" for i in range(256)], dtype="S2")
+
+
+def snapshot(ledger_id, backup_dir, full=False):
+    """Write a full or delta snapshot of a ledger; returns its manifest entry"""
+    ledger_dir = os.path.join(backup_dir, ledger_id)
+    manifest = _load_manifest(ledger_dir)
+    chain = _chain(manifest["snapshots"])
+    start = time.perf_counter()
+    taken_at = datetime.datetime.now()
+    # One transaction, so the watermarks and the rows agree (on Postgres; SQLite reads are snapshots under WAL)
+    options = {"isolation_level": "REPEATABLE READ"} if db.engine.dialect.name == "postgresql" else {}
+    with db.engine.connect().execution_options(**options) as conn, conn.begin():
+        _set_ledger(conn, ledger_id)
+        expense_mark = conn.execute(select(func.max(db.Expense.id)).where(db.Expense.ledger_id == ledger_id)).scalar() or 0
+        log_mark = conn.execute(select(func.max(db.ChangeLog.id))).scalar() or 0
+        prev = chain[-1] if chain else None
+        # After a restore ids can go backwards; start a new chain then
+        full = full or prev is None or len(chain) > FULL_EVERY or \
+            expense_mark < prev["expense_id"] or log_mark < prev["log_id"]
+        name = f"{len(manifest['snapshots']) + 1:05d}-{taken_at:%Y%m%dT%H%M%S}-{'full' if full else 'delta'}"
+        path = os.path.join(ledger_dir, name)
+        os.makedirs(path)
+
+        expenses = select(*_EXPENSE_COLUMNS).where(db.Expense.ledger_id == ledger_id, db.Expense.deleted_at.is_(None),
+                                                   db.Expense.id <= expense_mark).order_by(db.Expense.id)
+        balances = select(*_BALANCE_COLUMNS).where(db.Balance.ledger_id == ledger_id).order_by(db.Balance.month)
+        deleted = []
+        if not full:
+            logged = select(db.ChangeLog.row_id).where(
+                db.ChangeLog.ledger_id == ledger_id, db.ChangeLog.id > prev["log_id"], db.ChangeLog.id <= log_mark)
+            expenses = expenses.where(db.Expense.id > prev["expense_id"])
+            balances = balances.where(db.Balance.id.in_(logged.where(db.ChangeLog.table_name == "balances")))
+            deleted = conn.execute(select(db.Expense.uid).where(db.Expense.id.in_(
+                logged.where(db.ChangeLog.table_name == "expenses", db.ChangeLog.op == "delete")))).scalars().all()
+            pq.write_table(pa.table({"uid": deleted}, schema=DELETED_SCHEMA), os.path.join(path, "deleted.parquet"),
+                           compression="zstd")
+        n_expenses = _write_expenses(conn, expenses, os.path.join(path, "expenses.parquet"))
+        rows = [dict(r._mapping) for r in conn.execute(balances)]
+        pq.write_table(pa.Table.from_pylist(rows, schema=BALANCE_SCHEMA), os.path.join(path, "balances.parquet"),
+                       compression="zstd")
+
+    entry = {"name": name, "kind": "full" if full else "delta", "taken_at": taken_at.isoformat(),
+             "expense_id": expense_mark, "log_id": log_mark, "expenses": n_expenses, "balances": len(rows),
+             "deleted": len(deleted), "bytes": sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))}
+    manifest["snapshots"].append(entry)
+    _save_manifest(ledger_dir, manifest)
+    _report(f"snapshot {entry['kind']}", n_expenses + len(rows) + len(deleted), start)
+    return entry
+
+
+def restore(ledger_id, backup_dir, to_ledger=None, through=None, rescan=True):
+    """Replace to_ledger's (default: ledger_id's) balances and expenses with a snapshot chain
+    of ledger_id, ending at snapshot `through` (default: the latest); returns the expense count"""
+    to_ledger = to_ledger or ledger_id
+    ledger_dir = os.path.join(backup_dir, ledger_id)
+    snapshots = _load_manifest(ledger_dir)["snapshots"]
+    if through:
+        names = [s["name"] for s in snapshots]
+        if through not in names:
+            raise SystemExit(f"No snapshot named {through} in {ledger_dir}")
+        snapshots = snapshots[:names.index(through) + 1]
+    chain = _chain(snapshots)
+    if not chain:
+        raise SystemExit(f"No full snapshot of ledger {ledger_id} in {ledger_dir}")
+
+    start = time.perf_counter()
+    expenses, balances = _replay(ledger_dir, chain)
+    _report(f"read {len(chain)} snapshot(s)", expenses.num_rows + balances.num_rows, start)
+    expenses = _load(to_ledger, expenses, balances, same_ledger=to_ledger == ledger_id)
+
+    start = time.perf_counter()
+    db.rebuild_rollups(ledger_id=to_ledger)
+    _report("rebuild rollups", expenses.num_rows, start)
+    start = time.perf_counter()
+    _snapshot_history(to_ledger, expenses, balances)
+    _report("history snapshots", expenses.num_rows, start)
+    if rescan:
+        start = time.perf_counter()
+        db.rescan_anomalies(ledger_id=to_ledger)
+        _report("spending stats rescan", expenses.num_rows, start)
+    return expenses.num_rows
+
+
+def _replay(ledger_dir, chain):
+    """Expenses and balances as of the end of a full snapshot + deltas chain"""
+    full = os.path.join(ledger_dir, chain[0]["name"])
+    parts = [pq.read_table(os.path.join(full, "expenses.parquet"))]
+    balances = {b["month"]: b for b in pq.read_table(os.path.join(full, "balances.parquet")).to_pylist()}
+    for entry in chain[1:]:
+        path = os.path.join(ledger_dir, entry["name"])
+        deleted = pq.read_table(os.path.join(path, "deleted.parquet")).column("uid")
+        if len(deleted):
+            parts = [t.filter(pc.invert(pc.is_in(t["uid"], value_set=deleted.combine_chunks()))) for t in parts]
+        parts.append(pq.read_table(os.path.join(path, "expenses.parquet")))
+        balances.update((b["month"], b) for b in pq.read_table(os.path.join(path, "balances.parquet")).to_pylist())
+    expenses = pa.concat_tables(parts).sort_by("id")
+    return expenses, pa.Table.from_pylist([balances[m] for m in sorted(balances)], schema=BALANCE_SCHEMA)
+
+
+def _load(ledger_id, expenses, balances, same_ledger):
+    """Replace the ledger's rows with the restored ones; returns the expenses as loaded (with their ids)"""
+    n = expenses.num_rows
+    with db.engine.begin() as conn:
+        _set_ledger(conn, ledger_id)
+        start = time.perf_counter()
+        total, in_ledger = conn.execute(select(func.count(), func.count().filter(db.Expense.ledger_id == ledger_id))
+                                        .select_from(db.Expense)).one()
+        # Dropping the indexes pays off when they'd be rebuilt from mostly restored rows anyway
+        rebuild = n >= total - in_ledger
+        if rebuild:
+            for index in db.Expense.__table__.indexes:
+                index.drop(conn)
+        # Stats and anomalies of the replaced rows; a rescan (unless skipped) rebuilds them
+        conn.execute(delete(db.SpendingAnomaly).where(db.SpendingAnomaly.ledger_id == ledger_id))
+        conn.execute(delete(db.SpendingStat).where(db.SpendingStat.ledger_id == ledger_id))
+        conn.execute(delete(db.Balance).where(db.Balance.ledger_id == ledger_id))
+        conn.execute(delete(db.Expense).where(db.Expense.ledger_id == ledger_id))
+        _report("clear ledger", in_ledger, start)
+
+        # Keep the backed-up ids when they are free, so restored rows line up with the old history
+        ids = expenses["id"]
+        if n and not (same_ledger and conn.execute(select(db.Expense.id).where(
+                db.Expense.id.between(pc.min(ids).as_py(), pc.max(ids).as_py())).limit(1)).first() is None):
+            first = (conn.execute(select(func.max(db.Expense.id))).scalar() or 0) + 1
+            expenses = expenses.set_column(0, "id", pa.array(np.arange(first, first + n, dtype=np.int64)))
+        if not same_ledger:
+            # uids are unique across ledgers, and rule links belong to the source ledger's rules
+            expenses = expenses.set_column(1, "uid", _random_uids(n))
+            expenses = expenses.set_column(7, "rule_id", pa.nulls(n, pa.int64()))
+            expenses = expenses.set_column(8, "period", pa.nulls(n, pa.string()))
+        rows = expenses.append_column("ledger_id", pa.repeat(pa.scalar(ledger_id), n))
+
+        start = time.perf_counter()
+        _bulk_insert(conn, db.Expense.__table__, rows)
+        _report("load expenses", n, start)
+        _bulk_insert(conn, db.Balance.__table__,
+                     balances.append_column("ledger_id", pa.repeat(pa.scalar(ledger_id), balances.num_rows)))
+        if rebuild:
+            start = time.perf_counter()
+            for index in db.Expense.__table__.indexes:
+                index.create(conn)
+            _report("rebuild indexes", n + total - in_ledger, start)
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("SELECT setval(pg_get_serial_sequence('expenses', 'id'), "
+                              "(SELECT COALESCE(MAX(id), 0) + 1 FROM expenses), false)"))
+    return expenses
+
+
+def _bulk_insert(conn, table, rows):
+    """COPY an Arrow table into `table` on Postgres; executemany of plain tuples in chunks elsewhere"""
+    if conn.dialect.name == "postgresql":
+        cursor = conn.connection.cursor()
+        columns = ", ".join(rows.column_names)
+        for batch in rows.to_batches(COPY_ROWS):
+            buffer = io.BytesIO()
+            pa_csv.write_csv(batch, buffer, pa_csv.WriteOptions(include_header=False))
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table.name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.close()
+    elif conn.dialect.name == "sqlite":
+        # Dates and times in SQLAlchemy's SQLite text format (%S includes the microseconds)
+        columns = [pc.cast(c, pa.string()) if pa.types.is_date(c.type) else
+                   pc.strftime(c, "%Y-%m-%d %H:%M:%S") if pa.types.is_timestamp(c.type) else c for c in rows.columns]
+        sql = f"INSERT INTO {table.name} ({', '.join(rows.column_names)}) VALUES ({', '.join('?' * len(columns))})"
+        cursor = conn.connection.cursor()
+        for i in range(0, rows.num_rows, CHUNK_ROWS):
+            cursor.executemany(sql, zip(*(c.slice(i, CHUNK_ROWS).to_pylist() for c in columns)))
+        cursor.close()
+    else:
+        for batch in rows.to_batches(CHUNK_ROWS):
+            conn.execute(insert(table), batch.to_pylist())
+
+
+def _snapshot_history(ledger_id, expenses, balances):
+    """Snapshot every restored month, so point-in-time reads after the restore start from it"""
+    frame = expenses.select(["id", "uid", "date", "month", "category", "tag", "amount"]).to_pandas()
+    frame["date"] = frame["date"].astype(str)
+    # In the format of db_utils._month_state, serialized a month at a time by pandas
+    by_month = {month: group.drop(columns="month").to_json(orient="records", double_precision=15)
+                for month, group in frame.groupby("month")}
+    balance_rows = {b["month"]: {k: b[k] for k in ("prev_balance", "this_month", "total_balance")}
+                    for b in balances.to_pylist()}
+    session = db.SessionLocal()
+    now = datetime.datetime.now()
+    log_id = session.query(func.max(db.ChangeLog.id)).scalar() or 0
+    session.add_all([db.MonthSnapshot(ledger_id=ledger_id, month=month, log_id=log_id, taken_at=now,
+                                      data=f'{{"balance": {json.dumps(balance_rows.get(month))}, '
+                                           f'"expenses": {by_month.get(month, "[]")}}}')
+                     for month in set(by_month) | set(balance_rows)])
+    scopes = {scope for scope, in session.query(db.DataVersion.scope).filter_by(ledger_id=ledger_id)}
+    scopes |= {f"expenses:{c}" for c in pc.unique(expenses["category"]).to_pylist()} | {"balances"}
+    db._bump_versions(session, [(ledger_id, scope) for scope in scopes])
+    change_feed.publish(session, [db._change(None, None, None)])
+    session.commit()
+    session.close()
+
+
+def _write_expenses(conn, query, path):
+    """Stream query rows into a Parquet file in CHUNK_ROWS row groups; returns the row count"""
+    n = 0
+    with pq.ParquetWriter(path, EXPENSE_SCHEMA, compression="zstd") as writer:
+        for rows in conn.execution_options(yield_per=CHUNK_ROWS).execute(query).partitions():
+            columns = list(zip(*rows))
+            writer.write_batch(pa.record_batch([pa.array(c, type=f.type) for c, f in zip(columns, EXPENSE_SCHEMA)],
+                                               schema=EXPENSE_SCHEMA))
+            n += len(rows)
+    return n
+
+
+def _random_uids(n):
+    raw = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16)
+    return pa.array(_HEX[raw].view("S32").ravel().astype(str))
+
+
+def _set_ledger(conn, ledger_id):
+    if conn.dialect.name == "postgresql":
+        # Row-level security (db_utils.enable_row_level_security) filters on this setting
+        conn.execute(text("SELECT set_config('app.ledger_id', :ledger_id, true)"), {"ledger_id": ledger_id})
+
+
+def _chain(snapshots):
+    """The latest full snapshot and the deltas after it"""
+    fulls = [i for i, s in enumerate(snapshots) if s["kind"] == "full"]
+    return snapshots[fulls[-1]:] if fulls else []
+
+
+def _load_manifest(ledger_dir):
+    path = os.path.join(ledger_dir, "manifest.json")
+    if not os.path.exists(path):
+        return {"snapshots": []}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _save_manifest(ledger_dir, manifest):
+    path = os.path.join(ledger_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def _report(step, rows, start):
+    elapsed = time.perf_counter() - start
+    rate = f"{rows / elapsed:12,.0f} rows/s" if elapsed > 0 else ""
+    print(f"{step:24} {rows:12,} rows {elapsed:8.2f} s {rate}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Back up and restore ledgers as Parquet snapshots")
+    parser.add_argument("--dir", default=os.getenv("BACKUP_DIR", "backups"), help="backup directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    snap = commands.add_parser("snapshot", help="write a snapshot (a delta if a recent full one exists)")
+    snap.add_argument("--ledger", default=db.current_ledger())
+    snap.add_argument("--all", action="store_true", help="snapshot every ledger")
+    snap.add_argument("--full", action="store_true", help="always write a full snapshot")
+    rest = commands.add_parser("restore", help="replace a ledger's balances and expenses from snapshots")
+    rest.add_argument("--ledger", default=db.current_ledger(), help="ledger the snapshots were taken of")
+    rest.add_argument("--to-ledger", help="ledger to restore into (default: the same one)")
+    rest.add_argument("--through", help="last snapshot to apply (default: the latest)")
+    rest.add_argument("--skip-rescan", action="store_true", help="don't rebuild spending stats and anomalies")
+    lst = commands.add_parser("list", help="list a ledger's snapshots")
+    lst.add_argument("--ledger", default=db.current_ledger())
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        for ledger_id in db.list_ledgers() if args.all else [args.ledger]:
+            entry = snapshot(ledger_id, args.dir, full=args.full)
+            print(f"Wrote {ledger_id}/{entry['name']}: {entry['expenses']:,} expenses, {entry['balances']} balances, "
+                  f"{entry['deleted']} deletes, {entry['bytes'] / 2 ** 20:.1f} MiB")
+    elif args.command == "restore":
+        start = time.perf_counter()
+        n = restore(args.ledger, args.dir, args.to_ledger, args.through, rescan=not args.skip_rescan)
+        _report(f"restored {args.to_ledger or args.ledger}", n, start)
+    else:
+        for s in _load_manifest(os.path.join(args.dir, args.ledger))["snapshots"]:
+            print(f"{s['name']:28} {s['expenses']:12,} expenses {s['balances']:6} balances "
+                  f"{s['deleted']:8,} deletes {s['bytes'] / 2 ** 20:9.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""Load-test the JSON API (api.py): single vs bulk inserts, full vs conditional GETs.
+
+Starts the API with uvicorn on a throwaway SQLite database (or BENCH_DB_URL),
+unless API_URL points at a running instance; set API_TOKEN if the server needs
+one. Either way the database is filled with synthetic rows, so never point it
+at real data.
+Run from the repository root:
+    python benchmarks/bench_api.py [--clients 8] [--seconds 5]
+"""
+import argparse
+import datetime
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+LEDGER = "bench"
+CATEGORIES = [f"category-{i}" for i in range(30)]
+BULK_SIZE = 100
+
+
+def start_server():
+    """Run api:app in a background thread; returns its base URL"""
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DB_URL"] = os.getenv("BENCH_DB_URL", f"sqlite:///{tmpdir}/bench.db")
+    os.environ.pop("EXPENSE_WRITE_BEHIND", None)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import uvicorn
+    import api
+
+    server = uvicorn.Server(uvicorn.Config(api.app, host="127.0.0.1", port=8765, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return "http://127.0.0.1:8765"
+
+
+def request(method, url, body=None, headers=None):
+    """Send a request; returns (status, headers, body bytes)"""
+    headers = dict(headers or {}, **{"X-Ledger": LEDGER})
+    if os.getenv("API_TOKEN"):
+        headers["Authorization"] = f"Bearer {os.environ['API_TOKEN']}"
+    data = None
+    if body is not None:
+        data = json.dumps(body).encode()
+        headers["Content-Type"] = "application/json"
+    req = urllib.request.Request(url, data=data, method=method, headers=headers)
+    try:
+        with urllib.request.urlopen(req) as resp:
+            return resp.status, resp.headers, resp.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.headers, e.read()
+
+
+def expense(i):
+    d = datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365)
+    return {"date": d.isoformat(), "category": CATEGORIES[i % len(CATEGORIES)], "tag": "", "amount": float(i % 500 + 1)}
+
+
+def run(name, clients, seconds, call, rows_per_call=1):
+    """Call `call(i)` from `clients` threads for `seconds`; prints throughput and latency"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+    counter = iter(range(10 ** 9))
+
+    def worker():
+        while time.perf_counter() < deadline:
+            i = next(counter)
+            start = time.perf_counter()
+            status = call(i)
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        for _ in range(clients):
+            pool.submit(worker)
+    total = time.perf_counter() - start
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95)]
+    rows = f"{len(latencies) * rows_per_call / total:10,.0f} rows/s" if rows_per_call > 1 else " " * 17
+    print(f"{name:28} {len(latencies) / total:8,.0f} req/s {rows}"
+          f"   p50 {statistics.median(latencies) * 1000:6.1f} ms   p95 {p95 * 1000:6.1f} ms   {statuses}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    base = os.getenv("API_URL") or start_server()
+    print(f"{args.clients} clients x {args.seconds:g}s against {base}")
+
+    run("POST /expenses", args.clients, args.seconds,
+        lambda i: request("POST", f"{base}/expenses", expense(i))[0])
+    run(f"POST /expenses/bulk ({BULK_SIZE})", args.clients, args.seconds,
+        lambda i: request("POST", f"{base}/expenses/bulk",
+                          [expense(i * BULK_SIZE + j) for j in range(BULK_SIZE)])[0],
+        rows_per_call=BULK_SIZE)
+
+    month_url = f"{base}/expenses?month=2024-03"
+    status, headers, body = request("GET", month_url)
+    print(f"GET /expenses?month=2024-03 returns {len(json.loads(body)):,} rows ({len(body):,} bytes)")
+    run("GET /expenses (month)", args.clients, args.seconds,
+        lambda i: request("GET", month_url)[0])
+    etag = headers["ETag"]
+    run("GET /expenses (If-None-Match)", args.clients, args.seconds,
+        lambda i: request("GET", month_url, headers={"If-None-Match": etag})[0])
+    run("GET /summary", args.clients, args.seconds,
+        lambda i: request("GET", f"{base}/summary")[0])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Benchmark the over-budget check on the add_expense path at 1M expense rows.
+
+Uses a throwaway SQLite database unless BENCH_DB_URL points somewhere else
+(the database is filled with synthetic rows, so never point it at real data).
+Run from the repository root:
+    python benchmarks/bench_budget_check.py
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+import numpy as np
+
+N_ROWS = 1_000_000
+N_CHECKS = 2000
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DB_URL"] = os.getenv("BENCH_DB_URL", f"sqlite:///{_tmpdir}/bench.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils
+from db_utils import Expense, engine, SessionLocal
+from sqlalchemy import insert, func
+
+CATEGORIES = [f"category-{i}" for i in range(30)]
+
+
+def seed():
+    rng = np.random.default_rng(0)
+    start = datetime.date(2015, 1, 1)
+    offsets = rng.integers(0, 3650, size=N_ROWS)
+    cats = rng.integers(0, len(CATEGORIES), size=N_ROWS)
+    amounts = rng.gamma(2.0, 150.0, size=N_ROWS)
+    batch = 50_000
+    with engine.begin() as conn:
+        for lo in range(0, N_ROWS, batch):
+            rows = []
+            for off, cat, amt in zip(offsets[lo:lo + batch], cats[lo:lo + batch], amounts[lo:lo + batch]):
+                d = start + datetime.timedelta(days=int(off))
+                rows.append({"date": d, "month": d.strftime("%Y-%m"), "category": CATEGORIES[cat],
+                             "tag": "", "amount": float(amt)})
+            conn.execute(insert(Expense), rows)
+    db_utils.rebuild_rollups()
+
+
+def per_call_ms(fn, n=N_CHECKS):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n * 1000
+
+
+def main():
+    print(f"seeding {N_ROWS:,} expenses into {engine.url} ...")
+    t = time.perf_counter()
+    seed()
+    print(f"seeded in {time.perf_counter() - t:.1f} s")
+
+    month, category = "2019-06", CATEGORIES[0]
+    db_utils.set_budget(month, 1.0)
+    db_utils.set_budget(month, 1.0, category)
+
+    session = SessionLocal()
+    check = per_call_ms(lambda: db_utils._check_budget(session, db_utils.DEFAULT_LEDGER, month, category))
+    naive = per_call_ms(lambda: session.query(func.sum(Expense.amount)).filter_by(ledger_id=db_utils.DEFAULT_LEDGER, month=month).scalar(), 200)
+    session.close()
+
+    date = datetime.date(2019, 6, 15)
+    with_budget = per_call_ms(lambda: db_utils.add_expense(date, month, category, "", 10.0), 200)
+    no_budget = per_call_ms(lambda: db_utils.add_expense(date, "2019-07", category, "", 10.0), 200)
+
+    print(f"budget check (rollups + budgets):          {check:7.3f} ms")
+    print(f"for reference, SUM over month's expenses:  {naive:7.3f} ms")
+    print(f"add_expense, month with budgets:           {with_budget:7.3f} ms")
+    print(f"add_expense, month without budgets:        {no_budget:7.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
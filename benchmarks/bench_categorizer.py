@@ -0,0 +1,65 @@
+"""Benchmark auto-categorization of a large bank export.
+
+Builds a categorizer with a few hundred keyword, regex and amount rules plus
+tag -> category pairs learned from past expenses, then times classifying
+synthetic bank narrations (merchants repeat, as in real exports, and most
+carry a reference number). Needs no database.
+Run from the repository root:
+    python benchmarks/bench_categorizer.py
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from categorizer import Categorizer, Rule, REVIEW_BELOW
+
+N_ROWS = 100_000
+N_MERCHANTS = 5_000
+N_RULES = 300
+REPEATS = 5
+CATEGORIES = ["Food", "Groceries", "Transport", "Shopping", "Bills", "Health", "Travel", "Entertainment"]
+
+
+def rules(rng):
+    out = []
+    for i in range(N_RULES):
+        category = rng.choice(CATEGORIES)
+        if i % 10 == 0:
+            out.append(Rule(i, category, "amount", None, float(i), float(i + 50), 0))
+        elif i % 30 == 1:
+            out.append(Rule(i, category, "regex", rf"merchant{i}\s*(?:store|pay)", None, None, 1))
+        elif i % 30 == 2:
+            out.append(Rule(i, category, "keyword", f"merchant{i} store", None, None, 2))
+        else:
+            out.append(Rule(i, category, "keyword", f"merchant{i}", None, 5000.0 if i % 7 == 0 else None, i % 4))
+    return out
+
+
+def main():
+    rng = random.Random(0)
+    merchants = [f"merchant{i} store" for i in range(N_MERCHANTS)]
+    learned = [(m, rng.choice(CATEGORIES), rng.randint(1, 20)) for m in merchants[N_RULES:N_MERCHANTS // 2]]
+    texts = [f"UPI/{rng.randint(10**9, 10**10)}/{rng.choice(merchants)}" if rng.random() < 0.7
+             else rng.choice(merchants) for _ in range(N_ROWS)]
+    amounts = [round(rng.uniform(1, 10_000), 2) for _ in range(N_ROWS)]
+
+    start = time.perf_counter()
+    categorizer = Categorizer(rules(rng), learned)
+    print(f"build: {len(categorizer.rules)} rules, {len(learned):,} learned tags in "
+          f"{(time.perf_counter() - start) * 1000:.1f} ms")
+
+    best = float("inf")
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = categorizer.classify(texts, amounts)
+        best = min(best, time.perf_counter() - start)
+    counts = result["source"].replace("", "none").value_counts().to_dict()
+    review = int((result["confidence"] < REVIEW_BELOW).sum())
+    print(f"classify {N_ROWS:,} rows: {best * 1000:.0f} ms ({N_ROWS / best:,.0f} rows/s); "
+          f"{counts}, {review:,} for review")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""Benchmark forecast fitting: 30 categories x 10 years of daily expenses.
+
+Run from the repository root:
+    python benchmarks/bench_forecast.py
+"""
+import datetime
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import forecast
+
+N_CATEGORIES = 30
+YEARS = 10
+REPEATS = 5
+
+
+def timed(fn, repeats=REPEATS):
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    rng = np.random.default_rng(0)
+    as_of = datetime.date.today()
+    start = as_of - datetime.timedelta(days=365 * YEARS - 1)
+    n_days = (as_of - start).days + 1
+
+    # ~1 expense per category per day, like the per-row (category, date, amount) aggregate query returns
+    codes = np.repeat(np.arange(N_CATEGORIES), n_days)
+    dates = [start + datetime.timedelta(days=int(d)) for d in np.tile(np.arange(n_days), N_CATEGORIES)]
+    amounts = rng.gamma(2.0, 150.0, size=len(codes))
+    print(f"{N_CATEGORIES} categories x {YEARS} years = {len(codes):,} daily rows")
+
+    t_matrix, series = timed(lambda: forecast.daily_matrix(codes, dates, amounts, N_CATEGORIES, start, as_of))
+    print(f"daily_matrix (full history):          {t_matrix * 1000:8.2f} ms")
+
+    t_all, fitted = timed(lambda: forecast.fit(series, as_of))
+    print(f"fit, all {N_CATEGORIES} categories (cold cache):  {t_all * 1000:8.2f} ms")
+
+    t_one, _ = timed(lambda: forecast.fit(series[:1], as_of))
+    print(f"fit, 1 changed category (warm cache): {t_one * 1000:8.2f} ms")
+
+    month = as_of.strftime("%Y-%m")
+    t_proj, _ = timed(lambda: [forecast.remaining_month_forecast(p, month, as_of) for p in fitted])
+    print(f"month-end projection, all categories: {t_proj * 1000:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""Benchmark per-interaction query latency on the offline-first local database.
+
+Fills a throwaway local SQLite file (WAL, tuned pragmas) and times the
+queries behind common page interactions with the read cache cleared, so
+every call hits the database. Set BENCH_REMOTE_URL to also time the same
+calls against a shared database directly (it is filled with synthetic rows,
+so never point it at real data).
+Run from the repository root:
+    python benchmarks/bench_local_first.py
+"""
+import datetime
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+N_ROWS = 50_000
+REPEATS = 500
+LEDGER = "bench"
+
+
+def fill(db_utils):
+    start = datetime.date(2022, 1, 1)
+    rows = []
+    for i in range(N_ROWS):
+        d = start + datetime.timedelta(days=i % 1000)
+        rows.append({"ledger_id": LEDGER, "date": d, "month": d.strftime("%Y-%m"),
+                     "category": f"category-{i % 30}", "tag": "", "amount": float(i % 500 + 1)})
+    with db_utils.engine.begin() as conn:
+        conn.execute(db_utils.insert(db_utils.Expense), rows)
+    db_utils.rebuild_rollups()
+    for month in {r["month"] for r in rows}:
+        db_utils.add_balance(month, 1000.0, 500.0, ledger_id=LEDGER)
+
+
+def timed(db_utils, fn):
+    """Median and 95th percentile latency of fn() in ms, uncached"""
+    times = []
+    for _ in range(REPEATS):
+        db_utils._read_cache.clear()
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    times.sort()
+    return statistics.median(times), times[int(len(times) * 0.95)]
+
+
+def run(target):
+    """Time the local database file at `target`, or the database URL `target` directly"""
+    if "://" in target:
+        os.environ["DB_URL"] = target
+        os.environ.pop("LOCAL_DB_PATH", None)
+    else:
+        os.environ["DB_URL"] = ""  # no shared database: time the local one without a sync thread
+        os.environ["LOCAL_DB_PATH"] = target
+    os.environ.pop("EXPENSE_WRITE_BEHIND", None)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import db_utils
+
+    fill(db_utils)
+    print(f"{N_ROWS:,} expenses in {db_utils.engine.url}")
+    month = "2023-06"
+    cases = [
+        ("balance of a month", lambda: db_utils.get_balance(month, ledger_id=LEDGER)),
+        ("expenses of a month", lambda: db_utils.get_expenses(month, ledger_id=LEDGER)),
+        ("month/category selectors", lambda: db_utils.get_expense_index(ledger_id=LEDGER)),
+        ("category in a month", lambda: db_utils.get_expenses_by_category("category-3", month, ledger_id=LEDGER)),
+        ("add an expense", lambda: db_utils.add_expense(datetime.date(2023, 6, 15), month, "category-3", "",
+                                                        9.0, ledger_id=LEDGER)),
+    ]
+    for name, fn in cases:
+        p50, p95 = timed(db_utils, fn)
+        print(f"  {name:28} p50 {p50:7.3f} ms   p95 {p95:7.3f} ms")
+
+
+def main():
+    if len(sys.argv) > 1:
+        run(sys.argv[1])
+        return
+    # Each target in a fresh interpreter: db_utils binds its engine at import
+    targets = [os.path.join(tempfile.mkdtemp(), "local.db")]
+    if os.getenv("BENCH_REMOTE_URL"):
+        targets.append(os.environ["BENCH_REMOTE_URL"])
+    for target in targets:
+        subprocess.run([sys.executable, os.path.abspath(__file__), target], check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Benchmark the work a single widget interaction costs on each page.
+
+Drives the app with Streamlit's AppTest against a throwaway SQLite ledger
+and, for each interaction, counts the SQL statements the rerun executes (with
+the read cache cleared first, so every read it makes reaches the database)
+and the Plotly figures it builds. A widget inside an `st.fragment` reruns
+only that fragment, as in the browser: AppTest on its own always reruns the
+whole script, so the fragment-scoped rerun is requested here the way the
+frontend does it, from the fragment id the widget was rendered with.
+Balance Overview has no widgets, so it has no interactions here. A last
+check runs a session on a second ledger (?ledger=house-b) and fails unless
+its fragment reruns read and write that ledger rather than the default one.
+Run from the repository root:
+    python benchmarks/bench_page_reruns.py
+"""
+import datetime
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+N_MONTHS = 24
+PER_MONTH = 250
+OTHER_LEDGER = "house-b"
+
+# (page, interaction, widget type, key or label, value picked from the widget's options)
+INTERACTIONS = [
+    ("💵 Add Monthly Balance", "budget category", "selectbox", "Budget Applies To", lambda w: w.options[1]),
+    ("💵 Add Monthly Balance", "income amount", "number_input", "Income / Added Amount for this Month",
+     lambda w: 500.0),
+    ("📝 Add Expenses", "month to view", "selectbox", "expense_month_selector", lambda w: w.options[-1]),
+    ("📝 Add Expenses", "expense tag", "text_input", "Optional Tag / Note", lambda w: "coffee"),
+    ("🔁 Recurring Expenses", "repeats", "selectbox", "recurring_cadence", lambda w: "weekly"),
+    ("🏷️ Auto-Categorize", "try a tag", "text_input", "rule_test_tag", lambda w: "swiggy order 42"),
+    ("📈 Analysis", "single month", "selectbox", "single_month_analysis", lambda w: w.options[-1]),
+    ("📈 Analysis", "months to compare", "multiselect", "multi_month_comparison", lambda w: w.options[:2]),
+    ("📈 Analysis", "deep dive categories", "multiselect", "category_deep_dive", lambda w: w.options[:2]),
+    ("📚 Historical View", "month filter", "selectbox", "Filter by Month", lambda w: w.options[2]),
+    ("📚 Historical View", "category filter", "selectbox", "Filter by Category", lambda w: w.options[1]),
+    ("📚 Historical View", "point-in-time month", "selectbox", "as_of_month", lambda w: w.options[-1]),
+]
+
+
+def fill(db_utils):
+    start = datetime.date.today().replace(day=1)
+    rows = []
+    for m in range(N_MONTHS):
+        first = (start - datetime.timedelta(days=31 * m)).replace(day=1)
+        for i in range(PER_MONTH):
+            d = first + datetime.timedelta(days=i % 28)
+            rows.append({"ledger_id": db_utils.DEFAULT_LEDGER, "date": d, "month": d.strftime("%Y-%m"),
+                         "category": f"category-{i % 12}", "tag": f"shop {i % 40}", "amount": float(i % 90 + 10)})
+    with db_utils.engine.begin() as conn:
+        conn.execute(db_utils.insert(db_utils.Expense), rows)
+    db_utils.rebuild_rollups()
+    for month in sorted({r["month"] for r in rows}):
+        db_utils.add_balance(month, 1000.0, 20000.0)
+    db_utils.set_budget(start.strftime("%Y-%m"), 15000.0)
+    db_utils.add_recurring_rule("category-1", "rent", 12000.0, "monthly", 1, start)
+    db_utils.add_category_rule("category-2", "keyword", "swiggy")
+    db_utils.rescan_anomalies()
+
+
+class Harness:
+    """Counts SQL statements and figure builds, and reruns a single fragment on request"""
+
+    def __init__(self, db_utils):
+        import plotly.graph_objects as go
+        from sqlalchemy import event
+        from streamlit.testing.v1 import local_script_runner
+
+        self.statements = self.figures = 0
+        self.fragment_id = None
+        self.messages = []
+        event.listen(db_utils.engine, "before_cursor_execute", self._on_statement)
+
+        figure_init = go.Figure.__init__
+
+        def init(figure, *args, **kwargs):
+            self.figures += 1
+            figure_init(figure, *args, **kwargs)
+        go.Figure.__init__ = init
+
+        run = local_script_runner.LocalScriptRunner.run
+        rerun_data = local_script_runner.RerunData
+
+        def run_and_keep_messages(runner, *args, **kwargs):
+            tree = run(runner, *args, **kwargs)
+            self.messages = list(runner.forward_msgs())
+            return tree
+
+        def fragment_rerun_data(**kwargs):
+            if self.fragment_id:
+                kwargs["fragment_id_queue"] = [self.fragment_id]
+            return rerun_data(**kwargs)
+        local_script_runner.LocalScriptRunner.run = run_and_keep_messages
+        local_script_runner.RerunData = fragment_rerun_data
+
+    def _on_statement(self, *args):
+        self.statements += 1
+
+    def fragment_of(self, widget):
+        """Id of the fragment the widget was rendered in by the last run, or None"""
+        for msg in self.messages:
+            if msg.HasField("delta") and msg.delta.HasField("new_element"):
+                element = msg.delta.new_element
+                proto = getattr(element, element.WhichOneof("type"))
+                if getattr(proto, "id", None) == widget.id:
+                    return msg.delta.fragment_id or None
+        return None
+
+
+def find(at, kind, key_or_label):
+    widgets = getattr(at, kind)
+    for w in widgets:
+        if w.key == key_or_label or w.label == key_or_label:
+            return w
+    raise LookupError(f"No {kind} {key_or_label!r}")
+
+
+def check_other_ledger(db_utils, harness):
+    """Add an expense and browse months with fragment reruns in a session on OTHER_LEDGER"""
+    from streamlit.testing.v1 import AppTest
+
+    db_utils.add_expense(datetime.date(2001, 1, 15), "2001-01", "category-0", "old", 1.0, ledger_id=OTHER_LEDGER)
+    default_count = len(db_utils.get_all_expenses(db_utils.DEFAULT_LEDGER))
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+    at.query_params["ledger"] = OTHER_LEDGER
+    at.run()
+    at.sidebar.radio[0].set_value("📝 Add Expenses").run()
+
+    find(at, "number_input", "Expense Amount").set_value(123.0)
+    button = find(at, "button", "Add Expense")
+    harness.fragment_id = harness.fragment_of(button)
+    button.click()
+    at.run()
+    written = [e.amount for e in db_utils.get_all_expenses(OTHER_LEDGER)]
+    if not harness.fragment_id or 123.0 not in written or \
+            len(db_utils.get_all_expenses(db_utils.DEFAULT_LEDGER)) != default_count:
+        raise RuntimeError(f"Add Expense in a fragment rerun didn't write to {OTHER_LEDGER}")
+
+    selector = find(at, "selectbox", "expense_month_selector")
+    harness.fragment_id = harness.fragment_of(selector)
+    selector.set_value(selector.options[0])
+    at.run()
+    harness.fragment_id = None
+    months = find(at, "selectbox", "expense_month_selector").options
+    if at.exception or months != db_utils.list_expense_months(OTHER_LEDGER):
+        raise RuntimeError(f"The month browser's fragment rerun didn't read {OTHER_LEDGER}: {months}")
+    print(f"  fragment reruns on ledger {OTHER_LEDGER!r} read and write that ledger")
+
+
+def main():
+    os.environ["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "pages.db")
+    for name in ("LOCAL_DB_PATH", "EXPENSE_WRITE_BEHIND"):
+        os.environ.pop(name, None)
+    sys.path.insert(0, ROOT)
+    import db_utils
+    from streamlit.testing.v1 import AppTest
+
+    fill(db_utils)
+    harness = Harness(db_utils)
+    print(f"{N_MONTHS * PER_MONTH:,} expenses over {N_MONTHS} months; per interaction (read cache cleared):")
+    print(f"  {'page':24} {'interaction':22} {'rerun':9} {'SQL':>5} {'figures':>8}")
+    for page, name, kind, key_or_label, pick in INTERACTIONS:
+        at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120)
+        at.run()
+        at.sidebar.radio[0].set_value(page).run()
+        widget = find(at, kind, key_or_label)
+        harness.fragment_id = harness.fragment_of(widget)
+        widget.set_value(pick(widget))
+        db_utils._read_cache.clear()
+        harness.statements = harness.figures = 0
+        at.run()
+        scope = "fragment" if harness.fragment_id else "full page"
+        harness.fragment_id = None
+        if at.exception:
+            raise RuntimeError(f"{page} / {name}: {at.exception[0].message}")
+        print(f"  {page:24} {name:22} {scope:9} {harness.statements:5} {harness.figures:8}")
+    check_other_ledger(db_utils, harness)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark month x category aggregation at 1, 2, 4 and 8 worker processes.
+
+Uses a throwaway SQLite database unless BENCH_DB_URL points somewhere else
+(the database is filled with synthetic rows, so never point it at real data).
+Run from the repository root:
+    python benchmarks/bench_parallel_agg.py [rows]
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+LEDGER = "bench"
+WORKERS = [1, 2, 4, 8]
+REPEATS = 3
+
+
+def fill(db_utils, n_rows):
+    start = datetime.date(2010, 1, 1)
+    batch = []
+    with db_utils.engine.begin() as conn:
+        for i in range(n_rows):
+            d = start + datetime.timedelta(days=i % 5000)
+            batch.append({"ledger_id": LEDGER, "date": d, "month": d.strftime("%Y-%m"),
+                          "category": f"category-{i % 30}", "tag": "", "amount": float(i % 500 + 1)})
+            if len(batch) == 100_000:
+                conn.execute(db_utils.insert(db_utils.Expense), batch)
+                batch = []
+        if batch:
+            conn.execute(db_utils.insert(db_utils.Expense), batch)
+    db_utils.rebuild_rollups()
+
+
+def best_of(fn):
+    times = []
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def main():
+    n_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    tmpdir = tempfile.mkdtemp()
+    os.environ["DB_URL"] = os.getenv("BENCH_DB_URL", f"sqlite:///{tmpdir}/bench.db")
+    os.environ.pop("EXPENSE_WRITE_BEHIND", None)
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import db_utils
+    import parallel_agg
+
+    fill(db_utils, n_rows)
+    session = db_utils.SessionLocal()
+    month_counts = session.query(db_utils.ExpenseRollup.month, db_utils.func.sum(db_utils.ExpenseRollup.count)) \
+        .filter_by(ledger_id=LEDGER).group_by(db_utils.ExpenseRollup.month).order_by(db_utils.ExpenseRollup.month).all()
+    session.close()
+    print(f"{n_rows:,} expenses over {len(month_counts)} months in {db_utils.engine.url} ({os.cpu_count()} CPUs)")
+
+    def pandas_groupby():
+        db_utils._read_cache.clear()
+        df = db_utils.get_expense_columns(ledger_id=LEDGER).to_frame()
+        return df.groupby(["month", "category"], observed=True)["amount"].agg(["sum", "count"])
+    elapsed, _ = best_of(pandas_groupby)
+    print(f"{'load rows + pandas groupby':28} {elapsed:8.2f} s")
+
+    baseline = None
+    for workers in WORKERS:
+        shards = parallel_agg.plan_shards(month_counts, workers)
+        if workers == 1:
+            def run():
+                with db_utils.engine.connect() as conn:
+                    return parallel_agg.merge([parallel_agg.aggregate_shard(conn, LEDGER, *s) for s in shards])
+        else:
+            start = time.perf_counter()
+            parallel_agg.run_sharded(db_utils.DB_URL, LEDGER, shards, workers)  # start the pool
+            print(f"{'':28} (pool start + first run {time.perf_counter() - start:.2f} s)")
+            def run():
+                return parallel_agg.merge(parallel_agg.run_sharded(db_utils.DB_URL, LEDGER, shards, workers))
+        elapsed, result = best_of(run)
+        baseline = baseline or elapsed
+        print(f"{f'{workers} worker(s), {len(shards)} shard(s)':28} {elapsed:8.2f} s   speedup {baseline / elapsed:4.1f}x"
+              f"   ({len(result)} month x category groups)")
+
+
+if __name__ == "__main__":
+    main()
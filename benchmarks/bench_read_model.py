@@ -0,0 +1,89 @@
+"""Benchmark the per-row memory of expense reads: ORM instances vs ExpenseRow vs ExpenseColumns.
+
+Uses a throwaway SQLite database unless BENCH_DB_URL points somewhere else
+(the database is filled with synthetic rows, so never point it at real data).
+Run from the repository root:
+    python benchmarks/bench_read_model.py
+"""
+import datetime
+import gc
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+N_ROWS = 100_000
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DB_URL"] = os.getenv("BENCH_DB_URL", f"sqlite:///{_tmpdir}/bench.db")
+os.environ.pop("EXPENSE_WRITE_BEHIND", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import pandas as pd
+import db_utils
+from read_model import ExpenseColumns
+
+LEDGER = "bench"
+CATEGORIES = [f"category-{i}" for i in range(30)]
+
+
+def fill():
+    start = datetime.date(2020, 1, 1)
+    rows = []
+    for i in range(N_ROWS):
+        d = start + datetime.timedelta(days=i % 1500)
+        rows.append({"ledger_id": LEDGER, "date": d, "month": d.strftime("%Y-%m"),
+                     "category": CATEGORIES[i % len(CATEGORIES)], "tag": f"tag-{i % 200}",
+                     "amount": float(i % 500 + 1)})
+    with db_utils.engine.begin() as conn:
+        conn.execute(db_utils.insert(db_utils.Expense), rows)
+
+
+def measure(name, build):
+    """Print bytes/row retained by build()'s result and how long building it took"""
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - start
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:38} {retained / N_ROWS:8,.0f} bytes/row {retained / 2 ** 20:8,.1f} MiB {elapsed * 1000:8,.0f} ms")
+    return result
+
+
+def orm_rows():
+    session = db_utils.SessionLocal()
+    rows = session.query(db_utils.Expense).filter_by(ledger_id=LEDGER).all()
+    session.close()
+    return rows
+
+
+def page_frame(rows):
+    """What the pages used to build: per-row dicts, then a DataFrame"""
+    return pd.DataFrame([{"Date": e.date, "Month": e.month, "Category": e.category,
+                          "Tag": e.tag, "Amount": e.amount} for e in rows])
+
+
+def columns_only():
+    rows = db_utils.get_all_expenses(ledger_id=LEDGER)
+    db_utils._read_cache.clear()  # keep only the columns
+    return ExpenseColumns.from_rows(rows)
+
+
+def main():
+    fill()
+    print(f"{N_ROWS:,} expenses in {db_utils.engine.url}")
+    measure("ORM Expense instances (before)", orm_rows)
+    measure("ORM instances + page DataFrame (before)", lambda: (lambda rows: (rows, page_frame(rows)))(orm_rows()))
+    rows = measure("ExpenseRow list", lambda: db_utils.get_all_expenses(ledger_id=LEDGER))
+    db_utils._read_cache.clear()
+    del rows
+    columns = measure("ExpenseColumns", columns_only)
+    print(f"{'  (arrays only)':38} {columns.nbytes() / N_ROWS:8,.0f} bytes/row")
+    measure("ExpenseColumns.to_frame()", columns.to_frame)
+
+
+if __name__ == "__main__":
+    main()
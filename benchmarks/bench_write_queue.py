@@ -0,0 +1,55 @@
+"""Benchmark expense insert throughput: synchronous add_expense vs the write-behind queue.
+
+Uses a throwaway SQLite database unless BENCH_DB_URL points somewhere else
+(the database is filled with synthetic rows, so never point it at real data).
+Run from the repository root:
+    python benchmarks/bench_write_queue.py
+"""
+import datetime
+import os
+import sys
+import tempfile
+import time
+
+N_ROWS = 5000
+
+_tmpdir = tempfile.mkdtemp()
+os.environ["DB_URL"] = os.getenv("BENCH_DB_URL", f"sqlite:///{_tmpdir}/bench.db")
+os.environ.pop("EXPENSE_WRITE_BEHIND", None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db_utils
+from write_queue import ExpenseWriteQueue
+
+CATEGORIES = [f"category-{i}" for i in range(30)]
+
+
+def rows(n):
+    start = datetime.date(2024, 1, 1)
+    for i in range(n):
+        d = start + datetime.timedelta(days=i % 365)
+        yield d, d.strftime("%Y-%m"), CATEGORIES[i % len(CATEGORIES)], "", float(i % 500 + 1)
+
+
+def main():
+    print(f"{N_ROWS:,} inserts into {db_utils.engine.url}")
+
+    start = time.perf_counter()
+    for d, month, category, tag, amount in rows(N_ROWS):
+        db_utils.add_expense(d, month, category, tag, amount)
+    sync = time.perf_counter() - start
+    print(f"sync add_expense:       {N_ROWS / sync:10,.0f} inserts/s")
+
+    for max_rows in (100, 500, 2000):
+        queue = ExpenseWriteQueue(db_utils.add_expenses_batch, max_rows=max_rows, max_seconds=0.5)
+        start = time.perf_counter()
+        for d, month, category, tag, amount in rows(N_ROWS):
+            queue.submit(db_utils.DEFAULT_LEDGER, d, month, category, tag, amount)
+        submitted = time.perf_counter() - start
+        queue.close()  # flushes the remainder, so the timing includes every commit
+        total = time.perf_counter() - start
+        print(f"write-behind (batch {max_rows:>4}): {N_ROWS / total:10,.0f} inserts/s durable, "
+              f"{N_ROWS / submitted:12,.0f} submits/s")
+
+
+if __name__ == "__main__":
+    main()
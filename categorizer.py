@@ -0,0 +1,196 @@
+"""Rule-based and learned expense categorization, for imported bank data.
+
+Rules match an expense's tag (merchant or narration text) by keyword or
+regular expression, optionally only within an amount range; "amount" rules
+have no pattern and match on the range alone. Keyword rules are indexed by
+their first word, so a text costs one dict lookup per word however many
+keywords there are; regex rules (and keywords that don't start with a word
+character) compile into one alternation regex with a named group per rule,
+so a text is scanned once for all of them. Regexes that can't share that
+alternation (ones with groups of their own, or inline global flags) are
+scanned one by one. When several rules match, the
+one with the highest priority (then the oldest) whose amount range fits wins.
+
+Expenses no rule matches fall back to frequencies learned from past
+tag -> category pairs: the exact normalized tag if it was seen before,
+otherwise the votes of its words.
+
+`Categorizer.classify` scans each distinct text once (bank exports repeat
+merchants) and resolves amount ranges with NumPy. Every result carries a
+confidence in [0, 1]: 1 for rule matches, the smoothed share of the top
+category for learned ones, 0 when nothing matched. Results below
+REVIEW_BELOW are meant for a person to check.
+"""
+import re
+from collections import Counter, defaultdict, namedtuple
+import numpy as np
+import pandas as pd
+
+KINDS = ["keyword", "regex", "amount"]
+REVIEW_BELOW = 0.6
+# Word votes are less certain than a tag seen before as a whole
+WORD_WEIGHT = 0.8
+
+_WORD = re.compile(r"[a-z][a-z0-9&']{2,}")
+_TOKEN = re.compile(r"\w+")
+
+Rule = namedtuple("Rule", ["id", "category", "kind", "pattern", "min_amount", "max_amount", "priority"])
+
+
+def normalize(text):
+    """Lowercased words of a tag, without numbers, punctuation and one- or two-letter words"""
+    return " ".join(_WORD.findall(text.lower())) if text else ""
+
+
+def rule_regex(kind, pattern):
+    """Regex source of a text rule; keywords match as whole words"""
+    if kind == "keyword":
+        return r"(?<!\w)" + re.escape(pattern.strip()) + r"(?!\w)"
+    return pattern
+
+
+def validate(kind, pattern, min_amount=None, max_amount=None):
+    """Raise ValueError if a rule can't be compiled or can never match"""
+    if kind not in KINDS:
+        raise ValueError(f"Unknown rule kind: {kind}")
+    if kind == "amount":
+        if min_amount is None and max_amount is None:
+            raise ValueError("An amount rule needs a minimum or maximum amount")
+    elif not pattern or not pattern.strip():
+        raise ValueError(f"A {kind} rule needs a pattern")
+    else:
+        try:
+            re.compile(rule_regex(kind, pattern), re.IGNORECASE)
+        except re.error as e:
+            raise ValueError(f"Invalid regular expression: {e}")
+    if min_amount is not None and max_amount is not None and min_amount > max_amount:
+        raise ValueError("Minimum amount is above the maximum amount")
+
+
+class Categorizer:
+    def __init__(self, rules, learned_pairs=()):
+        """rules: Rule records; learned_pairs: (tag, category, count) rows of past expenses"""
+        self.rules = sorted(rules, key=lambda r: (-(r.priority or 0), r.id or 0))
+        # First word of a keyword -> (rule index, regex to confirm a longer keyword or None)
+        self._keywords = defaultdict(list)
+        text_rules = []
+        # (rule index, regex) of text rules scanned on their own
+        self._separate = []
+        for i, r in enumerate(self.rules):
+            if r.kind == "amount":
+                continue
+            keyword = r.pattern.strip().lower()
+            first = _TOKEN.match(keyword) if r.kind == "keyword" else None
+            if first is None:
+                source = rule_regex(r.kind, r.pattern)
+                if _combinable(source):
+                    text_rules.append(f"(?P<r{i}>{source})")
+                else:
+                    self._separate.append((i, re.compile(source, re.IGNORECASE)))
+            elif first.end() == len(keyword):
+                self._keywords[keyword].append((i, None))
+            else:
+                self._keywords[first.group()].append((i, re.compile(rule_regex(r.kind, r.pattern), re.IGNORECASE)))
+        self._pattern = re.compile("|".join(text_rules), re.IGNORECASE) if text_rules else None
+        self._groups = {f"r{i}": i for i in range(len(self.rules))}
+        self._amount_rules = [i for i, r in enumerate(self.rules) if r.kind == "amount"]
+        self._categories = np.array([r.category for r in self.rules] + [None], dtype=object)
+        # Index -1 (no rule) reads the trailing sentinel entries
+        self._lo = np.array([-np.inf if r.min_amount is None else r.min_amount for r in self.rules] + [np.inf])
+        self._hi = np.array([np.inf if r.max_amount is None else r.max_amount for r in self.rules] + [-np.inf])
+
+        exact = defaultdict(Counter)
+        for tag, category, count in learned_pairs:
+            key = normalize(tag)
+            if key and category:
+                exact[key][category] += count
+        words = defaultdict(Counter)
+        for key, counts in exact.items():
+            for word in set(key.split()):
+                words[word].update(counts)
+        self._exact = {key: _top(counts) for key, counts in exact.items()}
+        self._words = {word: _top(counts) for word, counts in words.items()}
+
+    def classify(self, texts, amounts):
+        """Categorize parallel sequences of tags and amounts. Returns a DataFrame with
+        category (missing if unknown), confidence and source ("rule", "learned" or "")"""
+        codes, uniques = pd.factorize(pd.Series(list(texts), dtype=object).fillna(""))
+        amounts = np.asarray(amounts, dtype=np.float64)
+
+        # Candidate rules of each distinct text, in priority order, and its normalized tag
+        candidates, keys = [], []
+        for text in uniques:
+            lower = text.lower()
+            found = set()
+            for token in _TOKEN.findall(lower):
+                for i, confirm in self._keywords.get(token, ()):
+                    if confirm is None or confirm.search(text):
+                        found.add(i)
+            if self._pattern:
+                for m in self._pattern.finditer(text):
+                    found.add(self._groups[m.lastgroup])
+            for i, regex in self._separate:
+                if regex.search(text):
+                    found.add(i)
+            # Rule indexes are in priority order, so amount rules compete with the text rules by priority
+            candidates.append(sorted(found.union(self._amount_rules)) if found else self._amount_rules)
+            keys.append(" ".join(_WORD.findall(lower)))
+        width = max((len(c) for c in candidates), default=0)
+        matrix = np.full((len(uniques), width), -1, dtype=np.int64)
+        for u, c in enumerate(candidates):
+            matrix[u, :len(c)] = c
+        rule = np.full(len(codes), -1, dtype=np.int64)
+        for j in range(width):
+            r = matrix[codes, j]
+            fits = (rule < 0) & (self._lo[r] <= amounts) & (amounts <= self._hi[r])
+            rule[fits] = r[fits]
+
+        category = self._categories[rule]
+        hit = rule >= 0
+        confidence = hit.astype(np.float64)
+        source = np.where(hit, "rule", "").astype(object)
+
+        # Texts differing only in reference numbers share a normalized tag
+        key_codes, key_uniques = pd.factorize(pd.Series(keys, dtype=object))
+        learned = [self._learned(key) for key in key_uniques]
+        learned_category = np.array([c for c, _ in learned] + [None], dtype=object)[key_codes[codes]]
+        learned_confidence = np.array([p for _, p in learned] + [0.0])[key_codes[codes]]
+        use = ~hit & (learned_confidence > 0)
+        category[use] = learned_category[use]
+        confidence[use] = learned_confidence[use]
+        source[use] = "learned"
+        return pd.DataFrame({"category": category, "confidence": confidence, "source": source})
+
+    def _learned(self, key):
+        """Learned category and confidence of a normalized tag"""
+        if not key:
+            return None, 0.0
+        if key in self._exact:
+            return self._exact[key]
+        votes = Counter()
+        known = 0
+        for word in set(key.split()):
+            if word in self._words:
+                category, share = self._words[word]
+                votes[category] += share
+                known += 1
+        if not votes:
+            return None, 0.0
+        category, score = votes.most_common(1)[0]
+        return category, WORD_WEIGHT * score / known
+
+
+def _combinable(source):
+    """Whether a regex can join the alternation: group names and numbered
+    references of its own would clash with the other rules' groups, and
+    inline global flags are only allowed at the start of the whole pattern"""
+    try:
+        return re.compile(source).groups == 0 and re.compile(f"(?:{source})") is not None
+    except re.error:
+        return False
+
+
+def _top(counts):
+    """Most common category and its share, smoothed so one sighting gives 0.5"""
+    category, count = counts.most_common(1)[0]
+    return category, count / (sum(counts.values()) + 1)
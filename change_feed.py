@@ -0,0 +1,130 @@
+"""Change events for expenses and balances.
+
+Writers call `publish(session, events)` before committing. On Postgres each
+event becomes a `pg_notify` in the same transaction, so other app processes
+hear about it only if the write commits; a background thread (`start_listener`)
+LISTENs and hands events to local subscribers. Other databases have no
+cross-process channel, so events are delivered in-process only. Either way
+local subscribers are called right after the writing session commits.
+
+An event is a dict: {"ledger_id", "table", "month", "category"}; category is
+None for balance changes. An event with ledger_id None means anything may
+have changed; the listener sends one whenever it (re)connects, since
+notifications sent while it was away are lost.
+"""
+import contextlib
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from sqlalchemy import event as sa_event, text
+
+CHANNEL = "finance_changes"
+RECONNECT_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+_origin = uuid.uuid4().hex  # lets the listener skip this process's own notifications
+_subscribers = []
+_versions = {}              # (ledger_id, month) -> change counter; month None counts the whole ledger
+_RESET = "*"                # snapshot key for the (None, None) counter bumped by ledger-less events
+_lock = threading.Lock()
+_listener = None
+
+
+def subscribe(callback):
+    """Call `callback(event)` for every change, from this process or (on Postgres) any other"""
+    _subscribers.append(callback)
+
+
+def publish(session, events):
+    """Announce changes made in `session`'s current transaction"""
+    if not events:
+        return
+    if session.get_bind().dialect.name == "postgresql":
+        for e in events:
+            session.execute(text("SELECT pg_notify(:channel, :payload)"),
+                            {"channel": CHANNEL, "payload": json.dumps(dict(e, origin=_origin))})
+    sa_event.listen(session, "after_commit", lambda s: _dispatch_all(events), once=True)
+
+
+def snapshot(ledger_id):
+    """Current change counters of a ledger, to compare against later with `changed_since`"""
+    with _lock:
+        snap = {month: v for (ledger, month), v in _versions.items() if ledger == ledger_id}
+        snap[_RESET] = _versions.get((None, None), 0)
+    return snap
+
+
+def changed_since(ledger_id, snap, months=None):
+    """Whether any of `months` (default: anything in the ledger) changed since `snap` was taken"""
+    if _versions.get((None, None), 0) != snap.get(_RESET, 0):
+        return True
+    return any(_versions.get((ledger_id, month), 0) != snap.get(month, 0)
+               for month in (months if months is not None else [None]))
+
+
+@contextlib.contextmanager
+def own_changes(ledger_id, snap):
+    """Advance `snap` in place by the changes made inside the block, so that
+    `changed_since` reports only changes made elsewhere"""
+    before = snapshot(ledger_id)
+    yield
+    for key, value in snapshot(ledger_id).items():
+        snap[key] = snap.get(key, 0) + value - before.get(key, 0)
+
+
+def start_listener(engine):
+    """Start the background LISTEN thread (Postgres only; safe to call repeatedly)"""
+    global _listener
+    if engine.dialect.name != "postgresql" or os.getenv("CHANGE_FEED_LISTENER") == "0":
+        return
+    with _lock:
+        if _listener is None:
+            _listener = threading.Thread(target=_listen, args=(engine,), name="change-feed-listener", daemon=True)
+            _listener.start()
+
+
+def _listen(engine):
+    while True:
+        try:
+            connection = engine.raw_connection()
+            try:
+                dbapi = connection.driver_connection
+                dbapi.autocommit = True
+                with dbapi.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                # Notifications sent while we weren't listening are lost: treat everything as changed
+                _dispatch({"ledger_id": None, "table": None, "month": None, "category": None})
+                while True:
+                    if select.select([dbapi], [], [], RECONNECT_SECONDS) == ([], [], []):
+                        continue
+                    dbapi.poll()
+                    while dbapi.notifies:
+                        payload = json.loads(dbapi.notifies.pop(0).payload)
+                        if payload.pop("origin", None) != _origin:
+                            _dispatch(payload)
+            finally:
+                connection.invalidate()
+        except Exception:
+            logger.exception("change feed listener failed; reconnecting")
+            time.sleep(RECONNECT_SECONDS)
+
+
+def _dispatch_all(events):
+    for e in events:
+        _dispatch(e)
+
+
+def _dispatch(e):
+    with _lock:
+        for key in {(e["ledger_id"], e["month"]), (e["ledger_id"], None)}:
+            _versions[key] = _versions.get(key, 0) + 1
+    for callback in _subscribers:
+        try:
+            callback(e)
+        except Exception:
+            logger.exception("change feed subscriber failed")
@@ -1,137 +1,1224 @@
-from sqlalchemy import create_engine, Column, Integer, Float, String, Date, MetaData
+from sqlalchemy import create_engine, Column, Integer, Float, String, Date, DateTime, Text, Boolean, MetaData, Table, Index, UniqueConstraint, PrimaryKeyConstraint, insert, select, func, inspect, text, event
+from sqlalchemy.exc import IntegrityError
+from concurrent.futures.process import BrokenProcessPool
 from sqlalchemy.orm import declarative_base, sessionmaker
 import pandas as pd
+import numpy as np
+import contextvars
 import datetime
+import json
+import threading
 import os
+import uuid
 from dotenv import load_dotenv
+from anomalies import ewma_update, ewma_scan, zscore, is_anomaly, flag_mask
+import forecast
+import recurring
+import categorizer
+import change_feed
+import parallel_agg
+import sync
+from write_queue import ExpenseWriteQueue
+from read_model import ExpenseRow, ExpenseColumns, ExpenseIndex
 # Update with your actual PostgreSQL credentials
 load_dotenv()
 DB_URL = os.getenv("DB_URL")
+# Offline-first mode: the app reads and writes an embedded SQLite file and
+# sync.py keeps it in step with the shared database (DB_URL) in the background
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH")
+SYNC_DB_URL = None
+if LOCAL_DB_PATH:
+    SYNC_DB_URL, DB_URL = DB_URL, f"sqlite:///{LOCAL_DB_PATH}"
 
-engine = create_engine(DB_URL)
+# One pooled engine per process, shared by the Streamlit pages and the API (api.py)
+_pool_options = {} if DB_URL.startswith("sqlite") else {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+}
+engine = create_engine(DB_URL, pool_pre_ping=True, **_pool_options)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
 
+# WAL lets pages read while a write (or a sync) is in progress; synchronous=NORMAL
+# only fsyncs at checkpoints, and the bigger page cache and memory map keep
+# hot pages in memory
+_SQLITE_PRAGMAS = ["journal_mode=WAL", "synchronous=NORMAL", "temp_store=MEMORY",
+                   "cache_size=-65536", "mmap_size=268435456", "busy_timeout=5000"]
+
+@event.listens_for(engine, "connect")
+def _tune_sqlite(dbapi_connection, connection_record):
+    if engine.dialect.name != "sqlite":
+        return
+    cursor = dbapi_connection.cursor()
+    for pragma in _SQLITE_PRAGMAS:
+        cursor.execute(f"PRAGMA {pragma}")
+    cursor.close()
+
+# Every row belongs to a ledger (a household). Functions take an optional
+# ledger_id and otherwise use the current ledger, which app.py sets from the
+# Streamlit session on every run.
+DEFAULT_LEDGER = "default"
+_current_ledger = contextvars.ContextVar("current_ledger", default=os.getenv("LEDGER_ID", DEFAULT_LEDGER))
+
+def set_current_ledger(ledger_id):
+    _current_ledger.set(ledger_id or DEFAULT_LEDGER)
+
+def current_ledger():
+    return _current_ledger.get()
+
+def _ledger(ledger_id):
+    return ledger_id or _current_ledger.get()
+
 class Balance(Base):
     __tablename__ = "balances"
     id = Column(Integer, primary_key=True, autoincrement=True)
-    month = Column(String, index=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    month = Column(String)
     prev_balance = Column(Float)
     this_month = Column(Float)
     total_balance = Column(Float)
+    # Last write time, which decides balance conflicts in sync.py
+    updated_at = Column(DateTime)
+
+    __table_args__ = (Index("ix_balances_ledger_month", "ledger_id", "month"),)
+
+# Partial-index clause: the lookup indexes cover only live (not soft-deleted) expenses
+_LIVE_ONLY = {"postgresql_where": text("deleted_at IS NULL"), "sqlite_where": text("deleted_at IS NULL")}
 
 class Expense(Base):
     __tablename__ = "expenses"
     id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
     date = Column(Date)
-    month = Column(String, index=True)
+    month = Column(String)
     category = Column(String)
     tag = Column(String)
     amount = Column(Float)
+    # Set on expenses materialized from a RecurringRule; unique together so reruns are idempotent
+    rule_id = Column(Integer)
+    period = Column(String)
+    # Set by delete_expense; deleted rows stay for the change history
+    deleted_at = Column(DateTime)
+    # Identifies the expense across databases (ids are per database), see sync.py
+    uid = Column(String, default=lambda: uuid.uuid4().hex)
+
+    __table_args__ = (
+        Index("ix_expenses_live_ledger_month", "ledger_id", "month", **_LIVE_ONLY),
+        Index("ix_expenses_live_ledger_date", "ledger_id", "date", **_LIVE_ONLY),
+        Index("ix_expenses_live_ledger_category_date", "ledger_id", "category", "date", **_LIVE_ONLY),
+        Index("uq_expenses_rule_period", "rule_id", "period", unique=True),
+        Index("uq_expenses_uid", "uid", unique=True),
+    )
+
+class RecurringRule(Base):
+    """A repeating expense; see recurring.py for cadences and period keys"""
+    __tablename__ = "recurring_rules"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER, index=True)
+    category = Column(String)
+    tag = Column(String)
+    amount = Column(Float)
+    cadence = Column(String)
+    day = Column(Integer)
+    start_date = Column(Date)
+    end_date = Column(Date)
+    active = Column(Boolean, default=True)
+    materialized_through = Column(Date)
+
+class CategoryRule(Base):
+    """Auto-categorization rule for imported expenses; see categorizer.py for kinds and matching"""
+    __tablename__ = "category_rules"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER, index=True)
+    category = Column(String)
+    kind = Column(String)
+    pattern = Column(String)
+    min_amount = Column(Float)
+    max_amount = Column(Float)
+    priority = Column(Integer, default=0)
+
+class ExpenseRollup(Base):
+    """Running spend total, count and date range per (month, category), maintained on every write"""
+    __tablename__ = "expense_rollups"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    month = Column(String)
+    category = Column(String)
+    total = Column(Float, default=0.0)
+    count = Column(Integer, default=0)
+    first_date = Column(Date)
+    last_date = Column(Date)
+
+    __table_args__ = (UniqueConstraint("ledger_id", "month", "category", name="uq_expense_rollups_ledger_month_category"),)
+
+class Budget(Base):
+    """Spending limit for a month; category=None is the budget for the whole month"""
+    __tablename__ = "budgets"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    month = Column(String)
+    category = Column(String)
+    amount = Column(Float)
+
+    __table_args__ = (UniqueConstraint("ledger_id", "month", "category", name="uq_budgets_ledger_month_category"),)
+
+class DataVersion(Base):
+    """Write counters per data scope ("expenses:<category>", "balances"), used as cache keys and API ETags"""
+    __tablename__ = "data_versions"
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    scope = Column(String)
+    version = Column(Integer, default=0)
+
+    __table_args__ = (PrimaryKeyConstraint("ledger_id", "scope", name="pk_data_versions"),)
+
+class SpendingStat(Base):
+    """Rolling EWMA statistics per category, updated on every insert"""
+    __tablename__ = "spending_stats"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    category = Column(String)
+    count = Column(Integer, default=0)
+    mean = Column(Float, default=0.0)
+    var = Column(Float, default=0.0)
+    month_count = Column(Integer, default=0)
+    month_mean = Column(Float, default=0.0)
+    month_var = Column(Float, default=0.0)
+    current_month = Column(String)
+    current_total = Column(Float, default=0.0)
+
+    __table_args__ = (UniqueConstraint("ledger_id", "category", name="uq_spending_stats_ledger_category"),)
+
+class SpendingAnomaly(Base):
+    """Flagged outlier expenses (kind='expense') and category-months (kind='month')"""
+    __tablename__ = "spending_anomalies"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    kind = Column(String, index=True)
+    expense_id = Column(Integer, index=True)
+    date = Column(Date)
+    month = Column(String)
+    category = Column(String)
+    amount = Column(Float)
+    expected = Column(Float)
+    z_score = Column(Float)
+
+    __table_args__ = (Index("ix_spending_anomalies_ledger_month", "ledger_id", "month"),)
+
+class ChangeLog(Base):
+    """Append-only history of expense and balance writes; data is the row after the change (the uid for deletes)"""
+    __tablename__ = "change_log"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    changed_at = Column(DateTime)
+    table_name = Column(String)
+    row_id = Column(Integer)
+    month = Column(String)
+    op = Column(String)  # insert, update or delete
+    data = Column(Text)
+    # None for writes made through this database; otherwise the sync client that copied it here
+    source = Column(String)
+
+    __table_args__ = (Index("ix_change_log_ledger_month_id", "ledger_id", "month", "id"),)
+
+class MonthSnapshot(Base):
+    """A month's balance and live expenses as of change_log entry log_id, as JSON"""
+    __tablename__ = "month_snapshots"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    month = Column(String)
+    log_id = Column(Integer)
+    taken_at = Column(DateTime)
+    data = Column(Text)
+
+    __table_args__ = (Index("ix_month_snapshots_ledger_month_log", "ledger_id", "month", "log_id"),)
+
+class SyncState(Base):
+    """Offline-first sync bookkeeping (client id and change_log watermarks), see sync.py"""
+    __tablename__ = "sync_state"
+    key = Column(String, primary_key=True)
+    value = Column(String)
+
+class SyncConflict(Base):
+    """A balance edited both locally and in the shared database between two syncs"""
+    __tablename__ = "sync_conflicts"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    ledger_id = Column(String, nullable=False, server_default=DEFAULT_LEDGER)
+    month = Column(String)
+    local_data = Column(Text)
+    remote_data = Column(Text)
+    kept = Column(String)  # local or remote: the newer write, which both sides now have
+    detected_at = Column(DateTime)
+    dismissed = Column(Boolean, default=False)
+
+    __table_args__ = (Index("ix_sync_conflicts_ledger_dismissed", "ledger_id", "dismissed"),)
+
+LEDGER_TABLES = [Balance, Expense, RecurringRule, CategoryRule, ExpenseRollup, Budget, DataVersion, SpendingStat, SpendingAnomaly,
+                 ChangeLog, MonthSnapshot, SyncConflict]
+# Tables whose keys changed when ledger_id was added; small enough to copy into a fresh table
+_RECREATED_FOR_LEDGER = [ExpenseRollup, Budget, DataVersion, SpendingStat]
+# Indexes superseded by the ledger-leading composite indexes, then by the partial (live-only) ones
+_OBSOLETE_INDEXES = ["ix_balances_month", "ix_expenses_month", "ix_expenses_category_date",
+                     "ix_spending_anomalies_month", "ix_spending_stats_category", "ix_expense_rollups_month",
+                     "ix_budgets_month", "ix_expenses_ledger_month", "ix_expenses_ledger_date",
+                     "ix_expenses_ledger_category_date"]
+
+def _add_missing_columns(bind, table):
+    """Add model columns that an existing table predates (create_all() won't)"""
+    existing = {c["name"] for c in inspect(bind).get_columns(table.name)}
+    with bind.begin() as conn:
+        for column in table.columns:
+            if column.name not in existing:
+                ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(bind.dialect)}"
+                if column.server_default is not None:
+                    ddl += f" DEFAULT '{column.server_default.arg}'"
+                if not column.nullable:
+                    ddl += " NOT NULL"
+                conn.execute(text(ddl))
 
-Base.metadata.create_all(engine)
+def _recreate_with_rows(bind, model):
+    """Recreate a table from its model, copying the existing rows over"""
+    with bind.begin() as conn:
+        old = Table(model.__tablename__, MetaData(), autoload_with=conn)
+        rows = [dict(r._mapping) for r in conn.execute(old.select())]
+        old.drop(conn)
+        model.__table__.create(conn)
+        if rows:
+            conn.execute(insert(model), rows)
 
-def add_balance(month, prev_balance, this_month):
+def _backfill_uids(bind):
+    """Give expenses that predate the uid column a random one"""
+    random_hex = "lower(hex(randomblob(16)))" if bind.dialect.name == "sqlite" else "md5(random()::text || id::text)"
+    with bind.begin() as conn:
+        conn.execute(text(f"UPDATE expenses SET uid = {random_hex} WHERE uid IS NULL"))
+
+def enable_row_level_security():
+    """Postgres only: restrict every ledger table to rows of the session's ledger.
+
+    Policies compare ledger_id with the `app.ledger_id` setting, which sessions
+    set from the current ledger when LEDGER_RLS=1. Run this once as the table
+    owner; the app must connect as a different, non-owner role for the
+    policies to apply.
+    """
+    with engine.begin() as conn:
+        for model in LEDGER_TABLES:
+            table = model.__tablename__
+            conn.execute(text(f"ALTER TABLE {table} ENABLE ROW LEVEL SECURITY"))
+            conn.execute(text(f"DROP POLICY IF EXISTS ledger_isolation ON {table}"))
+            conn.execute(text(f"CREATE POLICY ledger_isolation ON {table} "
+                              f"USING (ledger_id = current_setting('app.ledger_id', true)) "
+                              f"WITH CHECK (ledger_id = current_setting('app.ledger_id', true))"))
+
+if os.getenv("LEDGER_RLS") == "1" and engine.dialect.name == "postgresql":
+    @event.listens_for(SessionLocal, "after_begin")
+    def _set_rls_ledger(session, transaction, connection):
+        connection.execute(text("SELECT set_config('app.ledger_id', :ledger, true)"), {"ledger": current_ledger()})
+
+def rebuild_rollups(bind=None, ledger_id=None):
+    """Recompute expense_rollups (of one ledger, or all) from the expenses table"""
+    stale = ExpenseRollup.__table__.delete()
+    live = select(Expense.ledger_id, Expense.month, Expense.category, func.sum(Expense.amount), func.count(Expense.id),
+                  func.min(Expense.date), func.max(Expense.date)).where(Expense.deleted_at.is_(None))
+    if ledger_id:
+        stale = stale.where(ExpenseRollup.ledger_id == ledger_id)
+        live = live.where(Expense.ledger_id == ledger_id)
+    with (bind or engine).begin() as conn:
+        conn.execute(stale)
+        conn.execute(insert(ExpenseRollup).from_select(
+            ["ledger_id", "month", "category", "total", "count", "first_date", "last_date"],
+            live.group_by(Expense.ledger_id, Expense.month, Expense.category)))
+
+# A month gets a fresh snapshot once this many changes were logged since its last one,
+# so reconstructing any point in time replays at most about this many entries
+SNAPSHOT_EVERY = 200
+# taken_at of the snapshots of data that predates the change log
+HISTORY_START = datetime.datetime(1970, 1, 1)
+
+def _expense_row(e):
+    return {"id": e.id, "uid": e.uid, "date": e.date.isoformat(), "category": e.category, "tag": e.tag,
+            "amount": e.amount}
+
+def _balance_row(b):
+    return {"prev_balance": b.prev_balance, "this_month": b.this_month, "total_balance": b.total_balance}
+
+def _month_state(session, ledger_id, month):
+    """Current balance and live expenses of a month, in snapshot form"""
+    bal = session.query(Balance).filter_by(ledger_id=ledger_id, month=month).first()
+    exps = session.query(Expense).filter_by(ledger_id=ledger_id, month=month).filter(Expense.deleted_at.is_(None)).all()
+    return {"balance": _balance_row(bal) if bal else None, "expenses": [_expense_row(e) for e in exps]}
+
+def _snapshot_existing_months(bind):
+    """Snapshot every month once, so history starts from the data already there"""
+    session = sessionmaker(bind=bind)()
+    keys = set(session.query(Balance.ledger_id, Balance.month).distinct().all()) | \
+        set(session.query(Expense.ledger_id, Expense.month).filter(Expense.deleted_at.is_(None)).distinct().all())
+    for ledger_id, month in keys:
+        session.add(MonthSnapshot(ledger_id=ledger_id, month=month, log_id=0, taken_at=HISTORY_START,
+                                  data=json.dumps(_month_state(session, ledger_id, month))))
+    session.commit()
+    session.close()
+
+def _backfill_expense_versions(bind):
+    """Give each (ledger, category) with expenses a data version, so forecasts (which
+    fit the categories that have one) cover categories not written since the table existed"""
+    with bind.begin() as conn:
+        have = set(conn.execute(select(DataVersion.ledger_id, DataVersion.scope)).all())
+        missing = [{"ledger_id": ledger_id, "scope": f"expenses:{category}", "version": 1}
+                   for ledger_id, category in conn.execute(select(ExpenseRollup.ledger_id, ExpenseRollup.category)
+                                                           .where(ExpenseRollup.count > 0).distinct())
+                   if (ledger_id, f"expenses:{category}") not in have]
+        if missing:
+            conn.execute(insert(DataVersion), missing)
+
+def rescan_anomalies(ledger_id=None, bind=None):
+    """Rebuild rolling stats and anomaly flags from the full history in one vectorized pass"""
+    ledger_id = _ledger(ledger_id)
+    session = sessionmaker(bind=bind)() if bind else SessionLocal()
+    try:
+        rows = session.query(Expense.id, Expense.date, Expense.month, Expense.category, Expense.amount) \
+            .filter_by(ledger_id=ledger_id).filter(Expense.deleted_at.is_(None)).order_by(Expense.date, Expense.id).all()
+        session.query(SpendingAnomaly).filter_by(ledger_id=ledger_id).delete()
+        session.query(SpendingStat).filter_by(ledger_id=ledger_id).delete()
+        if not rows:
+            session.commit()
+            return 0
+
+        ids = np.array([r.id for r in rows])
+        dates = np.array([r.date for r in rows], dtype=object)
+        months = np.array([r.month for r in rows])
+        amounts = np.array([r.amount or 0.0 for r in rows], dtype=np.float64)
+        categories, cat_codes = np.unique(np.array([r.category or "" for r in rows]), return_inverse=True)
+        month_labels, month_codes = np.unique(months, return_inverse=True)
+
+        # Expense-level pass
+        scan = ewma_scan(cat_codes, amounts)
+        flagged = np.flatnonzero(flag_mask(scan.z, scan.prior_counts))
+        anomalies = [{
+            "ledger_id": ledger_id, "kind": "expense", "expense_id": int(ids[i]), "date": dates[i],
+            "month": str(months[i]), "category": str(categories[cat_codes[i]]), "amount": float(amounts[i]),
+            "expected": float(scan.expected[i]), "z_score": float(scan.z[i]),
+        } for i in flagged]
+
+        # Month-level pass over (category, month) totals; keys sort by category then month
+        keys, key_index = np.unique(cat_codes * len(month_labels) + month_codes, return_inverse=True)
+        totals = np.bincount(key_index, weights=amounts)
+        last_dates = {}
+        for i in range(len(rows)):
+            last_dates[key_index[i]] = dates[i]
+        key_cats, key_months = keys // len(month_labels), keys % len(month_labels)
+        month_scan = ewma_scan(key_cats, totals)
+        for k in np.flatnonzero(flag_mask(month_scan.z, month_scan.prior_counts)):
+            anomalies.append({
+                "ledger_id": ledger_id, "kind": "month", "expense_id": None, "date": last_dates[k],
+                "month": str(month_labels[key_months[k]]), "category": str(categories[key_cats[k]]),
+                "amount": float(totals[k]), "expected": float(month_scan.expected[k]),
+                "z_score": float(month_scan.z[k]),
+            })
+
+        # The latest month of each category is still running, so it stays out of the
+        # completed-month state, matching what the insert path maintains.
+        is_last = np.r_[key_cats[1:] != key_cats[:-1], True]
+        completed = ewma_scan(key_cats[~is_last], totals[~is_last])
+        completed_state = {int(c): (m, v, n) for c, m, v, n in zip(
+            completed.group_codes, completed.means, completed.variances, completed.counts)}
+
+        stats = []
+        for c, m, v, n in zip(scan.group_codes, scan.means, scan.variances, scan.counts):
+            last = np.flatnonzero(is_last & (key_cats == c))[0]
+            month_mean, month_var, month_count = completed_state.get(int(c), (0.0, 0.0, 0))
+            stats.append({
+                "ledger_id": ledger_id, "category": str(categories[c]), "count": int(n), "mean": float(m),
+                "var": float(v), "month_count": int(month_count), "month_mean": float(month_mean),
+                "month_var": float(month_var), "current_month": str(month_labels[key_months[last]]),
+                "current_total": float(totals[last]),
+            })
+
+        if anomalies:
+            session.execute(insert(SpendingAnomaly), anomalies)
+        session.execute(insert(SpendingStat), stats)
+        session.commit()
+        return len(anomalies)
+    finally:
+        session.close()
+
+def _backfill_spending_stats(bind):
+    """Scan the history of every ledger, so stats start from the data already there"""
+    with bind.connect() as conn:
+        ledgers = conn.execute(select(Expense.ledger_id).where(Expense.deleted_at.is_(None)).distinct()).scalars().all()
+    for ledger_id in ledgers:
+        rescan_anomalies(ledger_id, bind)
+
+def migrate(bind):
+    """Create or upgrade the schema behind engine `bind` (the app's database at
+    import; sync.py runs it on the shared database too)"""
+    existing_tables = set(inspect(bind).get_table_names())
+    for model in _RECREATED_FOR_LEDGER:
+        if model.__tablename__ in existing_tables and \
+                "ledger_id" not in {c["name"] for c in inspect(bind).get_columns(model.__tablename__)}:
+            _recreate_with_rows(bind, model)
+
+    Base.metadata.create_all(bind)
+    for model in LEDGER_TABLES:
+        _add_missing_columns(bind, model.__table__)
+    _backfill_uids(bind)
+    with bind.begin() as conn:
+        for name in _OBSOLETE_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    # create_all() skips tables that already exist, so add indexes introduced later explicitly
+    for model in LEDGER_TABLES:
+        for index in model.__table__.indexes:
+            index.create(bind, checkfirst=True)
+
+    # Backfill rollups for databases created before the table (or its date range columns) existed
+    with bind.connect() as conn:
+        needs_rollups = (conn.execute(select(ExpenseRollup.id).limit(1)).first() is None
+                         and conn.execute(select(Expense.id).limit(1)).first() is not None) or \
+            conn.execute(select(ExpenseRollup.id).where(ExpenseRollup.count > 0, ExpenseRollup.first_date.is_(None))
+                         .limit(1)).first() is not None
+    if needs_rollups:
+        rebuild_rollups(bind)
+    _backfill_expense_versions(bind)
+
+    if "change_log" not in existing_tables:
+        _snapshot_existing_months(bind)
+    if "spending_stats" not in existing_tables:
+        _backfill_spending_stats(bind)
+
+migrate(engine)
+
+# Fitted forecast parameters keyed by (ledger, category, data version, as_of date)
+_forecast_cache = {}
+_forecast_cache_lock = threading.Lock()
+
+# Read results shared by all sessions of this process, keyed by
+# (ledger_id, table, month, category, name). A change event drops only the
+# entries it can affect; table/month/category None means "depends on all".
+_read_cache = {}
+_read_cache_lock = threading.Lock()
+_read_cache_generation = 0
+
+# SQLite has no cross-process change events, so writes by other processes (the API,
+# recurring.py from cron, backup.py restore) are noticed through PRAGMA data_version
+# of a connection of its own, which moves whenever another connection commits
+_data_version_conn = None
+_data_version = None
+
+def _check_data_version():
+    """Drop the whole read cache if the SQLite file was committed to since the last read"""
+    global _data_version_conn, _data_version, _read_cache_generation
+    with _read_cache_lock:
+        if _data_version_conn is None:
+            _data_version_conn = engine.raw_connection()
+        cursor = _data_version_conn.cursor()
+        cursor.execute("PRAGMA data_version")
+        version = cursor.fetchone()[0]
+        cursor.close()
+        if version != _data_version:
+            _data_version = version
+            _read_cache_generation += 1
+            _read_cache.clear()
+
+def _cached(key, load):
+    """Return the cached result for key, calling load() on a miss"""
+    if engine.dialect.name == "sqlite":
+        _check_data_version()
+    with _read_cache_lock:
+        if key in _read_cache:
+            return _read_cache[key]
+        generation = _read_cache_generation
+    value = load()
+    with _read_cache_lock:
+        # Don't store a result that an invalidation raced with
+        if generation == _read_cache_generation:
+            _read_cache[key] = value
+    return value
+
+def _invalidate_read_cache(e):
+    global _read_cache_generation
+    with _read_cache_lock:
+        _read_cache_generation += 1
+        for key in list(_read_cache):
+            ledger_id, table, month, category, _ = key
+            if e["ledger_id"] is None or (
+                    ledger_id == e["ledger_id"]
+                    and table in (None, e["table"])
+                    and month in (None, e["month"])
+                    and (category is None or e["category"] is None or category == e["category"])):
+                del _read_cache[key]
+
+change_feed.subscribe(_invalidate_read_cache)
+change_feed.start_listener(engine)
+
+def _change(ledger_id, table, month, category=None):
+    return {"ledger_id": ledger_id, "table": table, "month": month, "category": category}
+
+def list_ledgers():
+    """Get the ids of all ledgers that have balances or expenses"""
     session = SessionLocal()
+    ledgers = session.query(Balance.ledger_id).distinct().all() + \
+        session.query(Expense.ledger_id).filter(Expense.deleted_at.is_(None)).distinct().all()
+    session.close()
+    return sorted(set([l[0] for l in ledgers]))
+
+def add_balance(month, prev_balance, this_month, ledger_id=None):
+    ledger_id = _ledger(ledger_id)
+    session = SessionLocal()
+    _upsert_balance(session, ledger_id, month, prev_balance, this_month, datetime.datetime.now())
+    session.commit()
+    session.close()
+
+def _upsert_balance(session, ledger_id, month, prev_balance, this_month, updated_at):
+    """Insert or update a month's balance, with its change log entry, version bump and change event"""
     total_balance = prev_balance + this_month
-    bal = session.query(Balance).filter_by(month=month).first()
+    bal = session.query(Balance).filter_by(ledger_id=ledger_id, month=month).first()
     if bal:
         bal.prev_balance = prev_balance
         bal.this_month = this_month
         bal.total_balance = total_balance
+        bal.updated_at = updated_at
+        op = "update"
     else:
-        bal = Balance(month=month, prev_balance=prev_balance, this_month=this_month, total_balance=total_balance)
+        bal = Balance(ledger_id=ledger_id, month=month, prev_balance=prev_balance, this_month=this_month,
+                      total_balance=total_balance, updated_at=updated_at)
         session.add(bal)
+        session.flush()
+        op = "insert"
+    _log_changes(session, [(ledger_id, "balances", bal.id, month, op, _balance_row(bal))])
+    _bump_versions(session, [(ledger_id, "balances")])
+    change_feed.publish(session, [_change(ledger_id, "balances", month)])
+
+def get_balance(month, ledger_id=None):
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        bal = session.query(Balance).filter_by(ledger_id=ledger_id, month=month).first()
+        session.close()
+        return bal
+    return _cached((ledger_id, "balances", month, None, "get_balance"), load)
+
+def list_balances(ledger_id=None):
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        bals = session.query(Balance).filter_by(ledger_id=ledger_id).order_by(Balance.month.desc()).all()
+        session.close()
+        return bals
+    return _cached((ledger_id, "balances", None, None, "list_balances"), load)
+
+def add_expense(date, month, category, tag, amount, ledger_id=None):
+    """Add an expense; returns an over-budget warning message or None.
+
+    With write-behind enabled the expense is queued instead (visible to reads
+    right away) and no budget check is done.
+    """
+    ledger_id = _ledger(ledger_id)
+    if write_queue:
+        write_queue.submit(ledger_id, date, month, category, tag, amount)
+        return None
+    session = SessionLocal()
+    exp = Expense(ledger_id=ledger_id, date=date, month=month, category=category, tag=tag, amount=amount)
+    session.add(exp)
+    session.flush()
+    _apply_new_expenses(session, [exp])
+    warning = _check_budget(session, ledger_id, month, category)
     session.commit()
     session.close()
+    return warning
+
+def add_expenses_batch(rows, ledger_id=None):
+    """Insert many expenses with one multi-row INSERT; returns their ids.
 
-def get_balance(month):
+    Each row is a dict with date, category, amount and optionally month, tag
+    and ledger_id (defaulting to the date's month and the current ledger).
+    """
     session = SessionLocal()
-    bal = session.query(Balance).filter_by(month=month).first()
+    exps = [Expense(ledger_id=row.get("ledger_id") or _ledger(ledger_id), date=row["date"],
+                    month=row.get("month") or row["date"].strftime("%Y-%m"), category=row["category"],
+                    tag=row.get("tag"), amount=row["amount"]) for row in rows]
+    if not exps:
+        session.close()
+        return []
+    session.add_all(exps)
+    session.flush()
+    _apply_new_expenses(session, exps)
+    session.commit()
+    ids = [e.id for e in exps]
     session.close()
-    return bal
+    return ids
+
+def _write_queued_expenses(rows):
+    """Write one ledger's queued expenses with that ledger as the current ledger
+    (the flush thread's own context has none, and the RLS hook scopes sessions to it)"""
+    token = _current_ledger.set(rows[0]["ledger_id"])
+    try:
+        add_expenses_batch(rows)
+    finally:
+        _current_ledger.reset(token)
+
+# Optional write-behind batching for add_expense (see write_queue.py)
+write_queue = None
+if os.getenv("EXPENSE_WRITE_BEHIND") == "1":
+    write_queue = ExpenseWriteQueue(
+        _write_queued_expenses,
+        max_rows=int(os.getenv("WRITE_BEHIND_MAX_ROWS", "500")),
+        max_seconds=float(os.getenv("WRITE_BEHIND_MAX_SECONDS", "0.5")),
+        spill_path=os.getenv("WRITE_BEHIND_SPILL_PATH", "write_behind_spill.jsonl"))
+
+def _pending_expenses(ledger_id, month=None, category=None):
+    """Queued expenses not yet committed, so reads show them right away"""
+    return write_queue.pending(ledger_id, month, category) if write_queue else []
+
+def _apply_new_expenses(session, expenses):
+    """Update rolling stats, data versions and rollups for freshly flushed expenses,
+    with one round trip per table however many expenses (and ledgers) there are"""
+    keys = {(e.ledger_id, e.category) for e in expenses}
+    stats = {(stat.ledger_id, stat.category): stat for stat in session.query(SpendingStat).filter(
+        SpendingStat.ledger_id.in_({l for l, _ in keys}),
+        SpendingStat.category.in_({c for _, c in keys})).with_for_update()}
+    for exp in sorted(expenses, key=lambda e: (e.date, e.id)):
+        key = (exp.ledger_id, exp.category)
+        if key not in stats:
+            stats[key] = SpendingStat(ledger_id=exp.ledger_id, category=exp.category, count=0, mean=0.0, var=0.0,
+                                      month_count=0, month_mean=0.0, month_var=0.0,
+                                      current_month=exp.month, current_total=0.0)
+            session.add(stats[key])
+        _record_spending_stats(session, exp, stats[key])
+
+    _bump_versions(session, [(ledger_id, f"expenses:{category}") for ledger_id, category in keys])
+
+    deltas = {}
+    for exp in expenses:
+        key = (exp.ledger_id, exp.month, exp.category)
+        total, count, first, last = deltas.get(key, (0.0, 0, exp.date, exp.date))
+        deltas[key] = (total + exp.amount, count + 1, min(first, exp.date), max(last, exp.date))
+    _update_rollups(session, deltas)
+    _log_changes(session, [(e.ledger_id, "expenses", e.id, e.month, "insert", _expense_row(e)) for e in expenses])
+    change_feed.publish(session, [_change(ledger_id, "expenses", month, category)
+                                  for ledger_id, month, category in deltas])
+
+# Recorded as change_log.source; sync.py sets it while copying changes between databases
+_log_source = contextvars.ContextVar("log_source", default=None)
+
+def _log_changes(session, changes):
+    """Append (ledger, table, row id, month, op, row data) changes to change_log, and snapshot
+    every touched month whose log grew SNAPSHOT_EVERY entries past its last snapshot"""
+    now = datetime.datetime.now()
+    source = _log_source.get()
+    session.add_all([ChangeLog(ledger_id=ledger_id, changed_at=now, table_name=table, row_id=row_id, month=month,
+                               op=op, data=json.dumps(data) if data is not None else None, source=source)
+                     for ledger_id, table, row_id, month, op, data in changes])
+    session.flush()
+    for ledger_id, month in {(c[0], c[3]) for c in changes}:
+        last = session.query(func.max(MonthSnapshot.log_id)).filter_by(ledger_id=ledger_id, month=month).scalar() or 0
+        count, newest = session.query(func.count(ChangeLog.id), func.max(ChangeLog.id)).filter(
+            ChangeLog.ledger_id == ledger_id, ChangeLog.month == month, ChangeLog.id > last).one()
+        if count >= SNAPSHOT_EVERY:
+            session.add(MonthSnapshot(ledger_id=ledger_id, month=month, log_id=newest, taken_at=now,
+                                      data=json.dumps(_month_state(session, ledger_id, month))))
 
-def list_balances():
+def _update_rollups(session, deltas):
+    """Apply {(ledger, month, category): (amount, count, first date, last date)} deltas to the rollups.
+
+    For removals (negative count) the dates are those of the removed expenses;
+    the date range is only recomputed when one of them was on its edge.
+    """
+    rollups = {(r.ledger_id, r.month, r.category): r for r in session.query(ExpenseRollup).filter(
+        ExpenseRollup.ledger_id.in_({k[0] for k in deltas}),
+        ExpenseRollup.month.in_({k[1] for k in deltas}),
+        ExpenseRollup.category.in_({k[2] for k in deltas})).with_for_update()}
+    for key, (amount, count, first, last) in deltas.items():
+        rollup = rollups.get(key)
+        if rollup is None:
+            session.add(ExpenseRollup(ledger_id=key[0], month=key[1], category=key[2], total=amount, count=count,
+                                      first_date=first, last_date=last))
+            continue
+        rollup.total += amount
+        rollup.count += count
+        if count > 0:
+            rollup.first_date = min(rollup.first_date or first, first)
+            rollup.last_date = max(rollup.last_date or last, last)
+        elif rollup.count <= 0:
+            rollup.first_date = rollup.last_date = None
+        elif first == rollup.first_date or last == rollup.last_date:
+            rollup.first_date, rollup.last_date = session.query(func.min(Expense.date), func.max(Expense.date)).filter(
+                Expense.ledger_id == key[0], Expense.month == key[1], Expense.category == key[2],
+                Expense.deleted_at.is_(None)).one()
+    session.flush()
+
+def _check_budget(session, ledger_id, month, category):
+    """Compare spend-to-date from the rollups against the month and category budgets"""
+    budgets = session.query(Budget).filter(
+        Budget.ledger_id == ledger_id, Budget.month == month,
+        (Budget.category == category) | (Budget.category.is_(None))).all()
+    if not budgets:
+        return None
+    spent = dict(session.query(ExpenseRollup.category, ExpenseRollup.total)
+                 .filter_by(ledger_id=ledger_id, month=month).all())
+    warnings = []
+    for budget in sorted(budgets, key=lambda b: b.category is not None):
+        to_date = spent.get(category, 0.0) if budget.category else sum(spent.values())
+        if to_date > budget.amount:
+            scope = f"{category} budget" if budget.category else "monthly budget"
+            used = f" ({to_date / budget.amount * 100:.0f}%)" if budget.amount else ""
+            warnings.append(f"Over {scope} for {month}: spent ₹{to_date:,.2f} of ₹{budget.amount:,.2f}{used}")
+    return " · ".join(warnings) or None
+
+def set_budget(month, amount, category=None, ledger_id=None):
+    """Set (or clear, with amount=None) the budget for a month or a month's category"""
+    ledger_id = _ledger(ledger_id)
+    session = SessionLocal()
+    budget = session.query(Budget).filter_by(ledger_id=ledger_id, month=month, category=category).first()
+    if amount is None:
+        if budget:
+            session.delete(budget)
+    elif budget:
+        budget.amount = amount
+    else:
+        session.add(Budget(ledger_id=ledger_id, month=month, category=category, amount=amount))
+    session.commit()
+    session.close()
+
+def _add_pending_spend(spent, ledger_id, month):
+    """Add the queued (write-behind) expenses of a month to a {category: spent} dict"""
+    for e in _pending_expenses(ledger_id, month):
+        spent[e.category] = (spent.get(e.category) or 0.0) + e.amount
+
+def get_budget_status(month, ledger_id=None):
+    """Get each budget for a month with its spend-to-date"""
+    ledger_id = _ledger(ledger_id)
     session = SessionLocal()
-    bals = session.query(Balance).order_by(Balance.month.desc()).all()
+    budgets = session.query(Budget).filter_by(ledger_id=ledger_id, month=month).all()
+    spent = dict(session.query(ExpenseRollup.category, ExpenseRollup.total)
+                 .filter_by(ledger_id=ledger_id, month=month).all())
     session.close()
-    return bals
+    _add_pending_spend(spent, ledger_id, month)
+    status = []
+    for budget in sorted(budgets, key=lambda b: (b.category is not None, b.category or "")):
+        to_date = spent.get(budget.category, 0.0) if budget.category else sum(spent.values())
+        status.append({
+            'category': budget.category or "All categories",
+            'budget': budget.amount,
+            'spent': to_date,
+            'left': budget.amount - to_date,
+            'used_percentage': round(to_date / budget.amount * 100, 2) if budget.amount else 0.0
+        })
+    return status
+
+def _bump_versions(session, keys):
+    """Increment the write counters for (ledger, scope) pairs"""
+    keys = set(keys)
+    rows = [row for row in session.query(DataVersion).filter(
+        DataVersion.ledger_id.in_({l for l, _ in keys}),
+        DataVersion.scope.in_({s for _, s in keys})).with_for_update()
+        if (row.ledger_id, row.scope) in keys]
+    for row in rows:
+        row.version += 1
+    for ledger_id, scope in keys - {(row.ledger_id, row.scope) for row in rows}:
+        session.add(DataVersion(ledger_id=ledger_id, scope=scope, version=1))
 
-def add_expense(date, month, category, tag, amount):
+def add_recurring_rule(category, tag, amount, cadence, day, start_date, end_date=None, ledger_id=None):
+    """Add a recurring expense rule; occurrences are created by materialize_recurring()"""
+    if cadence not in recurring.CADENCES:
+        raise ValueError(f"cadence must be one of {recurring.CADENCES}")
     session = SessionLocal()
-    exp = Expense(date=date, month=month, category=category, tag=tag, amount=amount)
-    session.add(exp)
+    rule = RecurringRule(ledger_id=_ledger(ledger_id), category=category, tag=tag, amount=amount, cadence=cadence,
+                         day=day, start_date=start_date, end_date=end_date, active=True)
+    session.add(rule)
     session.commit()
     session.close()
 
-def get_expenses(month):
+def list_recurring_rules(ledger_id=None):
     session = SessionLocal()
-    exps = session.query(Expense).filter_by(month=month).all()
+    rules = session.query(RecurringRule).filter_by(ledger_id=_ledger(ledger_id)) \
+        .order_by(RecurringRule.active.desc(), RecurringRule.category).all()
     session.close()
-    return exps
+    return rules
 
-def list_expense_months():
+def set_recurring_rule_active(rule_id, active, ledger_id=None):
+    """Pause or resume a recurring rule.
+
+    Occurrences due up to the pause are created first, and resuming moves
+    materialized_through to today, so the periods in between are skipped
+    rather than caught up.
+    """
+    ledger_id = _ledger(ledger_id)
+    today = datetime.date.today()
+    if not active:
+        materialize_recurring(today, ledger_id)
     session = SessionLocal()
-    months = session.query(Expense.month).distinct().all()
+    rule = session.query(RecurringRule).filter_by(ledger_id=ledger_id, id=rule_id).first()
+    if rule:
+        if active and not rule.active:
+            rule.materialized_through = max(rule.materialized_through or today, today)
+        rule.active = active
+        session.commit()
     session.close()
-    return sorted(set([m[0] for m in months]))
+    return rule is not None
 
-def get_all_expenses():
-    """Get all expenses across all months"""
+def add_category_rule(category, kind, pattern=None, min_amount=None, max_amount=None, priority=0, ledger_id=None):
+    """Add an auto-categorization rule; raises ValueError if it can't match anything"""
+    categorizer.validate(kind, pattern, min_amount, max_amount)
+    ledger_id = _ledger(ledger_id)
     session = SessionLocal()
-    exps = session.query(Expense).order_by(Expense.date.desc()).all()
+    session.add(CategoryRule(ledger_id=ledger_id, category=category, kind=kind,
+                             pattern=pattern.strip() if pattern else None, min_amount=min_amount,
+                             max_amount=max_amount, priority=priority))
+    change_feed.publish(session, [_change(ledger_id, "category_rules", None)])
+    session.commit()
     session.close()
-    return exps
 
-def get_expenses_by_category(category=None, month=None):
+def list_category_rules(ledger_id=None):
+    session = SessionLocal()
+    rules = session.query(CategoryRule).filter_by(ledger_id=_ledger(ledger_id)) \
+        .order_by(CategoryRule.priority.desc(), CategoryRule.id).all()
+    session.close()
+    return rules
+
+def delete_category_rule(rule_id, ledger_id=None):
+    ledger_id = _ledger(ledger_id)
+    session = SessionLocal()
+    deleted = session.query(CategoryRule).filter_by(ledger_id=ledger_id, id=rule_id).delete()
+    change_feed.publish(session, [_change(ledger_id, "category_rules", None)])
+    session.commit()
+    session.close()
+    return deleted > 0
+
+def get_categorizer(ledger_id=None):
+    """The ledger's rules and learned tag -> category frequencies, compiled into a Categorizer"""
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        rules = [categorizer.Rule(r.id, r.category, r.kind, r.pattern, r.min_amount, r.max_amount, r.priority)
+                 for r in session.query(CategoryRule).filter_by(ledger_id=ledger_id)]
+        pairs = session.query(Expense.tag, Expense.category, func.count(Expense.id)).filter(
+            Expense.ledger_id == ledger_id, Expense.deleted_at.is_(None), Expense.tag.isnot(None), Expense.tag != "") \
+            .group_by(Expense.tag, Expense.category).all()
+        session.close()
+        return categorizer.Categorizer(rules, pairs)
+    # Learned pairs change with every expense write, so any change in the ledger invalidates it
+    return _cached((ledger_id, None, None, None, "categorizer"), load)
+
+def materialize_recurring(through=None, ledger_id=None):
+    """Insert every due recurring expense up to `through` (default: today) in one batch.
+
+    Covers every ledger unless ledger_id is given. Occurrences are keyed on
+    (rule, period), so missed periods are caught up in the same pass and reruns
+    (or a concurrent run) never duplicate them. Returns the number of expenses added.
+    """
+    through = through or datetime.date.today()
+    session = SessionLocal()
+    try:
+        query = session.query(RecurringRule).filter(
+            RecurringRule.active.is_(True),
+            RecurringRule.materialized_through.is_(None) | (RecurringRule.materialized_through < through))
+        if ledger_id:
+            query = query.filter_by(ledger_id=ledger_id)
+        due = []
+        for rule in query.all():
+            for period, date in recurring.due_occurrences(rule.cadence, rule.day, rule.start_date, rule.end_date,
+                                                          rule.materialized_through, through):
+                due.append((rule, period, date))
+            rule.materialized_through = through
+
+        new = []
+        if due:
+            # Deleted occurrences count too, so deleting a generated expense doesn't bring it back
+            existing = set(session.query(Expense.rule_id, Expense.period).filter(
+                Expense.rule_id.in_({rule.id for rule, _, _ in due}),
+                Expense.period.in_({period for _, period, _ in due})).all())
+            new = [Expense(ledger_id=rule.ledger_id, date=date, month=date.strftime("%Y-%m"), category=rule.category,
+                           tag=rule.tag, amount=rule.amount, rule_id=rule.id, period=period)
+                   for rule, period, date in due if (rule.id, period) not in existing]
+        if new:
+            session.add_all(new)
+            session.flush()
+            _apply_new_expenses(session, new)
+        session.commit()
+        return len(new)
+    except IntegrityError:
+        # Another process materialized the same occurrences first
+        session.rollback()
+        return 0
+    finally:
+        session.close()
+
+def get_data_versions(prefix="", ledger_id=None):
+    """Get {scope: version} for all scopes starting with prefix"""
+    session = SessionLocal()
+    rows = session.query(DataVersion).filter(DataVersion.ledger_id == _ledger(ledger_id),
+                                             DataVersion.scope.startswith(prefix)).all()
+    session.close()
+    return {r.scope: r.version for r in rows}
+
+def _record_spending_stats(session, exp, stat):
+    """Fold a new expense into its category's rolling stats and flag outliers in O(1)"""
+    # Expense-level outliers
+    prior_count, expected = stat.count, stat.mean
+    stat.mean, stat.var, stat.count, z = ewma_update(stat.mean, stat.var, stat.count, exp.amount)
+    if is_anomaly(z, prior_count):
+        session.add(SpendingAnomaly(ledger_id=exp.ledger_id, kind="expense", expense_id=exp.id, date=exp.date,
+                                    month=exp.month, category=exp.category, amount=exp.amount,
+                                    expected=expected, z_score=z))
+
+    # Month-level outliers: the running month total is scored against the EWMA of
+    # completed months. Back-dated expenses only count towards the expense stats;
+    # rescan_anomalies() places them correctly.
+    if exp.month > stat.current_month:
+        stat.month_mean, stat.month_var, stat.month_count, _ = ewma_update(
+            stat.month_mean, stat.month_var, stat.month_count, stat.current_total)
+        stat.current_month = exp.month
+        stat.current_total = 0.0
+    if exp.month == stat.current_month:
+        stat.current_total += exp.amount
+        z = zscore(stat.current_total, stat.month_mean, stat.month_var)
+        if is_anomaly(z, stat.month_count):
+            flagged = session.query(SpendingAnomaly).filter_by(
+                ledger_id=exp.ledger_id, kind="month", month=exp.month, category=exp.category).first()
+            if not flagged:
+                flagged = SpendingAnomaly(ledger_id=exp.ledger_id, kind="month", month=exp.month, category=exp.category)
+                session.add(flagged)
+            flagged.date = exp.date
+            flagged.amount = stat.current_total
+            flagged.expected = stat.month_mean
+            flagged.z_score = z
+
+# Reads return ExpenseRow records (read_model.py) built from these columns, not ORM instances
+_EXPENSE_ROW_COLUMNS = [Expense.id, Expense.ledger_id, Expense.date, Expense.month, Expense.category,
+                        Expense.tag, Expense.amount]
+
+def _expense_rows(query):
+    return [ExpenseRow(*r) for r in query]
+
+def get_expenses(month, ledger_id=None):
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        exps = _expense_rows(session.query(*_EXPENSE_ROW_COLUMNS).filter_by(ledger_id=ledger_id, month=month)
+                             .filter(Expense.deleted_at.is_(None)))
+        session.close()
+        return exps
+    return _cached((ledger_id, "expenses", month, None, "get_expenses"), load) + _pending_expenses(ledger_id, month)
+
+def get_expense_index(ledger_id=None):
+    """Get the months and categories that have expenses and the first/last expense date.
+
+    Read from the rollups (one row per month and category, kept current on
+    every write) and cached until the ledger's expenses change, so page
+    selectors don't scan the expenses table.
+    """
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        rows = session.query(ExpenseRollup.month, ExpenseRollup.category, ExpenseRollup.first_date,
+                             ExpenseRollup.last_date).filter(ExpenseRollup.ledger_id == ledger_id,
+                                                             ExpenseRollup.count > 0).all()
+        session.close()
+        return ExpenseIndex(sorted({r.month for r in rows if r.month}),
+                            sorted({r.category for r in rows if r.category}),
+                            min((r.first_date for r in rows if r.first_date), default=None),
+                            max((r.last_date for r in rows if r.last_date), default=None))
+    index = _cached((ledger_id, "expenses", None, None, "get_expense_index"), load)
+    pending = _pending_expenses(ledger_id)
+    if pending:
+        dates = [e.date for e in pending] + [d for d in (index.first_date, index.last_date) if d]
+        index = ExpenseIndex(sorted(set(index.months) | {e.month for e in pending}),
+                             sorted(set(index.categories) | {e.category for e in pending}),
+                             min(dates), max(dates))
+    return index
+
+def list_expense_months(ledger_id=None):
+    return get_expense_index(ledger_id).months
+
+def get_all_expenses(ledger_id=None):
+    """Get all expenses across all months"""
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        exps = _expense_rows(session.query(*_EXPENSE_ROW_COLUMNS).filter_by(ledger_id=ledger_id)
+                             .filter(Expense.deleted_at.is_(None)).order_by(Expense.date.desc()))
+        session.close()
+        return exps
+    exps = _cached((ledger_id, "expenses", None, None, "get_all_expenses"), load)
+    pending = _pending_expenses(ledger_id)
+    return sorted(exps + pending, key=lambda e: e.date, reverse=True) if pending else exps
+
+def get_expenses_by_category(category=None, month=None, ledger_id=None):
     """Get expenses filtered by category and/or month"""
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        query = session.query(*_EXPENSE_ROW_COLUMNS).filter_by(ledger_id=ledger_id).filter(Expense.deleted_at.is_(None))
+        if category:
+            query = query.filter_by(category=category)
+        if month:
+            query = query.filter_by(month=month)
+        exps = _expense_rows(query.order_by(Expense.date.desc()))
+        session.close()
+        return exps
+    exps = _cached((ledger_id, "expenses", month, category, "get_expenses_by_category"), load)
+    pending = _pending_expenses(ledger_id, month, category)
+    return sorted(exps + pending, key=lambda e: e.date, reverse=True) if pending else exps
+
+# Ledgers with at least this many expenses are aggregated across a process pool
+PARALLEL_AGG_MIN_ROWS = int(os.getenv("PARALLEL_AGG_MIN_ROWS", "200000"))
+PARALLEL_AGG_WORKERS = int(os.getenv("PARALLEL_AGG_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+def get_category_month_stats(ledger_id=None):
+    """Get a DataFrame of spend total, count and sum of squares per (month, category).
+
+    Above PARALLEL_AGG_MIN_ROWS expenses the months are split into shards of
+    similar size that worker processes aggregate in parallel (parallel_agg.py);
+    smaller ledgers run the same query in-process.
+    """
+    ledger_id = _ledger(ledger_id)
+    def load():
+        session = SessionLocal()
+        month_counts = session.query(ExpenseRollup.month, func.sum(ExpenseRollup.count)) \
+            .filter(ExpenseRollup.ledger_id == ledger_id).group_by(ExpenseRollup.month) \
+            .order_by(ExpenseRollup.month).all()
+        session.close()
+        rows = sum(count or 0 for _, count in month_counts)
+        workers = PARALLEL_AGG_WORKERS if rows >= PARALLEL_AGG_MIN_ROWS else 1
+        shards = parallel_agg.plan_shards(month_counts, workers)
+        if len(shards) > 1:
+            try:
+                return parallel_agg.merge(parallel_agg.run_sharded(DB_URL, ledger_id, shards, workers))
+            except BrokenProcessPool:
+                pass  # a worker died; aggregate in-process this time
+        with engine.connect() as conn:
+            return parallel_agg.merge([parallel_agg.aggregate_shard(conn, ledger_id, first, last)
+                                       for first, last in shards])
+    stats = _cached((ledger_id, "expenses", None, None, "get_category_month_stats"), load)
+    pending = _pending_expenses(ledger_id)
+    if pending:
+        stats = parallel_agg.merge([stats.itertuples(index=False, name=None),
+                                    [(e.month, e.category, e.amount, 1, e.amount * e.amount) for e in pending]])
+    return stats
+
+def get_expense_columns(category=None, month=None, ledger_id=None):
+    """Get the expenses of get_expenses_by_category as NumPy columns (see read_model.py)"""
+    ledger_id = _ledger(ledger_id)
+    rows = get_expenses_by_category(category, month, ledger_id)
+    if _pending_expenses(ledger_id, month, category):
+        return ExpenseColumns.from_rows(rows)
+    return _cached((ledger_id, "expenses", month, category, "get_expense_columns"),
+                   lambda: ExpenseColumns.from_rows(rows))
+
+def _fitted_forecasts(session, ledger_id, as_of):
+    """Get {category: FitParams}, refitting only categories whose data version changed"""
+    versions = {r.scope.split(":", 1)[1]: r.version for r in session.query(DataVersion).filter(
+        DataVersion.ledger_id == ledger_id, DataVersion.scope.startswith("expenses:")).all()}
+    fitted = {}
+    stale = []
+    with _forecast_cache_lock:
+        for category, version in versions.items():
+            params = _forecast_cache.get((ledger_id, category, version, as_of))
+            if params is None:
+                stale.append(category)
+            else:
+                fitted[category] = params
+
+    if stale:
+        start = as_of - datetime.timedelta(days=forecast.LOOKBACK_DAYS - 1)
+        rows = session.query(Expense.category, Expense.date, func.sum(Expense.amount)) \
+            .filter(Expense.ledger_id == ledger_id, Expense.category.in_(stale), Expense.deleted_at.is_(None),
+                    Expense.date >= start, Expense.date <= as_of) \
+            .group_by(Expense.category, Expense.date).all()
+        codes = {category: i for i, category in enumerate(stale)}
+        series = forecast.daily_matrix([codes[r[0]] for r in rows], [r[1] for r in rows],
+                                       [r[2] or 0.0 for r in rows], len(stale), start, as_of)
+        fits = forecast.fit(series, as_of)
+        # Sessions and API threads share the cache
+        with _forecast_cache_lock:
+            for category, params in zip(stale, fits):
+                _forecast_cache[(ledger_id, category, versions[category], as_of)] = params
+                fitted[category] = params
+            # Drop this ledger's entries superseded by newer versions or dates
+            for key in [k for k in _forecast_cache if k[0] == ledger_id and
+                        (versions.get(k[1]) != k[2] or k[3] != as_of)]:
+                del _forecast_cache[key]
+    return fitted
+
+def get_spending_forecast(month=None, as_of=None, ledger_id=None):
+    """Get projected month-end spend per category for a month (default: current month)"""
+    ledger_id = _ledger(ledger_id)
+    as_of = as_of or datetime.date.today()
+    month = month or as_of.strftime("%Y-%m")
     session = SessionLocal()
-    query = session.query(Expense)
-    if category:
-        query = query.filter_by(category=category)
-    if month:
-        query = query.filter_by(month=month)
-    exps = query.order_by(Expense.date.desc()).all()
+    fitted = _fitted_forecasts(session, ledger_id, as_of)
+    spent = dict(session.query(Expense.category, func.sum(Expense.amount))
+                 .filter_by(ledger_id=ledger_id, month=month).filter(Expense.deleted_at.is_(None))
+                 .group_by(Expense.category).all())
     session.close()
-    return exps
+    _add_pending_spend(spent, ledger_id, month)
+
+    result = {}
+    for category in sorted(set(fitted) | set(spent)):
+        to_date = spent.get(category) or 0.0
+        expected = forecast.remaining_month_forecast(fitted[category], month, as_of) if category in fitted else 0.0
+        result[category] = {"spent": to_date, "forecast_remaining": expected, "projected": to_date + expected}
+    return result
 
-def get_monthly_summary():
+def get_monthly_summary(ledger_id=None):
     """Get summary data for all months"""
+    ledger_id = _ledger(ledger_id)
+    # Queued expenses aren't part of the cached result, so don't cache while there are any
+    pending = _pending_expenses(ledger_id)
+    if pending:
+        return _load_monthly_summary(ledger_id, pending)
+    # Projections depend on today's date as well as the data
+    return _cached((ledger_id, None, None, None, f"get_monthly_summary:{datetime.date.today()}"),
+                   lambda: _load_monthly_summary(ledger_id))
+
+def _load_monthly_summary(ledger_id, pending=()):
     session = SessionLocal()
     # Get all months that have either balances or expenses
-    balance_months = session.query(Balance.month).distinct().all()
-    expense_months = session.query(Expense.month).distinct().all()
-    all_months = sorted(set([m[0] for m in balance_months + expense_months]))
-    
+    balance_months = session.query(Balance.month).filter_by(ledger_id=ledger_id).distinct().all()
+    expense_months = session.query(Expense.month).filter_by(ledger_id=ledger_id) \
+        .filter(Expense.deleted_at.is_(None)).distinct().all()
+    all_months = sorted(set([m[0] for m in balance_months + expense_months] + [e.month for e in pending]))
+
+    # Month-end projections only matter for the current and future months
+    as_of = datetime.date.today()
+    current_month = as_of.strftime("%Y-%m")
+    fitted = _fitted_forecasts(session, ledger_id, as_of) if all_months and all_months[-1] >= current_month else {}
+
     summary_data = []
     for month in all_months:
         # Get balance for this month
-        bal = session.query(Balance).filter_by(month=month).first()
+        bal = session.query(Balance).filter_by(ledger_id=ledger_id, month=month).first()
         total_balance = bal.total_balance if bal else 0.0
-        
+
         # Get expenses for this month
-        expenses = session.query(Expense).filter_by(month=month).all()
+        expenses = session.query(Expense).filter_by(ledger_id=ledger_id, month=month) \
+            .filter(Expense.deleted_at.is_(None)).all() + [e for e in pending if e.month == month]
         total_spent = sum([e.amount for e in expenses]) if expenses else 0.0
         remaining = total_balance - total_spent
-        
+
+        forecast_remaining = 0.0
+        if month >= current_month:
+            forecast_remaining = sum(forecast.remaining_month_forecast(p, month, as_of) for p in fitted.values())
+
         summary_data.append({
             'month': month,
             'total_balance': total_balance,
             'total_spent': total_spent,
             'remaining': remaining,
+            'expected_remaining': remaining - forecast_remaining,
             'expense_count': len(expenses)
         })
-    
+
     session.close()
     return summary_data
 
-def delete_expense(expense_id):
-    """Delete an expense by ID"""
+def delete_expense(expense_id, ledger_id=None):
+    """Delete an expense by ID (soft delete: the row is kept for the change history)"""
+    ledger_id = _ledger(ledger_id)
     session = SessionLocal()
     try:
-        expense = session.query(Expense).filter_by(id=expense_id).first()
+        expense = session.query(Expense).filter_by(ledger_id=ledger_id, id=expense_id) \
+            .filter(Expense.deleted_at.is_(None)).first()
         if expense:
-            session.delete(expense)
+            _soft_delete_expense(session, expense)
             session.commit()
             session.close()
             return True
@@ -143,9 +1230,80 @@ def delete_expense(expense_id):
         session.close()
         return False
 
-def get_expense_by_id(expense_id):
+def _soft_delete_expense(session, expense):
+    """Mark a live expense deleted and take it out of the rollups, anomalies and caches"""
+    session.query(SpendingAnomaly).filter_by(ledger_id=expense.ledger_id, kind="expense", expense_id=expense.id).delete()
+    _bump_versions(session, [(expense.ledger_id, f"expenses:{expense.category}")])
+    expense.deleted_at = datetime.datetime.now()
+    _update_rollups(session, {(expense.ledger_id, expense.month, expense.category):
+                              (-expense.amount, -1, expense.date, expense.date)})
+    _log_changes(session, [(expense.ledger_id, "expenses", expense.id, expense.month, "delete", {"uid": expense.uid})])
+    change_feed.publish(session, [_change(expense.ledger_id, "expenses", expense.month, expense.category)])
+
+def get_expense_by_id(expense_id, ledger_id=None):
     """Get a specific expense by ID"""
     session = SessionLocal()
-    expense = session.query(Expense).filter_by(id=expense_id).first()
+    expense = session.query(*_EXPENSE_ROW_COLUMNS).filter_by(ledger_id=_ledger(ledger_id), id=expense_id) \
+        .filter(Expense.deleted_at.is_(None)).first()
+    expense = ExpenseRow(*expense) if expense else None
+    session.close()
+    return expense
+
+def get_month_as_of(month, as_of, ledger_id=None):
+    """Reconstruct a month's balance and expenses as they were at `as_of` (a datetime).
+
+    Starts from the month's latest snapshot taken by then and replays the
+    change log entries after it, so the work is bounded by SNAPSHOT_EVERY.
+    """
+    ledger_id = _ledger(ledger_id)
+    session = SessionLocal()
+    snap = session.query(MonthSnapshot).filter(
+        MonthSnapshot.ledger_id == ledger_id, MonthSnapshot.month == month, MonthSnapshot.taken_at <= as_of) \
+        .order_by(MonthSnapshot.log_id.desc()).first()
+    changes = session.query(ChangeLog).filter(
+        ChangeLog.ledger_id == ledger_id, ChangeLog.month == month,
+        ChangeLog.id > (snap.log_id if snap else 0), ChangeLog.changed_at <= as_of).order_by(ChangeLog.id).all()
+    session.close()
+
+    state = json.loads(snap.data) if snap else {"balance": None, "expenses": []}
+    balance = state["balance"]
+    expenses = {e["id"]: e for e in state["expenses"]}
+    for change in changes:
+        if change.table_name == "balances":
+            balance = json.loads(change.data)
+        elif change.op == "delete":
+            expenses.pop(change.row_id, None)
+        else:
+            expenses[change.row_id] = json.loads(change.data)
+    return {"month": month, "as_of": as_of, "balance": balance,
+            "expenses": sorted(expenses.values(), key=lambda e: (e["date"], e["id"]), reverse=True)}
+
+def get_anomalies(kind=None, month=None, ledger_id=None):
+    """Get flagged anomalies, most recent first"""
+    session = SessionLocal()
+    query = session.query(SpendingAnomaly).filter_by(ledger_id=_ledger(ledger_id))
+    if kind:
+        query = query.filter_by(kind=kind)
+    if month:
+        query = query.filter_by(month=month)
+    anomalies = query.order_by(SpendingAnomaly.month.desc(), SpendingAnomaly.z_score.desc()).all()
+    session.close()
+    return anomalies
+
+def get_sync_conflicts(ledger_id=None):
+    """Balance conflicts found by offline-first sync that haven't been dismissed, newest first"""
+    session = SessionLocal()
+    conflicts = session.query(SyncConflict).filter_by(ledger_id=_ledger(ledger_id), dismissed=False) \
+        .order_by(SyncConflict.detected_at.desc()).all()
+    session.close()
+    return conflicts
+
+def dismiss_sync_conflict(conflict_id, ledger_id=None):
+    session = SessionLocal()
+    session.query(SyncConflict).filter_by(ledger_id=_ledger(ledger_id), id=conflict_id).update({"dismissed": True})
+    session.commit()
     session.close()
-    return expense
\ No newline at end of file
+
+# Offline-first mode: sync the local database with the shared one in the background
+if SYNC_DB_URL:
+    sync.start(float(os.getenv("SYNC_INTERVAL_SECONDS", "5")))
@@ -0,0 +1,107 @@
+"""Month-end spending forecasts from per-category daily series.
+
+Two lightweight NumPy models are blended:
+- exponential smoothing of the daily spend with additive day-of-week offsets
+  (the smoothing factor is picked per category by a grid search), and
+- seasonal-naive: each remaining day is expected to repeat the spend on the
+  same day of the previous month.
+
+`fit` works on a whole (categories x days) matrix at once so refitting many
+categories costs one pass; callers cache the returned `FitParams` per
+category and data version and only refit what changed.
+"""
+import datetime
+import calendar
+from collections import namedtuple
+import numpy as np
+
+ALPHAS = np.linspace(0.05, 0.95, 19)  # smoothing factors tried per series
+LOOKBACK_DAYS = 365                   # smoothing effectively forgets older history
+RECENT_DAYS = 62                      # kept for seasonal-naive lookups
+SES_WEIGHT = 0.5                      # blend weight of smoothing vs seasonal-naive
+
+FitParams = namedtuple("FitParams", ["as_of", "alpha", "level", "weekday_offsets", "recent"])
+
+
+def daily_matrix(codes, dates, amounts, n_series, start, as_of):
+    """Bucket (series code, date, amount) rows into a dense (n_series, days) matrix
+    covering start..as_of inclusive. Rows outside the range are dropped."""
+    n_days = (as_of - start).days + 1
+    day_index = np.array([(d - start).days for d in dates], dtype=np.int64)
+    codes = np.asarray(codes, dtype=np.int64)
+    keep = (day_index >= 0) & (day_index < n_days)
+    flat = np.bincount(codes[keep] * n_days + day_index[keep],
+                       weights=np.asarray(amounts, dtype=np.float64)[keep],
+                       minlength=n_series * n_days)
+    return flat.reshape(n_series, n_days)
+
+
+def fit(series, as_of):
+    """Fit every row of a (n_series, n_days) daily matrix ending at `as_of`.
+
+    Returns one FitParams per row.
+    """
+    series = np.atleast_2d(np.asarray(series, dtype=np.float64))
+    n_series, n_days = series.shape
+    window = series[:, -LOOKBACK_DAYS:]
+    n_window = window.shape[1]
+
+    # Additive day-of-week offsets; weekday[i] is the weekday of window column i
+    first_day = as_of - datetime.timedelta(days=n_window - 1)
+    weekday = (first_day.weekday() + np.arange(n_window)) % 7
+    offsets = np.zeros((n_series, 7))
+    for wd in range(7):
+        cols = weekday == wd
+        if cols.any():
+            offsets[:, wd] = window[:, cols].mean(axis=1)
+    offsets -= offsets.mean(axis=1, keepdims=True)
+    deseasoned = window - offsets[:, weekday]
+
+    # Simple exponential smoothing for all series x all alphas at once
+    level = np.repeat(deseasoned[:, :1], len(ALPHAS), axis=1)
+    sse = np.zeros_like(level)
+    for t in range(1, n_window):
+        err = deseasoned[:, t:t + 1] - level
+        sse += err * err
+        level += ALPHAS * err
+    best = sse.argmin(axis=1)
+    rows = np.arange(n_series)
+
+    recent = np.zeros((n_series, RECENT_DAYS))
+    tail = series[:, -RECENT_DAYS:]
+    recent[:, RECENT_DAYS - tail.shape[1]:] = tail
+    return [FitParams(as_of, float(ALPHAS[best[i]]), float(level[i, best[i]]), offsets[i], recent[i])
+            for i in rows]
+
+
+def forecast_days(params, days):
+    """Expected spend for each date in `days` (all after params.as_of)"""
+    if not days:
+        return np.zeros(0)
+    weekdays = np.array([d.weekday() for d in days])
+    ses = np.maximum(params.level + params.weekday_offsets[weekdays], 0.0)
+
+    naive = ses.copy()
+    for i, d in enumerate(days):
+        prev = _same_day_last_month(d)
+        lag = (params.as_of - prev).days
+        if 0 <= lag < RECENT_DAYS:
+            naive[i] = params.recent[RECENT_DAYS - 1 - lag]
+    return SES_WEIGHT * ses + (1 - SES_WEIGHT) * naive
+
+
+def remaining_month_forecast(params, month, as_of):
+    """Expected spend for the rest of `month` ("YYYY-MM") after `as_of`"""
+    year, mon = (int(p) for p in month.split("-"))
+    month_start = datetime.date(year, mon, 1)
+    month_end = datetime.date(year, mon, calendar.monthrange(year, mon)[1])
+    first = max(month_start, as_of + datetime.timedelta(days=1))
+    if first > month_end:
+        return 0.0
+    days = [first + datetime.timedelta(days=i) for i in range((month_end - first).days + 1)]
+    return float(forecast_days(params, days).sum())
+
+
+def _same_day_last_month(d):
+    year, mon = (d.year, d.month - 1) if d.month > 1 else (d.year - 1, 12)
+    return datetime.date(year, mon, min(d.day, calendar.monthrange(year, mon)[1]))
@@ -1,15 +1,29 @@
 import streamlit as st
 import datetime
-from db_utils import add_balance, get_balance
+import json
+import pandas as pd
+import change_feed
+from db_utils import add_balance, get_balance, set_budget, get_budget_status, get_sync_conflicts, dismiss_sync_conflict, set_current_ledger
 
 def add_balance_page(categories):
     st.header("💵 Add Monthly Balance")
     selected_date = st.date_input("Select Month", datetime.date.today())
     month_key = selected_date.strftime("%Y-%m")
+    st.session_state["watched_months"] = [month_key]
+    # The month is shared; the balance, conflicts and budgets each rerun on their own
+    _balance_form(month_key)
+    _sync_conflicts()
+    _budgets(month_key, categories)
+
+@st.fragment
+def _balance_form(month_key):
+    """Balance inputs and the saved balance of month_key"""
+    set_current_ledger(st.session_state["ledger_id"])
     prev_balance = st.number_input("Carry Forward from Previous Month", min_value=0.0, step=100.0)
     this_month = st.number_input("Income / Added Amount for this Month", min_value=0.0, step=100.0)
     if st.button("Save Balance"):
-        add_balance(month_key, prev_balance, this_month)
+        with change_feed.own_changes(st.session_state["ledger_id"], st.session_state["changes_seen"]):
+            add_balance(month_key, prev_balance, this_month)
         st.success(f"Balance for {month_key} saved.")
     st.subheader("Current Balance for Selected Month")
     bal = get_balance(month_key)
@@ -19,4 +33,56 @@ def add_balance_page(categories):
         st.write(f"This Month: ₹{bal.this_month:,.2f}")
         st.write(f"Total Balance: ₹{bal.total_balance:,.2f}")
     else:
-        st.info("No balance set for this month.")
\ No newline at end of file
+        st.info("No balance set for this month.")
+
+@st.fragment
+def _sync_conflicts():
+    """Balance conflicts recorded by the offline-first sync (sync.py), with a dismiss button each"""
+    set_current_ledger(st.session_state["ledger_id"])
+    conflicts = get_sync_conflicts()
+    if conflicts:
+        st.subheader("⚠️ Balance Sync Conflicts")
+        for c in conflicts:
+            local, remote = json.loads(c.local_data), json.loads(c.remote_data)
+            kept, lost = (local, remote) if c.kept == "local" else (remote, local)
+            st.warning(f"{c.month} was edited here and elsewhere before syncing. Kept the later edit "
+                       f"(total ₹{kept['total_balance']:,.2f}, saved {kept['updated_at']}) over "
+                       f"₹{lost['total_balance']:,.2f} (saved {lost['updated_at']}).")
+            if st.button("Dismiss", key=f"dismiss_conflict_{c.id}"):
+                dismiss_sync_conflict(c.id)
+                st.rerun()
+
+@st.fragment
+def _budgets(month_key, categories):
+    """Budget inputs and budget status of month_key"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("🎯 Budgets for Selected Month")
+    col1, col2 = st.columns(2)
+    with col1:
+        budget_category = st.selectbox("Budget Applies To", ["All categories"] + categories)
+    with col2:
+        budget_amount = st.number_input("Budget Amount", min_value=0.0, step=500.0)
+    col1, col2 = st.columns(2)
+    with col1:
+        if st.button("Save Budget"):
+            set_budget(month_key, budget_amount, None if budget_category == "All categories" else budget_category)
+            st.success(f"Budget for {budget_category} in {month_key} saved.")
+    with col2:
+        if st.button("Remove Budget"):
+            set_budget(month_key, None, None if budget_category == "All categories" else budget_category)
+            st.success(f"Budget for {budget_category} in {month_key} removed.")
+    
+    budget_status = get_budget_status(month_key)
+    if budget_status:
+        df_budgets = pd.DataFrame(budget_status)
+        st.dataframe(
+            df_budgets.style.format({
+                'budget': '₹{:,.2f}',
+                'spent': '₹{:,.2f}',
+                'left': '₹{:,.2f}',
+                'used_percentage': '{:.1f}%'
+            }),
+            use_container_width=True
+        )
+    else:
+        st.info("No budgets set for this month.")
\ No newline at end of file
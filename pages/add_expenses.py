@@ -1,6 +1,6 @@
 import streamlit as st
 import datetime
-from db_utils import add_expense, get_expenses, list_expense_months, delete_expense, get_expense_by_id
+from db_utils import add_expense, get_expenses, list_expense_months, delete_expense, get_expense_by_id, set_current_ledger
 
 def add_expenses_page(categories):
     st.header("📝 Add Expense")
@@ -12,84 +12,109 @@ def add_expenses_page(categories):
         st.subheader("➕ Add New Expense")
         exp_date = st.date_input("Expense Date", datetime.date.today())
         month_key = exp_date.strftime("%Y-%m")
-        category = st.selectbox("Select Category", categories)
-        tag = st.text_input("Optional Tag / Note")
-        amount = st.number_input("Expense Amount", min_value=0.0, step=50.0)
-        if st.button("Add Expense", type="primary"):
-            add_expense(exp_date, month_key, category, tag, amount)
-            st.success(f"Expense of ₹{amount:,.2f} added under {category} for {month_key}")
-            st.rerun()
-    
+        st.session_state["watched_months"] = [month_key]
+        _expense_form(exp_date, month_key, categories)
+
     with col2:
-        st.subheader("📅 View Expenses by Month")
-        months = list_expense_months()
-        if months:
-            selected_month = st.selectbox("Select Month to View", months, key="expense_month_selector")
-            expenses = get_expenses(selected_month)
-            if expenses:
-                import pandas as pd
-                df = pd.DataFrame([{
-                    "Date": e.date,
-                    "Category": e.category,
-                    "Tag": e.tag if e.tag else "",
-                    "Amount": e.amount
-                } for e in expenses])
-                
-                # Show summary
-                total_spent = df['Amount'].sum()
-                expense_count = len(df)
-                st.metric("Total Spent", f"₹{total_spent:,.2f}")
-                st.metric("Number of Expenses", expense_count)
+        _month_browser(month_key)
+
+    # Show current month expenses below
+    _current_month_expenses(month_key)
+
+@st.fragment
+def _expense_form(exp_date, month_key, categories):
+    """Category, tag and amount inputs; typing in them reruns only this form"""
+    set_current_ledger(st.session_state["ledger_id"])
+    category = st.selectbox("Select Category", categories)
+    tag = st.text_input("Optional Tag / Note")
+    amount = st.number_input("Expense Amount", min_value=0.0, step=50.0)
+    if st.button("Add Expense", type="primary"):
+        budget_warning = add_expense(exp_date, month_key, category, tag, amount)
+        st.success(f"Expense of ₹{amount:,.2f} added under {category} for {month_key}")
+        if budget_warning:
+            # Keep the warning across the rerun below so it is still shown
+            st.session_state["budget_warning"] = budget_warning
+        st.rerun()
+    if "budget_warning" in st.session_state:
+        st.warning(f"⚠️ {st.session_state.pop('budget_warning')}")
+
+@st.fragment
+def _month_browser(month_key):
+    """Expenses of the month picked in its selector, with delete"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("📅 View Expenses by Month")
+    months = list_expense_months()
+    if months:
+        selected_month = st.selectbox("Select Month to View", months, key="expense_month_selector")
+        st.session_state["watched_months"] = [month_key, selected_month]
+        expenses = get_expenses(selected_month)
+        if expenses:
+            import pandas as pd
+            df = pd.DataFrame([{
+                "Date": e.date,
+                "Category": e.category,
+                "Tag": e.tag if e.tag else "",
+                "Amount": e.amount
+            } for e in expenses])
+            
+            # Show summary
+            total_spent = df['Amount'].sum()
+            expense_count = len(df)
+            st.metric("Total Spent", f"₹{total_spent:,.2f}")
+            st.metric("Number of Expenses", expense_count)
+            
+            # Show expenses table with delete functionality
+            st.dataframe(
+                df.sort_values("Date", ascending=False).style.format({'Amount': '₹{:,.2f}'}),
+                use_container_width=True
+            )
+            
+            # Delete expense section
+            st.subheader("🗑️ Delete Expense")
+            if len(df) > 0:
+                # Create a selectbox for expense selection
+                expense_options = []
+                for _, row in df.iterrows():
+                    expense_options.append(f"{row['Date']} - {row['Category']} - ₹{row['Amount']:,.2f}")
                 
-                # Show expenses table with delete functionality
-                st.dataframe(
-                    df.sort_values("Date", ascending=False).style.format({'Amount': '₹{:,.2f}'}),
-                    use_container_width=True
+                selected_expense = st.selectbox(
+                    "Select expense to delete:", 
+                    expense_options,
+                    key=f"delete_expense_{selected_month}"
                 )
                 
-                # Delete expense section
-                st.subheader("🗑️ Delete Expense")
-                if len(df) > 0:
-                    # Create a selectbox for expense selection
-                    expense_options = []
-                    for _, row in df.iterrows():
-                        expense_options.append(f"{row['Date']} - {row['Category']} - ₹{row['Amount']:,.2f}")
+                if selected_expense and st.button("Delete Selected Expense", type="secondary"):
+                    # Find the expense ID
+                    selected_index = expense_options.index(selected_expense)
+                    expense_row = df.iloc[selected_index]
                     
-                    selected_expense = st.selectbox(
-                        "Select expense to delete:", 
-                        expense_options,
-                        key=f"delete_expense_{selected_month}"
-                    )
+                    # Get the actual expense from database to get ID
+                    expenses = get_expenses(selected_month)
+                    expense_to_delete = None
+                    for exp in expenses:
+                        if (str(exp.date) == str(expense_row['Date']) and 
+                            exp.category == expense_row['Category'] and 
+                            exp.amount == expense_row['Amount']):
+                            expense_to_delete = exp
+                            break
                     
-                    if selected_expense and st.button("Delete Selected Expense", type="secondary"):
-                        # Find the expense ID
-                        selected_index = expense_options.index(selected_expense)
-                        expense_row = df.iloc[selected_index]
-                        
-                        # Get the actual expense from database to get ID
-                        expenses = get_expenses(selected_month)
-                        expense_to_delete = None
-                        for exp in expenses:
-                            if (str(exp.date) == str(expense_row['Date']) and 
-                                exp.category == expense_row['Category'] and 
-                                exp.amount == expense_row['Amount']):
-                                expense_to_delete = exp
-                                break
-                        
-                        if expense_to_delete:
-                            if delete_expense(expense_to_delete.id):
-                                st.success(f"✅ Expense deleted: {expense_row['Category']} - ₹{expense_row['Amount']:,.2f}")
-                                st.rerun()
-                            else:
-                                st.error("❌ Failed to delete expense. Please try again.")
+                    if expense_to_delete:
+                        if delete_expense(expense_to_delete.id):
+                            st.success(f"✅ Expense deleted: {expense_row['Category']} - ₹{expense_row['Amount']:,.2f}")
+                            st.rerun()
                         else:
-                            st.error("❌ Could not find expense to delete.")
-            else:
-                st.info(f"No expenses found for {selected_month}")
+                            st.error("❌ Failed to delete expense. Please try again.")
+                    else:
+                        st.error("❌ Could not find expense to delete.")
         else:
-            st.info("No expenses added yet. Add your first expense above!")
-    
-    # Show current month expenses below
+            st.info(f"No expenses found for {selected_month}")
+    else:
+        st.info("No expenses added yet. Add your first expense above!")
+
+@st.fragment
+def _current_month_expenses(month_key):
+    """Expenses of month_key, with delete"""
+    set_current_ledger(st.session_state["ledger_id"])
     st.subheader(f"📋 Current Month ({month_key}) Expenses")
     current_expenses = get_expenses(month_key)
     if current_expenses:
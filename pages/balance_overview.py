@@ -1,7 +1,8 @@
 import streamlit as st
+import datetime
 import pandas as pd
 import plotly.express as px
-from db_utils import list_balances, get_expenses, get_monthly_summary
+from db_utils import list_balances, get_expenses, get_monthly_summary, get_spending_forecast
 
 def balance_overview_page():
     st.header("📊 Balance Overview")
@@ -72,11 +73,44 @@ def balance_overview_page():
                 'total_balance': '₹{:,.2f}',
                 'total_spent': '₹{:,.2f}',
                 'remaining': '₹{:,.2f}',
+                'expected_remaining': '₹{:,.2f}',
                 'spending_percentage': '{:.1f}%'
             }),
             use_container_width=True
         )
         
+        # Month-end forecast for the current month
+        st.subheader("🔮 Month-End Forecast")
+        forecast_data = get_spending_forecast()
+        if forecast_data:
+            df_forecast = pd.DataFrame([{
+                'Category': category,
+                'Spent So Far': f['spent'],
+                'Expected Additional': f['forecast_remaining'],
+                'Projected Total': f['projected']
+            } for category, f in forecast_data.items()]).sort_values('Projected Total', ascending=False)
+            
+            current_month = datetime.date.today().strftime("%Y-%m")
+            current_row = df_summary[df_summary['month'] == current_month]
+            col1, col2 = st.columns(2)
+            with col1:
+                st.metric("Projected Spend This Month", f"₹{df_forecast['Projected Total'].sum():,.2f}")
+            with col2:
+                if len(current_row) > 0:
+                    st.metric("Expected Remaining Balance", f"₹{current_row['expected_remaining'].iloc[0]:,.2f}")
+            
+            fig_forecast = px.bar(
+                df_forecast,
+                x='Category',
+                y=['Spent So Far', 'Expected Additional'],
+                title=f"Projected Month-End Spend by Category ({current_month})",
+                labels={'value': 'Amount (₹)'}
+            )
+            fig_forecast.update_layout(xaxis_tickangle=-45)
+            st.plotly_chart(fig_forecast, use_container_width=True)
+        else:
+            st.info("Add some expenses to see month-end projections.")
+        
         # Monthly trend analysis
         st.subheader("📈 Monthly Trends")
         
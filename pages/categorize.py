@@ -0,0 +1,163 @@
+import streamlit as st
+import pandas as pd
+import change_feed
+from categorizer import KINDS, REVIEW_BELOW
+from db_utils import add_category_rule, list_category_rules, delete_category_rule, get_categorizer, add_expenses_batch, set_current_ledger
+
+# Column names bank exports use for the merchant / narration text
+TAG_COLUMNS = ["tag", "description", "narration", "merchant", "details", "particulars", "remarks"]
+KIND_LABELS = {"keyword": "Keyword (whole word)", "regex": "Regular expression", "amount": "Amount range only"}
+
+def _read_import(upload):
+    """Date, Tag and Amount columns of an uploaded CSV, and how many rows had no valid date or amount"""
+    raw = pd.read_csv(upload)
+    columns = {str(c).strip().lower(): c for c in raw.columns}
+    tag_column = next((columns[c] for c in TAG_COLUMNS if c in columns), None)
+    if "date" not in columns or "amount" not in columns or tag_column is None:
+        raise ValueError(f"The CSV needs date, amount and one of {', '.join(TAG_COLUMNS)} columns")
+    # ISO dates first, then the day-first dates of Indian bank statements
+    dates = raw[columns["date"]].astype(str).str.strip()
+    parsed = pd.to_datetime(dates, format="ISO8601", errors="coerce")
+    parsed = parsed.fillna(pd.to_datetime(dates, dayfirst=True, format="mixed", errors="coerce"))
+    df = pd.DataFrame({
+        "Date": parsed.dt.date,
+        "Tag": raw[tag_column].fillna("").astype(str).str.strip(),
+        # Debits are often exported as negative numbers
+        "Amount": pd.to_numeric(raw[columns["amount"]], errors="coerce").abs(),
+    })
+    valid = df.dropna(subset=["Date", "Amount"]).reset_index(drop=True)
+    return valid, len(df) - len(valid)
+
+def categorize_page(categories):
+    st.header("🏷️ Auto-Categorize")
+    st.caption("Import bank exports as expenses. Categories come from your rules first, "
+               "then from how past expenses with the same or similar tags were categorized.")
+    tab1, tab2 = st.tabs(["📥 Import & Review", "📏 Rules"])
+
+    # Each tab is a fragment, so its widgets rerun only that tab
+    with tab1:
+        _import_review(categories)
+    with tab2:
+        _rules(categories)
+
+@st.fragment
+def _import_review(categories):
+    """Upload, classification and review of a bank export; edits rerun only this tab"""
+    set_current_ledger(st.session_state["ledger_id"])
+    upload = st.file_uploader("Bank export (CSV with date, amount and description columns)", type="csv")
+    if upload:
+        imported = st.session_state.setdefault("imported_files", set())
+        if upload.file_id in imported:
+            st.info("This file was imported. Upload another one to continue.")
+        else:
+            # Classify once per upload, so review edits stay attached to the same rows across reruns
+            key = f"categorized_{upload.file_id}"
+            if key not in st.session_state:
+                try:
+                    df, dropped = _read_import(upload)
+                except ValueError as e:
+                    st.error(str(e))
+                    return
+                result = get_categorizer().classify(df["Tag"], df["Amount"])
+                df["Category"] = result["category"]
+                df["Confidence"] = result["confidence"]
+                df["Source"] = result["source"]
+                st.session_state[key] = (df, dropped)
+            df, dropped = st.session_state[key]
+
+            confident = df["Confidence"] >= REVIEW_BELOW
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.metric("Rows", len(df))
+            with col2:
+                st.metric("Categorized", int(confident.sum()))
+            with col3:
+                st.metric("Need Review", int((~confident).sum()))
+            if dropped:
+                st.warning(f"{dropped} row(s) without a valid date or amount were skipped.")
+
+            with st.expander("✅ Categorized automatically"):
+                st.dataframe(df[confident].style.format({'Amount': '₹{:,.2f}', 'Confidence': '{:.2f}'}),
+                             use_container_width=True)
+
+            st.subheader("🔍 Review Low-Confidence Matches")
+            options = sorted(set(categories) | set(df["Category"].dropna()))
+            reviewed = st.data_editor(
+                df[~confident],
+                column_config={
+                    "Category": st.column_config.SelectboxColumn("Category", options=options),
+                    "Amount": st.column_config.NumberColumn("Amount", format="₹%.2f"),
+                    "Confidence": st.column_config.NumberColumn("Confidence", format="%.2f"),
+                },
+                disabled=["Date", "Tag", "Amount", "Confidence", "Source"],
+                use_container_width=True,
+                key=f"review_{upload.file_id}",
+            )
+
+            rows = pd.concat([df[confident], reviewed])
+            ready = rows[rows["Category"].notna() & (rows["Category"] != "")]
+            if st.button(f"Import {len(ready)} Expense(s)", type="primary", disabled=ready.empty):
+                with change_feed.own_changes(st.session_state["ledger_id"], st.session_state["changes_seen"]):
+                    add_expenses_batch([{"date": r.Date, "category": r.Category, "tag": r.Tag, "amount": r.Amount}
+                                        for r in ready.itertuples()])
+                imported.add(upload.file_id)
+                del st.session_state[key]
+                skipped = len(rows) - len(ready)
+                st.success(f"Imported {len(ready)} expense(s)" +
+                           (f"; {skipped} without a category were left out." if skipped else "."))
+
+@st.fragment
+def _rules(categories):
+    """Rule form, rule tester and rule list"""
+    set_current_ledger(st.session_state["ledger_id"])
+    col1, col2 = st.columns(2)
+    with col1:
+        st.subheader("➕ Add Rule")
+        category = st.selectbox("Category", categories, key="rule_category")
+        kind = st.selectbox("Match", KINDS, format_func=KIND_LABELS.get, key="rule_kind")
+        pattern = st.text_input("Keyword or pattern (matched against the tag)", disabled=kind == "amount",
+                                key="rule_pattern")
+        min_amount = st.number_input("Minimum amount (optional)", min_value=0.0, value=None, step=50.0,
+                                     key="rule_min")
+        max_amount = st.number_input("Maximum amount (optional)", min_value=0.0, value=None, step=50.0,
+                                     key="rule_max")
+        priority = st.number_input("Priority (higher wins)", value=0, step=1, key="rule_priority")
+        if st.button("Add Rule", type="primary"):
+            try:
+                with change_feed.own_changes(st.session_state["ledger_id"], st.session_state["changes_seen"]):
+                    add_category_rule(category, kind, None if kind == "amount" else pattern,
+                                      min_amount, max_amount, int(priority))
+                st.success(f"Rule for {category} added.")
+            except ValueError as e:
+                st.error(str(e))
+    with col2:
+        st.subheader("🧪 Try It")
+        sample_tag = st.text_input("Tag / description", key="rule_test_tag")
+        sample_amount = st.number_input("Amount", min_value=0.0, step=50.0, key="rule_test_amount")
+        if sample_tag:
+            result = get_categorizer().classify([sample_tag], [sample_amount]).iloc[0]
+            if pd.notna(result["category"]):
+                st.write(f"**{result['category']}** ({result['source']}, confidence {result['confidence']:.2f})")
+            else:
+                st.write("No category found.")
+
+    st.subheader("📋 Rules")
+    rules = list_category_rules()
+    if rules:
+        df_rules = pd.DataFrame([{
+            "ID": r.id,
+            "Category": r.category,
+            "Match": r.kind,
+            "Pattern": r.pattern or "",
+            "Min": r.min_amount,
+            "Max": r.max_amount,
+            "Priority": r.priority,
+        } for r in rules])
+        st.dataframe(df_rules, use_container_width=True)
+        rule_options = [f"#{r.id} - {r.category} - {r.kind} {r.pattern or ''}" for r in rules]
+        selected_rule = st.selectbox("Select rule:", rule_options, key="category_rule_selector")
+        if st.button("Delete Rule"):
+            delete_category_rule(rules[rule_options.index(selected_rule)].id)
+            st.rerun()
+    else:
+        st.info("No rules yet. Without rules, categories are only suggested from past expenses.")
@@ -1,293 +1,334 @@
 import streamlit as st
 import pandas as pd
+import datetime
 import plotly.express as px
 import plotly.graph_objects as go
-from db_utils import get_all_expenses, get_monthly_summary, get_expenses_by_category, list_expense_months, delete_expense
+from db_utils import get_monthly_summary, get_expense_columns, get_expense_index, get_category_month_stats, delete_expense, get_month_as_of, set_current_ledger
+from parallel_agg import summarize
 
 def historical_view_page():
     st.header("📚 Historical Data & Analytics")
     
     # Create tabs for different views
-    tab1, tab2, tab3, tab4 = st.tabs(["📊 Monthly Summary", "💰 All Expenses", "🔍 Category Analysis", "📈 Trends"])
-    
+    tab1, tab2, tab3, tab4, tab5 = st.tabs(["📊 Monthly Summary", "💰 All Expenses", "🔍 Category Analysis", "📈 Trends", "🕰️ Point in Time"])
+
+    # Each tab is a fragment, so its widgets rerun only that tab
     with tab1:
-        st.subheader("📊 Monthly Summary Overview")
-        monthly_data = get_monthly_summary()
-        
-        if monthly_data:
-            df_summary = pd.DataFrame(monthly_data)
-            
-            # Display summary table
-            st.dataframe(
-                df_summary.style.format({
-                    'total_balance': '₹{:,.2f}',
-                    'total_spent': '₹{:,.2f}',
-                    'remaining': '₹{:,.2f}'
-                }),
-                use_container_width=True
-            )
-            
-            # Create visualizations
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                # Monthly spending bar chart
-                fig_spending = px.bar(
-                    df_summary, 
-                    x='month', 
-                    y='total_spent',
-                    title="Monthly Spending",
-                    labels={'total_spent': 'Amount Spent (₹)', 'month': 'Month'}
-                )
-                fig_spending.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig_spending, use_container_width=True)
-            
-            with col2:
-                # Remaining balance bar chart
-                fig_remaining = px.bar(
-                    df_summary, 
-                    x='month', 
-                    y='remaining',
-                    title="Remaining Balance by Month",
-                    labels={'remaining': 'Remaining Balance (₹)', 'month': 'Month'},
-                    color='remaining',
-                    color_continuous_scale=['red', 'yellow', 'green']
-                )
-                fig_remaining.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig_remaining, use_container_width=True)
-            
-            # Total statistics
-            total_balance = df_summary['total_balance'].sum()
-            total_spent = df_summary['total_spent'].sum()
-            total_remaining = df_summary['remaining'].sum()
-            avg_monthly_spending = df_summary['total_spent'].mean()
-            
-            col1, col2, col3, col4 = st.columns(4)
-            with col1:
-                st.metric("Total Balance", f"₹{total_balance:,.2f}")
-            with col2:
-                st.metric("Total Spent", f"₹{total_spent:,.2f}")
-            with col3:
-                st.metric("Total Remaining", f"₹{total_remaining:,.2f}")
-            with col4:
-                st.metric("Avg Monthly Spending", f"₹{avg_monthly_spending:,.2f}")
-        else:
-            st.info("No data available. Add some balances and expenses to see historical data.")
-    
+        _monthly_summary()
     with tab2:
-        st.subheader("💰 All Expenses History")
+        _all_expenses()
+    with tab3:
+        _category_analysis()
+    with tab4:
+        _trends()
+    with tab5:
+        _point_in_time()
+
+@st.fragment
+def _monthly_summary():
+    """Balance, spending and remaining amount of every month"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("📊 Monthly Summary Overview")
+    monthly_data = get_monthly_summary()
+    
+    if monthly_data:
+        df_summary = pd.DataFrame(monthly_data)
         
-        # Filters
+        # Display summary table
+        st.dataframe(
+            df_summary.style.format({
+                'total_balance': '₹{:,.2f}',
+                'total_spent': '₹{:,.2f}',
+                'remaining': '₹{:,.2f}',
+                'expected_remaining': '₹{:,.2f}'
+            }),
+            use_container_width=True
+        )
+        
+        # Create visualizations
         col1, col2 = st.columns(2)
+        
+        with col1:
+            # Monthly spending bar chart
+            fig_spending = px.bar(
+                df_summary, 
+                x='month', 
+                y='total_spent',
+                title="Monthly Spending",
+                labels={'total_spent': 'Amount Spent (₹)', 'month': 'Month'}
+            )
+            fig_spending.update_layout(xaxis_tickangle=-45)
+            st.plotly_chart(fig_spending, use_container_width=True)
+        
+        with col2:
+            # Remaining balance bar chart
+            fig_remaining = px.bar(
+                df_summary, 
+                x='month', 
+                y='remaining',
+                title="Remaining Balance by Month",
+                labels={'remaining': 'Remaining Balance (₹)', 'month': 'Month'},
+                color='remaining',
+                color_continuous_scale=['red', 'yellow', 'green']
+            )
+            fig_remaining.update_layout(xaxis_tickangle=-45)
+            st.plotly_chart(fig_remaining, use_container_width=True)
+        
+        # Total statistics
+        total_balance = df_summary['total_balance'].sum()
+        total_spent = df_summary['total_spent'].sum()
+        total_remaining = df_summary['remaining'].sum()
+        avg_monthly_spending = df_summary['total_spent'].mean()
+        
+        col1, col2, col3, col4 = st.columns(4)
         with col1:
-            months = list_expense_months()
-            selected_month = st.selectbox("Filter by Month", ["All"] + months)
+            st.metric("Total Balance", f"₹{total_balance:,.2f}")
         with col2:
-            all_expenses = get_all_expenses()
-            categories = sorted(list(set([e.category for e in all_expenses])))
-            selected_category = st.selectbox("Filter by Category", ["All"] + categories)
+            st.metric("Total Spent", f"₹{total_spent:,.2f}")
+        with col3:
+            st.metric("Total Remaining", f"₹{total_remaining:,.2f}")
+        with col4:
+            st.metric("Avg Monthly Spending", f"₹{avg_monthly_spending:,.2f}")
+    else:
+        st.info("No data available. Add some balances and expenses to see historical data.")
+
+@st.fragment
+def _all_expenses():
+    """Expense list filtered by month and category; reruns alone when a filter changes"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("💰 All Expenses History")
+    
+    # Filters
+    index = get_expense_index()
+    if index.first_date:
+        st.caption(f"📅 Expenses from {index.first_date} to {index.last_date}")
+    col1, col2 = st.columns(2)
+    with col1:
+        selected_month = st.selectbox("Filter by Month", ["All"] + index.months)
+    with col2:
+        selected_category = st.selectbox("Filter by Category", ["All"] + index.categories)
+    
+    # Get filtered expenses as columns (one copy of the rows, no ORM objects)
+    expenses = get_expense_columns(category=None if selected_category == "All" else selected_category,
+                                   month=None if selected_month == "All" else selected_month)
+    
+    if len(expenses):
+        df_expenses = expenses.to_frame().rename(columns={
+            "id": "ID", "date": "Date", "month": "Month", "category": "Category", "tag": "Tag", "amount": "Amount"
+        })
+        df_expenses["Date"] = df_expenses["Date"].dt.date
         
-        # Get filtered expenses
-        if selected_month == "All" and selected_category == "All":
-            expenses = all_expenses
-        elif selected_month == "All":
-            expenses = get_expenses_by_category(category=selected_category)
-        elif selected_category == "All":
-            expenses = get_expenses_by_category(month=selected_month)
-        else:
-            expenses = get_expenses_by_category(category=selected_category, month=selected_month)
+        # Display expenses
+        st.dataframe(
+            df_expenses.drop(columns="ID").style.format({'Amount': '₹{:,.2f}'}),
+            use_container_width=True
+        )
         
-        if expenses:
-            # Create dataframe
-            df_expenses = pd.DataFrame([{
-                "Date": e.date,
-                "Month": e.month,
-                "Category": e.category,
-                "Tag": e.tag if e.tag else "",
-                "Amount": e.amount
-            } for e in expenses])
+        # Delete expense section
+        st.subheader("🗑️ Delete Expense")
+        if len(df_expenses) > 0:
+            # Create a selectbox for expense selection
+            expense_options = []
+            for _, row in df_expenses.iterrows():
+                expense_options.append(f"{row['Date']} - {row['Month']} - {row['Category']} - ₹{row['Amount']:,.2f}")
             
-            # Display expenses
-            st.dataframe(
-                df_expenses.style.format({'Amount': '₹{:,.2f}'}),
-                use_container_width=True
+            selected_expense = st.selectbox(
+                "Select expense to delete:", 
+                expense_options,
+                key="delete_historical_expense"
             )
             
-            # Delete expense section
-            st.subheader("🗑️ Delete Expense")
-            if len(df_expenses) > 0:
-                # Create a selectbox for expense selection
-                expense_options = []
-                for _, row in df_expenses.iterrows():
-                    expense_options.append(f"{row['Date']} - {row['Month']} - {row['Category']} - ₹{row['Amount']:,.2f}")
+            if selected_expense and st.button("Delete Selected Expense", type="secondary"):
+                # Find the expense ID
+                selected_index = expense_options.index(selected_expense)
+                expense_row = df_expenses.iloc[selected_index]
                 
-                selected_expense = st.selectbox(
-                    "Select expense to delete:", 
-                    expense_options,
-                    key="delete_historical_expense"
-                )
-                
-                if selected_expense and st.button("Delete Selected Expense", type="secondary"):
-                    # Find the expense ID
-                    selected_index = expense_options.index(selected_expense)
-                    expense_row = df_expenses.iloc[selected_index]
-                    
-                    # Get the actual expense from database to get ID
-                    expense_to_delete = None
-                    for exp in expenses:
-                        if (str(exp.date) == str(expense_row['Date']) and 
-                            exp.month == expense_row['Month'] and
-                            exp.category == expense_row['Category'] and 
-                            exp.amount == expense_row['Amount']):
-                            expense_to_delete = exp
-                            break
-                    
-                    if expense_to_delete:
-                        if delete_expense(expense_to_delete.id):
-                            st.success(f"✅ Expense deleted: {expense_row['Category']} - ₹{expense_row['Amount']:,.2f}")
-                            st.rerun()
-                        else:
-                            st.error("❌ Failed to delete expense. Please try again.")
+                # Queued (not yet written) expenses have no ID yet
+                if expense_row['ID'] >= 0:
+                    if delete_expense(int(expense_row['ID'])):
+                        st.success(f"✅ Expense deleted: {expense_row['Category']} - ₹{expense_row['Amount']:,.2f}")
+                        st.rerun()
                     else:
-                        st.error("❌ Could not find expense to delete.")
-            
-            # Summary statistics
-            total_amount = df_expenses['Amount'].sum()
-            expense_count = len(df_expenses)
-            avg_expense = df_expenses['Amount'].mean()
-            
-            col1, col2, col3 = st.columns(3)
-            with col1:
-                st.metric("Total Amount", f"₹{total_amount:,.2f}")
-            with col2:
-                st.metric("Number of Expenses", expense_count)
-            with col3:
-                st.metric("Average Expense", f"₹{avg_expense:,.2f}")
-        else:
-            st.info("No expenses found with the selected filters.")
-    
-    with tab3:
-        st.subheader("🔍 Category Analysis")
+                        st.error("❌ Failed to delete expense. Please try again.")
+                else:
+                    st.error("❌ Could not find expense to delete.")
         
-        all_expenses = get_all_expenses()
-        if all_expenses:
-            # Create category summary
-            df_cat = pd.DataFrame([{
-                "Category": e.category,
-                "Amount": e.amount,
-                "Month": e.month
-            } for e in all_expenses])
-            
-            # Overall category spending
-            category_summary = df_cat.groupby('Category')['Amount'].agg(['sum', 'count', 'mean']).reset_index()
-            category_summary.columns = ['Category', 'Total Spent', 'Count', 'Average']
-            category_summary = category_summary.sort_values('Total Spent', ascending=False)
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                # Pie chart of category spending
-                fig_pie = px.pie(
-                    category_summary, 
-                    values='Total Spent', 
-                    names='Category',
-                    title="Total Spending by Category"
-                )
-                st.plotly_chart(fig_pie, use_container_width=True)
-            
-            with col2:
-                # Bar chart of category spending
-                fig_bar = px.bar(
-                    category_summary.head(10), 
-                    x='Category', 
-                    y='Total Spent',
-                    title="Top 10 Categories by Spending"
-                )
-                fig_bar.update_layout(xaxis_tickangle=-45)
-                st.plotly_chart(fig_bar, use_container_width=True)
-            
-            # Category summary table
-            st.subheader("Category Summary")
-            st.dataframe(
-                category_summary.style.format({
-                    'Total Spent': '₹{:,.2f}',
-                    'Average': '₹{:,.2f}'
-                }),
-                use_container_width=True
-            )
-            
-            # Monthly category breakdown
-            st.subheader("Monthly Category Breakdown")
-            monthly_cat = df_cat.groupby(['Month', 'Category'])['Amount'].sum().reset_index()
-            monthly_cat_pivot = monthly_cat.pivot(index='Category', columns='Month', values='Amount').fillna(0)
-            
-            if not monthly_cat_pivot.empty:
-                fig_heatmap = px.imshow(
-                    monthly_cat_pivot.values,
-                    labels=dict(x="Month", y="Category", color="Amount"),
-                    x=monthly_cat_pivot.columns,
-                    y=monthly_cat_pivot.index,
-                    aspect="auto",
-                    title="Monthly Spending by Category (Heatmap)"
-                )
-                st.plotly_chart(fig_heatmap, use_container_width=True)
-        else:
-            st.info("No expenses available for category analysis.")
+        # Summary statistics
+        total_amount = df_expenses['Amount'].sum()
+        expense_count = len(df_expenses)
+        avg_expense = df_expenses['Amount'].mean()
+        
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total Amount", f"₹{total_amount:,.2f}")
+        with col2:
+            st.metric("Number of Expenses", expense_count)
+        with col3:
+            st.metric("Average Expense", f"₹{avg_expense:,.2f}")
+    else:
+        st.info("No expenses found with the selected filters.")
+
+@st.fragment
+def _category_analysis():
+    """Spending per category over the whole history"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("🔍 Category Analysis")
     
-    with tab4:
-        st.subheader("📈 Spending Trends")
+    # Per-(month, category) aggregates; large histories are aggregated in parallel
+    stats = get_category_month_stats()
+    if len(stats):
+        # Overall category spending
+        category_summary = summarize(stats, 'category')[['category', 'total', 'count', 'mean']]
+        category_summary.columns = ['Category', 'Total Spent', 'Count', 'Average']
+        category_summary = category_summary.sort_values('Total Spent', ascending=False)
         
-        all_expenses = get_all_expenses()
-        if all_expenses:
-            df_trends = pd.DataFrame([{
-                "Date": e.date,
-                "Month": e.month,
-                "Amount": e.amount,
-                "Category": e.category
-            } for e in all_expenses])
-            
-            # Daily spending trend
-            daily_spending = df_trends.groupby('Date')['Amount'].sum().reset_index()
-            daily_spending['Date'] = pd.to_datetime(daily_spending['Date'])
-            
-            fig_daily = px.line(
-                daily_spending, 
-                x='Date', 
-                y='Amount',
-                title="Daily Spending Trend",
-                labels={'Amount': 'Amount Spent (₹)', 'Date': 'Date'}
+        col1, col2 = st.columns(2)
+        
+        with col1:
+            # Pie chart of category spending
+            fig_pie = px.pie(
+                category_summary, 
+                values='Total Spent', 
+                names='Category',
+                title="Total Spending by Category"
             )
-            st.plotly_chart(fig_daily, use_container_width=True)
-            
-            # Monthly spending trend
-            monthly_spending = df_trends.groupby('Month')['Amount'].sum().reset_index()
-            monthly_spending['Month'] = pd.to_datetime(monthly_spending['Month'] + '-01')
-            
-            fig_monthly = px.line(
-                monthly_spending, 
-                x='Month', 
-                y='Amount',
-                title="Monthly Spending Trend",
-                labels={'Amount': 'Amount Spent (₹)', 'Month': 'Month'}
+            st.plotly_chart(fig_pie, use_container_width=True)
+        
+        with col2:
+            # Bar chart of category spending
+            fig_bar = px.bar(
+                category_summary.head(10), 
+                x='Category', 
+                y='Total Spent',
+                title="Top 10 Categories by Spending"
             )
-            st.plotly_chart(fig_monthly, use_container_width=True)
-            
-            # Spending by day of week
-            df_trends['Date'] = pd.to_datetime(df_trends['Date'])
-            df_trends['DayOfWeek'] = df_trends['Date'].dt.day_name()
-            df_trends['DayOfWeek'] = pd.Categorical(df_trends['DayOfWeek'], 
-                                                  categories=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
-                                                  ordered=True)
-            
-            dow_spending = df_trends.groupby('DayOfWeek')['Amount'].sum().reset_index()
-            
-            fig_dow = px.bar(
-                dow_spending, 
-                x='DayOfWeek', 
-                y='Amount',
-                title="Spending by Day of Week",
-                labels={'Amount': 'Amount Spent (₹)', 'DayOfWeek': 'Day of Week'}
+            fig_bar.update_layout(xaxis_tickangle=-45)
+            st.plotly_chart(fig_bar, use_container_width=True)
+        
+        # Category summary table
+        st.subheader("Category Summary")
+        st.dataframe(
+            category_summary.style.format({
+                'Total Spent': '₹{:,.2f}',
+                'Average': '₹{:,.2f}'
+            }),
+            use_container_width=True
+        )
+        
+        # Monthly category breakdown
+        st.subheader("Monthly Category Breakdown")
+        monthly_cat = stats[['month', 'category', 'total']].rename(
+            columns={'month': 'Month', 'category': 'Category', 'total': 'Amount'})
+        monthly_cat_pivot = monthly_cat.pivot(index='Category', columns='Month', values='Amount').fillna(0)
+        
+        if not monthly_cat_pivot.empty:
+            fig_heatmap = px.imshow(
+                monthly_cat_pivot.values,
+                labels=dict(x="Month", y="Category", color="Amount"),
+                x=monthly_cat_pivot.columns,
+                y=monthly_cat_pivot.index,
+                aspect="auto",
+                title="Monthly Spending by Category (Heatmap)"
             )
-            st.plotly_chart(fig_dow, use_container_width=True)
+            st.plotly_chart(fig_heatmap, use_container_width=True)
+    else:
+        st.info("No expenses available for category analysis.")
+
+@st.fragment
+def _trends():
+    """Daily, monthly and day-of-week spending trends"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("📈 Spending Trends")
+    
+    all_expenses = get_expense_columns()
+    if len(all_expenses):
+        df_trends = all_expenses.to_frame()[["date", "month", "amount", "category"]].rename(
+            columns={"date": "Date", "month": "Month", "amount": "Amount", "category": "Category"})
+        
+        # Daily spending trend
+        daily_spending = df_trends.groupby('Date')['Amount'].sum().reset_index()
+        daily_spending['Date'] = pd.to_datetime(daily_spending['Date'])
+        
+        fig_daily = px.line(
+            daily_spending, 
+            x='Date', 
+            y='Amount',
+            title="Daily Spending Trend",
+            labels={'Amount': 'Amount Spent (₹)', 'Date': 'Date'}
+        )
+        st.plotly_chart(fig_daily, use_container_width=True)
+        
+        # Monthly spending trend
+        monthly_spending = df_trends.groupby('Month', observed=True)['Amount'].sum().reset_index()
+        monthly_spending['Month'] = pd.to_datetime(monthly_spending['Month'].astype(str) + '-01')
+        
+        fig_monthly = px.line(
+            monthly_spending, 
+            x='Month', 
+            y='Amount',
+            title="Monthly Spending Trend",
+            labels={'Amount': 'Amount Spent (₹)', 'Month': 'Month'}
+        )
+        st.plotly_chart(fig_monthly, use_container_width=True)
+        
+        # Spending by day of week
+        df_trends['Date'] = pd.to_datetime(df_trends['Date'])
+        df_trends['DayOfWeek'] = df_trends['Date'].dt.day_name()
+        df_trends['DayOfWeek'] = pd.Categorical(df_trends['DayOfWeek'], 
+                                              categories=['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'],
+                                              ordered=True)
+        
+        dow_spending = df_trends.groupby('DayOfWeek')['Amount'].sum().reset_index()
+        
+        fig_dow = px.bar(
+            dow_spending, 
+            x='DayOfWeek', 
+            y='Amount',
+            title="Spending by Day of Week",
+            labels={'Amount': 'Amount Spent (₹)', 'DayOfWeek': 'Day of Week'}
+        )
+        st.plotly_chart(fig_dow, use_container_width=True)
+    else:
+        st.info("No expenses available for trend analysis.")
+
+@st.fragment
+def _point_in_time():
+    """One month reconstructed as of a chosen time; reruns alone when the month or time changes"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("🕰️ Month as of a Point in Time")
+    st.caption("Reconstructed from the change history, including expenses deleted since and earlier balances.")
+
+    months = get_expense_index().months
+    if months:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            as_of_month = st.selectbox("Month", months[::-1], key="as_of_month")
+        with col2:
+            as_of_date = st.date_input("As of date", value=datetime.date.today(), key="as_of_date")
+        with col3:
+            as_of_time = st.time_input("As of time", value=datetime.time(23, 59), key="as_of_time")
+
+        state = get_month_as_of(as_of_month, datetime.datetime.combine(as_of_date, as_of_time))
+        balance = state["balance"]
+        spent = sum(e["amount"] for e in state["expenses"])
+
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Total Balance", f"₹{balance['total_balance']:,.2f}" if balance else "—")
+        with col2:
+            st.metric("Total Spent", f"₹{spent:,.2f}")
+        with col3:
+            st.metric("Expenses", len(state["expenses"]))
+
+        if state["expenses"]:
+            df_as_of = pd.DataFrame([{
+                "Date": e["date"],
+                "Category": e["category"],
+                "Tag": e["tag"],
+                "Amount": e["amount"]
+            } for e in state["expenses"]])
+            st.dataframe(df_as_of.style.format({"Amount": "₹{:,.2f}"}), use_container_width=True)
         else:
-            st.info("No expenses available for trend analysis.")
+            st.info("No expenses in this month at that time.")
+    else:
+        st.info("No expenses recorded yet.")
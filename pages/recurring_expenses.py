@@ -0,0 +1,84 @@
+import streamlit as st
+import datetime
+import pandas as pd
+import change_feed
+from db_utils import add_recurring_rule, list_recurring_rules, set_recurring_rule_active, materialize_recurring, set_current_ledger
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+def recurring_expenses_page(categories):
+    st.header("🔁 Recurring Expenses")
+    st.caption("Rules are turned into expenses automatically when the app starts, including any missed periods.")
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        st.subheader("➕ Add Recurring Expense")
+        _add_rule_form(categories)
+
+    with col2:
+        st.subheader("⚙️ Run Now")
+        if st.button("Create Due Expenses"):
+            with change_feed.own_changes(st.session_state["ledger_id"], st.session_state["changes_seen"]):
+                added = materialize_recurring()
+            st.success(f"{added} recurring expense(s) created.")
+
+    _rules_list()
+
+@st.fragment
+def _add_rule_form(categories):
+    """Inputs of a new recurring rule; changing them reruns only this form"""
+    set_current_ledger(st.session_state["ledger_id"])
+    category = st.selectbox("Category", categories, key="recurring_category")
+    tag = st.text_input("Tag / Note", key="recurring_tag")
+    amount = st.number_input("Amount", min_value=0.0, step=50.0, key="recurring_amount")
+    cadence = st.selectbox("Repeats", ["monthly", "weekly", "yearly"], key="recurring_cadence")
+    start_date = st.date_input("Starting From", datetime.date.today(), key="recurring_start")
+    if cadence == "monthly":
+        day = st.number_input("Day of Month", min_value=1, max_value=31, value=start_date.day, step=1)
+    elif cadence == "weekly":
+        day = WEEKDAYS.index(st.selectbox("Day of Week", WEEKDAYS, index=start_date.weekday()))
+    else:
+        day = start_date.day
+        st.write(f"Repeats every year on {start_date.strftime('%d %B')}.")
+    if st.button("Add Recurring Expense", type="primary"):
+        add_recurring_rule(category, tag, amount, cadence, int(day), start_date)
+        added = materialize_recurring()
+        # The rules list below is another fragment: rerun the page, keeping the message
+        st.session_state["recurring_added"] = (f"Recurring {cadence} expense for {category} added "
+                                               f"({added} occurrence(s) created so far).")
+        st.rerun()
+    if "recurring_added" in st.session_state:
+        st.success(st.session_state.pop("recurring_added"))
+
+@st.fragment
+def _rules_list():
+    """Recurring rules, with pause / resume"""
+    set_current_ledger(st.session_state["ledger_id"])
+    st.subheader("📋 Recurring Rules")
+    rules = list_recurring_rules()
+    if rules:
+        df_rules = pd.DataFrame([{
+            "ID": r.id,
+            "Category": r.category,
+            "Tag": r.tag if r.tag else "",
+            "Amount": r.amount,
+            "Repeats": r.cadence,
+            "Day": WEEKDAYS[r.day] if r.cadence == "weekly" else str(r.day),
+            "Start": r.start_date,
+            "Created Through": r.materialized_through,
+            "Active": r.active
+        } for r in rules])
+        st.dataframe(
+            df_rules.style.format({'Amount': '₹{:,.2f}'}),
+            use_container_width=True
+        )
+        
+        rule_options = [f"#{r.id} - {r.category} - ₹{r.amount:,.2f} ({'active' if r.active else 'paused'})" for r in rules]
+        selected_rule = st.selectbox("Select rule:", rule_options, key="recurring_rule_selector")
+        rule = rules[rule_options.index(selected_rule)]
+        if st.button("Pause Rule" if rule.active else "Resume Rule"):
+            set_recurring_rule_active(rule.id, not rule.active)
+            st.rerun()
+    else:
+        st.info("No recurring expenses yet.")
@@ -0,0 +1,133 @@
+"""Sharded month x category aggregation over a process pool.
+
+The expense history is split into contiguous month ranges holding about the
+same number of rows (`plan_shards`, fed from the rollup counts). Each worker
+process opens its own connection, aggregates its shard with a GROUP BY on
+the (ledger_id, month) index and returns partials (sum, count, sum of
+squares per month and category); `merge` adds the partials up and
+`summarize` turns them into totals, means and standard deviations.
+
+Workers are spawned (not forked, the parent runs background threads) once
+and reused; they only import this module, not db_utils.
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+
+PARTIAL_COLUMNS = ["month", "category", "total", "count", "sum_sq"]
+
+_SHARD_SQL = """
+    SELECT month, category, SUM(amount), COUNT(*), SUM(amount * amount)
+    FROM expenses
+    WHERE ledger_id = :ledger_id AND deleted_at IS NULL AND month >= :first_month AND month <= :last_month
+    GROUP BY month, category
+"""
+
+_engine = None      # worker process engine
+_executor = None
+_executor_key = None
+_executor_lock = threading.Lock()
+
+
+def plan_shards(month_counts, n_shards):
+    """Split sorted (month, row count) pairs into at most n_shards contiguous
+    (first_month, last_month) ranges of roughly equal row counts"""
+    month_counts = [(m, c) for m, c in month_counts if c > 0]
+    if not month_counts:
+        return []
+    total = sum(c for _, c in month_counts)
+    target = total / max(1, n_shards)
+    shards = []
+    first, rows = None, 0
+    for month, count in month_counts:
+        first = first or month
+        rows += count
+        if rows >= target * (len(shards) + 1) and len(shards) < n_shards - 1:
+            shards.append((first, month))
+            first = None
+    if first:
+        shards.append((first, month_counts[-1][0]))
+    return shards
+
+
+def aggregate_shard(conn, ledger_id, first_month, last_month):
+    """(month, category, sum, count, sum of squares) rows for one shard"""
+    if conn.dialect.name == "postgresql":
+        # Row-level security (db_utils.enable_row_level_security) filters on this setting
+        conn.execute(text("SELECT set_config('app.ledger_id', :ledger_id, true)"), {"ledger_id": ledger_id})
+    rows = conn.execute(text(_SHARD_SQL), {"ledger_id": ledger_id, "first_month": first_month,
+                                           "last_month": last_month})
+    return [tuple(r) for r in rows]
+
+
+def run_sharded(db_url, ledger_id, shards, workers):
+    """Aggregate every shard on the process pool; returns one partial list per shard"""
+    executor = _pool(db_url, workers)
+    futures = [executor.submit(_aggregate_in_worker, ledger_id, first, last) for first, last in shards]
+    try:
+        return [f.result() for f in futures]
+    except BrokenProcessPool:
+        _discard_pool(executor)
+        raise
+
+
+def merge(partials):
+    """Add up partial rows from all shards into one DataFrame of PARTIAL_COLUMNS"""
+    merged = {}
+    for rows in partials:
+        for month, category, total, count, sum_sq in rows:
+            key = (month, category)
+            if key in merged:
+                t, c, s = merged[key]
+                merged[key] = (t + (total or 0.0), c + count, s + (sum_sq or 0.0))
+            else:
+                merged[key] = (total or 0.0, count, sum_sq or 0.0)
+    keys = sorted(merged, key=lambda k: (k[0] or "", k[1] or ""))
+    return pd.DataFrame([k + merged[k] for k in keys], columns=PARTIAL_COLUMNS)
+
+
+def summarize(partials, by):
+    """Group merged partials by column(s) `by` into total, count, mean and std (sample, like pandas)"""
+    grouped = partials.groupby(by, as_index=False)[["total", "count", "sum_sq"]].sum()
+    count = grouped["count"].to_numpy(dtype=np.float64)
+    total = grouped["total"].to_numpy(dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grouped["mean"] = total / count
+        var = (grouped["sum_sq"].to_numpy(dtype=np.float64) - total * total / count) / (count - 1)
+    grouped["std"] = np.where(count > 1, np.sqrt(np.maximum(var, 0.0)), np.nan)
+    return grouped.drop(columns="sum_sq")
+
+
+def _pool(db_url, workers):
+    global _executor, _executor_key
+    with _executor_lock:
+        if _executor_key != (db_url, workers):
+            if _executor:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(db_url,))
+            _executor_key = (db_url, workers)
+        return _executor
+
+
+def _discard_pool(executor):
+    """Forget a broken pool so the next call starts a fresh one"""
+    global _executor, _executor_key
+    with _executor_lock:
+        if _executor is executor:
+            _executor, _executor_key = None, None
+    executor.shutdown(wait=False)
+
+
+def _init_worker(db_url):
+    global _engine
+    _engine = create_engine(db_url)
+
+
+def _aggregate_in_worker(ledger_id, first_month, last_month):
+    with _engine.connect() as conn:
+        return aggregate_shard(conn, ledger_id, first_month, last_month)
@@ -0,0 +1,89 @@
+"""Lightweight read model for expenses.
+
+`ExpenseRow` carries the attributes pages read from `Expense` in a __slots__
+record, without SQLAlchemy instance state or a per-row __dict__.
+`ExpenseColumns` holds the same rows as typed NumPy columns (int32 date
+ordinals, int16/int32 category, month and tag codes, float64 amounts) and
+turns into a DataFrame that reuses those arrays. `ExpenseIndex` summarizes
+which months and categories exist, for page selectors.
+"""
+import datetime
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+# Sorted months and categories that have expenses, and the first/last expense date (None if there are none)
+ExpenseIndex = namedtuple("ExpenseIndex", ["months", "categories", "first_date", "last_date"])
+
+
+class ExpenseRow:
+    """Read-only view of one expense row"""
+    __slots__ = ("id", "ledger_id", "date", "month", "category", "tag", "amount")
+
+    def __init__(self, id, ledger_id, date, month, category, tag, amount):
+        self.id = id
+        self.ledger_id = ledger_id
+        self.date = date
+        self.month = month
+        self.category = category
+        self.tag = tag
+        self.amount = amount
+
+    def __repr__(self):
+        return f"ExpenseRow(id={self.id}, date={self.date}, category={self.category!r}, amount={self.amount})"
+
+
+def _encode(values, n):
+    """Dictionary-encode values into (codes, sorted labels); None becomes code -1"""
+    index = {}
+    codes = np.fromiter((-1 if v is None else index.setdefault(v, len(index)) for v in values), np.int32, n)
+    labels = sorted(index)
+    # Renumber so codes follow label order, like grouping by the plain strings would
+    rank = np.empty(len(labels) + 1, dtype=np.int32)
+    rank[[index[label] for label in labels]] = np.arange(len(labels))
+    rank[-1] = -1
+    codes = rank[codes]
+    return (codes.astype(np.int16) if len(labels) < 2 ** 15 else codes), labels
+
+
+class ExpenseColumns:
+    """Expenses as parallel NumPy columns; ids of not-yet-written (queued) rows are -1"""
+    __slots__ = ("ids", "dates", "month_codes", "months", "category_codes", "categories",
+                 "tag_codes", "tags", "amounts")
+
+    @classmethod
+    def from_rows(cls, rows):
+        n = len(rows)
+        self = cls()
+        self.ids = np.fromiter((-1 if r.id is None else r.id for r in rows), np.int64, n)
+        self.dates = np.fromiter((r.date.toordinal() - _EPOCH_ORDINAL for r in rows), np.int32, n)
+        self.month_codes, self.months = _encode((r.month for r in rows), n)
+        self.category_codes, self.categories = _encode((r.category for r in rows), n)
+        self.tag_codes, self.tags = _encode((r.tag or "" for r in rows), n)
+        self.amounts = np.fromiter((r.amount or 0.0 for r in rows), np.float64, n)
+        return self
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self):
+        """Memory held by the arrays (labels excluded)"""
+        return sum(getattr(self, name).nbytes for name in
+                   ("ids", "dates", "month_codes", "category_codes", "tag_codes", "amounts"))
+
+    def to_frame(self):
+        """DataFrame with id, date, month, category, tag and amount columns.
+
+        id and amount share memory with the arrays; month, category and tag are
+        Categoricals over the code arrays; date is converted to datetime64.
+        """
+        return pd.DataFrame({
+            "id": self.ids,
+            "date": self.dates.astype("datetime64[D]").astype("datetime64[s]"),
+            "month": pd.Categorical.from_codes(self.month_codes, self.months),
+            "category": pd.Categorical.from_codes(self.category_codes, self.categories),
+            "tag": pd.Categorical.from_codes(self.tag_codes, self.tags),
+            "amount": self.amounts,
+        }, copy=False)
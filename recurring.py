@@ -0,0 +1,86 @@
+"""Recurring expense schedules.
+
+A rule repeats an expense every month, week or year. Each occurrence is
+identified by (rule id, period) where period is "YYYY-MM", "YYYY-Www" or
+"YYYY"; `db_utils.materialize_recurring` inserts every due occurrence that
+isn't in the expenses table yet in one batch, so running it repeatedly (at
+app start, from cron, ...) is safe.
+
+Command line:
+    python recurring.py [--through YYYY-MM-DD]
+"""
+import argparse
+import calendar
+import datetime
+
+CADENCES = ["monthly", "weekly", "yearly"]
+
+
+def occurrence_date(cadence, day, start_date, period):
+    """Date of the occurrence for `period`.
+
+    `day` is the day of the month for monthly rules (clamped to the month's
+    length) and the weekday (0=Monday) for weekly rules; yearly rules repeat
+    on the month/day of `start_date`.
+    """
+    if cadence == "monthly":
+        year, month = (int(p) for p in period.split("-"))
+        return datetime.date(year, month, min(day, calendar.monthrange(year, month)[1]))
+    if cadence == "weekly":
+        year, week = period.split("-W")
+        return datetime.date.fromisocalendar(int(year), int(week), day % 7 + 1)
+    if cadence == "yearly":
+        year = int(period)
+        return datetime.date(year, start_date.month,
+                             min(start_date.day, calendar.monthrange(year, start_date.month)[1]))
+    raise ValueError(f"Unknown cadence: {cadence}")
+
+
+def due_occurrences(cadence, day, start_date, end_date, after, through):
+    """(period, date) pairs for occurrences in (after, through], bounded by the
+    rule's start and end dates. `after` may be None to start from the beginning."""
+    first = max(start_date, after + datetime.timedelta(days=1)) if after else start_date
+    last = min(end_date, through) if end_date else through
+    occurrences = []
+    for period in _periods(cadence, first, last):
+        date = occurrence_date(cadence, day, start_date, period)
+        if first <= date <= last:
+            occurrences.append((period, date))
+    return occurrences
+
+
+def _periods(cadence, first, last):
+    """Period keys touching the date range first..last"""
+    if first > last:
+        return
+    if cadence == "monthly":
+        year, month = first.year, first.month
+        while (year, month) <= (last.year, last.month):
+            yield f"{year:04d}-{month:02d}"
+            year, month = (year, month + 1) if month < 12 else (year + 1, 1)
+    elif cadence == "weekly":
+        d = first - datetime.timedelta(days=first.weekday())
+        while d <= last:
+            iso_year, iso_week, _ = d.isocalendar()
+            yield f"{iso_year:04d}-W{iso_week:02d}"
+            d += datetime.timedelta(days=7)
+    elif cadence == "yearly":
+        for year in range(first.year, last.year + 1):
+            yield f"{year:04d}"
+    else:
+        raise ValueError(f"Unknown cadence: {cadence}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialize due recurring expenses")
+    parser.add_argument("--through", type=datetime.date.fromisoformat, default=datetime.date.today(),
+                        help="materialize occurrences up to this date (default: today)")
+    args = parser.parse_args()
+
+    from db_utils import materialize_recurring
+    added = materialize_recurring(args.through)
+    print(f"Materialized {added} recurring expense(s) through {args.through}")
+
+
+if __name__ == "__main__":
+    main()
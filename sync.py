@@ -0,0 +1,288 @@
+"""Offline-first sync between the embedded SQLite database and the shared one.
+
+With LOCAL_DB_PATH set, db_utils reads and writes a local SQLite file (WAL
+mode) and DB_URL names the shared database. A background thread (`start`)
+runs `sync_once` every SYNC_INTERVAL_SECONDS and right after local writes:
+
+* push: local change_log entries past the `pushed_log_id` watermark are
+  replayed on the shared database,
+* pull: shared change_log entries past the `pulled_log_id` watermark, except
+  the ones this client pushed, are replayed locally.
+
+Replays go through the same db_utils helpers as ordinary writes, so rollups,
+stats, data versions and change events stay right on both sides; their
+change_log entries carry a `source` so they are never sent back. Expenses are
+matched by uid and balances are copied as whole rows, so replaying a batch
+twice (after a crash between the two commits) does no harm.
+
+A balance edited on both sides between two syncs is a conflict: the write
+with the later updated_at wins on both databases and both versions are kept
+in sync_conflicts for review. A copied balance never replaces a newer one
+written on the other side while the sync ran; that is recorded as a
+conflict too. The first sync copies over the live expenses
+and balances each side is missing. Recurring rules and budgets are not
+synced; synced copies of materialized expenses are plain expenses.
+
+Command line (one sync, e.g. from cron):
+    python sync.py
+"""
+import datetime
+import json
+import logging
+import threading
+import uuid
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+import change_feed
+
+BATCH_SIZE = 1000
+PULLED = "remote"   # change_log.source of local entries pulled from the shared database
+
+logger = logging.getLogger(__name__)
+
+_remote_engine = None
+_sync_lock = threading.Lock()
+_wake = threading.Event()
+_thread = None
+
+
+def start(interval):
+    """Start the background sync thread (safe to call repeatedly)"""
+    global _thread
+    with _sync_lock:
+        if _thread is None:
+            change_feed.subscribe(_on_change)
+            _thread = threading.Thread(target=_run, args=(interval,), name="offline-sync", daemon=True)
+            _thread.start()
+
+
+def sync_once():
+    """Push local changes, then pull remote ones; returns the (pushed, pulled) change counts"""
+    import db_utils
+    with _sync_lock:
+        local = db_utils.SessionLocal()
+        remote = sessionmaker(bind=_remote(db_utils))()
+        try:
+            if _get_state(db_utils, local, "client_id") is None:
+                return _bootstrap(db_utils, local, remote)
+            pushed = pulled = 0
+            more = True
+            while more:
+                n_pushed, n_pulled, more = _sync_batch(db_utils, local, remote)
+                pushed += n_pushed
+                pulled += n_pulled
+            return pushed, pulled
+        finally:
+            remote.close()
+            local.close()
+
+
+def _run(interval):
+    while True:
+        _wake.wait(interval)
+        _wake.clear()
+        try:
+            sync_once()
+        except Exception as e:
+            logger.warning("sync with the shared database failed (%s); retrying", e)
+
+
+def _on_change(event):
+    # Local writes trigger a sync; the sync thread's own replays don't
+    if threading.current_thread() is not _thread:
+        _wake.set()
+
+
+def _remote(db):
+    global _remote_engine
+    if _remote_engine is None:
+        engine = create_engine(db.SYNC_DB_URL, pool_pre_ping=True)
+        db.migrate(engine)
+        _remote_engine = engine
+    return _remote_engine
+
+
+def _get_state(db, session, key):
+    row = session.get(db.SyncState, key)
+    return row.value if row else None
+
+
+def _set_state(db, session, key, value):
+    session.merge(db.SyncState(key=key, value=str(value)))
+
+
+def _sync_batch(db, local, remote):
+    """Sync up to BATCH_SIZE change_log entries each way; returns (pushed, pulled, more to do)"""
+    client_id = _get_state(db, local, "client_id")
+    pushed_mark = int(_get_state(db, local, "pushed_log_id"))
+    pulled_mark = int(_get_state(db, local, "pulled_log_id"))
+    outgoing = local.query(db.ChangeLog).filter(db.ChangeLog.id > pushed_mark) \
+        .order_by(db.ChangeLog.id).limit(BATCH_SIZE).all()
+    incoming = remote.query(db.ChangeLog).filter(db.ChangeLog.id > pulled_mark) \
+        .order_by(db.ChangeLog.id).limit(BATCH_SIZE).all()
+    more = len(outgoing) == BATCH_SIZE or len(incoming) == BATCH_SIZE
+    if outgoing:
+        pushed_mark = outgoing[-1].id
+    if incoming:
+        pulled_mark = incoming[-1].id
+    outgoing = [c for c in outgoing if c.source is None]
+    incoming = [c for c in incoming if c.source != client_id]
+
+    push_balances = {(c.ledger_id, c.month) for c in outgoing if c.table_name == "balances"}
+    pull_balances = {(c.ledger_id, c.month) for c in incoming if c.table_name == "balances"}
+    for key in push_balances & pull_balances:
+        kept = _record_conflict(db, local, key, _balance(db, local, key), _balance(db, remote, key))
+        (pull_balances if kept == "local" else push_balances).discard(key)
+
+    token = db._log_source.set(client_id)
+    try:
+        _replay(db, remote, local, outgoing, push_balances, local)
+        remote.commit()
+    finally:
+        db._log_source.reset(token)
+    _set_state(db, local, "pushed_log_id", pushed_mark)
+    local.commit()
+
+    token = db._log_source.set(PULLED)
+    try:
+        _replay(db, local, remote, incoming, pull_balances, local)
+        _set_state(db, local, "pulled_log_id", pulled_mark)
+        local.commit()
+    finally:
+        db._log_source.reset(token)
+    return len(outgoing), len(incoming), more
+
+
+def _replay(db, target, source, changes, balance_keys, local):
+    """Apply logged expense inserts and deletes to target, and copy the balances
+    of balance_keys over from source (conflicts are recorded in the local session)"""
+    inserts = []
+    for change in changes:
+        data = json.loads(change.data) if change.data else {}
+        if change.table_name != "expenses" or not data.get("uid"):
+            continue  # balances are copied below; entries logged before uids existed can't be matched
+        if change.op == "insert":
+            inserts.append(_copy_expense(db, change.ledger_id, change.month, data))
+        elif change.op == "delete":
+            _insert_missing(db, target, inserts)
+            inserts = []
+            expense = target.query(db.Expense).filter_by(uid=data["uid"]) \
+                .filter(db.Expense.deleted_at.is_(None)).first()
+            if expense:
+                db._soft_delete_expense(target, expense)
+    _insert_missing(db, target, inserts)
+    oldest = datetime.datetime.min
+    for key in sorted(balance_keys):
+        bal = _balance(db, source, key)
+        if not bal:
+            continue
+        # A write that committed on the target since the batch was read (an add_balance
+        # during the sync) is newer than the copy: keep it and record the conflict
+        current = target.query(db.Balance).filter_by(ledger_id=key[0], month=key[1]).with_for_update().first()
+        if current and (current.updated_at or oldest) > (bal.updated_at or oldest):
+            _record_conflict(db, local, key, *((current, bal) if target is local else (bal, current)))
+            continue
+        db._upsert_balance(target, key[0], key[1], bal.prev_balance, bal.this_month, bal.updated_at)
+
+
+def _copy_expense(db, ledger_id, month, data):
+    return db.Expense(ledger_id=ledger_id, uid=data["uid"], date=datetime.date.fromisoformat(data["date"]),
+                      month=month, category=data["category"], tag=data["tag"], amount=data["amount"])
+
+
+def _insert_missing(db, session, expenses):
+    """Insert the expenses whose uid the session's database doesn't have yet"""
+    if not expenses:
+        return
+    known = {uid for uid, in session.query(db.Expense.uid).filter(db.Expense.uid.in_([e.uid for e in expenses]))}
+    new = []
+    for e in expenses:
+        if e.uid not in known:
+            known.add(e.uid)
+            new.append(e)
+    if new:
+        session.add_all(new)
+        session.flush()
+        db._apply_new_expenses(session, new)
+
+
+def _balance(db, session, key):
+    return session.query(db.Balance).filter_by(ledger_id=key[0], month=key[1]).first()
+
+
+def _record_conflict(db, local, key, local_bal, remote_bal):
+    """Log a balance edited on both sides; returns which one is kept (the later write)"""
+    oldest = datetime.datetime.min
+    kept = "local" if (local_bal.updated_at or oldest) > (remote_bal.updated_at or oldest) else "remote"
+    local.add(db.SyncConflict(ledger_id=key[0], month=key[1], local_data=json.dumps(_balance_json(db, local_bal)),
+                              remote_data=json.dumps(_balance_json(db, remote_bal)), kept=kept,
+                              detected_at=datetime.datetime.now()))
+    return kept
+
+
+def _balance_json(db, bal):
+    return dict(db._balance_row(bal), updated_at=bal.updated_at.isoformat() if bal.updated_at else None)
+
+
+def _bootstrap(db, local, remote):
+    """First sync: copy the live expenses and balances each side is missing, then start
+    both watermarks at the current end of the change logs"""
+    client_id = uuid.uuid4().hex
+    local_mark = local.query(func.max(db.ChangeLog.id)).scalar() or 0
+    remote_mark = remote.query(func.max(db.ChangeLog.id)).scalar() or 0
+
+    local_bals = {(b.ledger_id, b.month): b for b in local.query(db.Balance)}
+    remote_bals = {(b.ledger_id, b.month): b for b in remote.query(db.Balance)}
+    push_balances = set(local_bals) - set(remote_bals)
+    pull_balances = set(remote_bals) - set(local_bals)
+    for key in set(local_bals) & set(remote_bals):
+        l, r = local_bals[key], remote_bals[key]
+        if (l.prev_balance, l.this_month) != (r.prev_balance, r.this_month):
+            kept = _record_conflict(db, local, key, l, r)
+            (push_balances if kept == "local" else pull_balances).add(key)
+
+    token = db._log_source.set(client_id)
+    try:
+        pushed = _copy_missing_expenses(db, local, remote)
+        _replay(db, remote, local, [], push_balances, local)
+        remote.commit()
+    finally:
+        db._log_source.reset(token)
+
+    token = db._log_source.set(PULLED)
+    try:
+        pulled = _copy_missing_expenses(db, remote, local)
+        _replay(db, local, remote, [], pull_balances, local)
+        _set_state(db, local, "pushed_log_id", local_mark)
+        _set_state(db, local, "pulled_log_id", remote_mark)
+        _set_state(db, local, "client_id", client_id)
+        local.commit()
+    finally:
+        db._log_source.reset(token)
+    return pushed + len(push_balances), pulled + len(pull_balances)
+
+
+def _copy_missing_expenses(db, source, target):
+    """Insert into target the live expenses of source it has no uid for; returns how many"""
+    known = {uid for uid, in target.query(db.Expense.uid)}
+    copies = [db.Expense(ledger_id=e.ledger_id, uid=e.uid, date=e.date, month=e.month, category=e.category,
+                         tag=e.tag, amount=e.amount)
+              for e in source.query(db.Expense).filter(db.Expense.deleted_at.is_(None)) if e.uid not in known]
+    for i in range(0, len(copies), BATCH_SIZE):
+        batch = copies[i:i + BATCH_SIZE]
+        target.add_all(batch)
+        target.flush()
+        db._apply_new_expenses(target, batch)
+    return len(copies)
+
+
+def main():
+    import db_utils
+    if not db_utils.SYNC_DB_URL:
+        raise SystemExit("Offline-first sync needs LOCAL_DB_PATH (the local file) and DB_URL (the shared database)")
+    pushed, pulled = sync_once()
+    print(f"Pushed {pushed} and pulled {pulled} change(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""Write-behind queue for expense inserts.
+
+`submit` returns immediately; a background thread collects submitted rows
+into micro-batches once they reach `max_rows` or the oldest is `max_seconds`
+old, and hands each ledger's rows of a batch to `flush_fn` (one multi-row
+INSERT, in its own transaction). Rows stay visible through `pending` until
+they have committed.
+
+On interpreter exit the queue is flushed. If the database can't be reached
+then, rows are appended to a JSON-lines spill file and replayed by the next
+queue that starts with the same spill path. A hard kill can still lose the
+rows of the current micro-batch.
+"""
+import atexit
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from read_model import ExpenseRow
+
+logger = logging.getLogger(__name__)
+
+
+class PendingExpense(ExpenseRow):
+    """Queued expense, read like any other expense row (id is None until written)"""
+    __slots__ = ()
+
+    def __init__(self, ledger_id, date, month, category, tag, amount):
+        super().__init__(None, ledger_id, date, month, category, tag, amount)
+
+    def as_row(self):
+        return {"ledger_id": self.ledger_id, "date": self.date, "month": self.month,
+                "category": self.category, "tag": self.tag, "amount": self.amount}
+
+
+class ExpenseWriteQueue:
+    def __init__(self, flush_fn, max_rows=500, max_seconds=0.5, spill_path=None):
+        self._flush_fn = flush_fn
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.spill_path = spill_path
+        self._queued = []       # waiting for the next batch
+        self._in_flight = []    # batch being written
+        self._oldest = None     # monotonic time of the oldest queued row
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._replay_spill()
+        self._thread = threading.Thread(target=self._run, name="expense-write-behind", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, ledger_id, date, month, category, tag, amount):
+        """Queue an expense; returns the PendingExpense that stands in for it until written"""
+        row = PendingExpense(ledger_id, date, month, category, tag, amount)
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("write queue is closed")
+            self._queued.append(row)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            if len(self._queued) >= self.max_rows:
+                self._cond.notify()
+        return row
+
+    def pending(self, ledger_id, month=None, category=None):
+        """Expenses submitted but not yet committed, optionally filtered"""
+        with self._cond:
+            rows = self._in_flight + self._queued
+        return [r for r in rows if r.ledger_id == ledger_id
+                and (month is None or r.month == month)
+                and (category is None or r.category == category)]
+
+    def flush(self):
+        """Write everything queued so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._queued, self._oldest = self._queued, [], None
+                self._in_flight = batch
+            if not batch:
+                return 0
+            for ledger_id, rows in _by_ledger(batch).items():
+                try:
+                    self._flush_fn([r.as_row() for r in rows])
+                except Exception:
+                    # Put the unwritten rows back in front so they are retried with the next flush
+                    with self._cond:
+                        self._queued = self._in_flight + self._queued
+                        self._oldest = self._oldest or time.monotonic()
+                        self._in_flight = []
+                    raise
+                with self._cond:
+                    self._in_flight = [r for r in self._in_flight if r.ledger_id != ledger_id]
+            return len(batch)
+
+    def close(self):
+        """Stop the background thread and flush (or spill) whatever is left"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout=self.max_seconds + 5)
+        try:
+            self.flush()
+        except Exception:
+            logger.exception("final write-behind flush failed")
+            self._spill()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    timeout = None if self._oldest is None else \
+                        max(0.0, self._oldest + self.max_seconds - time.monotonic())
+                    self._cond.wait(timeout)
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("write-behind flush failed; retrying")
+                time.sleep(self.max_seconds)
+
+    def _due(self):
+        return bool(self._queued) and (len(self._queued) >= self.max_rows or
+                                       time.monotonic() - self._oldest >= self.max_seconds)
+
+    def _spill(self):
+        with self._cond:
+            rows, self._queued = self._queued, []
+        if not rows:
+            return
+        if not self.spill_path:
+            logger.error("dropping %d unwritten expenses (no spill path configured)", len(rows))
+            return
+        with open(self.spill_path, "a") as f:
+            for r in rows:
+                f.write(json.dumps(dict(r.as_row(), date=r.date.isoformat())) + "\n")
+        logger.warning("spilled %d unwritten expenses to %s", len(rows), self.spill_path)
+
+    def _replay_spill(self):
+        if not self.spill_path or not os.path.exists(self.spill_path):
+            return
+        with open(self.spill_path) as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+        for row in rows:
+            row["date"] = datetime.date.fromisoformat(row["date"])
+        unwritten = list(rows)
+        for ledger_id, ledger_rows in _by_ledger(rows).items():
+            try:
+                self._flush_fn(ledger_rows)
+            except Exception:
+                logger.exception("could not replay %s; keeping it for the next start", self.spill_path)
+                # Keep only the rows of ledgers that weren't written
+                with open(self.spill_path, "w") as f:
+                    for row in unwritten:
+                        f.write(json.dumps(dict(row, date=row["date"].isoformat())) + "\n")
+                return
+            unwritten = [row for row in unwritten if row["ledger_id"] != ledger_id]
+        logger.info("replayed %d spilled expenses from %s", len(rows), self.spill_path)
+        os.remove(self.spill_path)
+
+
+def _by_ledger(rows):
+    """Group queued rows (PendingExpense or row dicts) by ledger, keeping their order"""
+    groups = {}
+    for row in rows:
+        ledger_id = row["ledger_id"] if isinstance(row, dict) else row.ledger_id
+        groups.setdefault(ledger_id, []).append(row)
+    return groups